@@ -0,0 +1,68 @@
+"""add task search
+
+Revision ID: 5d2e7a1c9b40
+Revises: 3b1f0c9d7e21
+Create Date: 2026-10-18 15:02:37.418205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2e7a1c9b40'
+down_revision: Union[str, None] = '3b1f0c9d7e21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 10000
+
+SEARCH_VECTOR = ("setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+                 "setweight(to_tsvector('simple', coalesce(description, '')), 'B')")
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.add_column('tasks', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+    # The trigger goes in first, so rows written during the backfill are already covered.
+    op.execute("""
+        CREATE OR REPLACE FUNCTION tasks_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector :=
+                setweight(to_tsvector('simple', coalesce(NEW.title, '')), 'A') ||
+                setweight(to_tsvector('simple', coalesce(NEW.description, '')), 'B');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER tasks_search_vector_update BEFORE INSERT OR UPDATE OF title, description ON tasks
+        FOR EACH ROW EXECUTE FUNCTION tasks_search_vector_update()
+    """)
+
+    # Backfill by id ranges, committing each batch, so no long transaction holds row locks on tasks.
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        low, high = bind.execute(sa.text('SELECT min(id), max(id) FROM tasks')).one()
+        if low is not None:
+            for start in range(low, high + 1, BATCH_SIZE):
+                bind.execute(
+                    sa.text(f'UPDATE tasks SET search_vector = {SEARCH_VECTOR} '
+                            'WHERE id >= :start AND id < :stop AND search_vector IS NULL'),
+                    {'start': start, 'stop': start + BATCH_SIZE},
+                )
+        op.create_index('ix_tasks_search_vector', 'tasks', ['search_vector'],
+                        postgresql_using='gin', postgresql_concurrently=True)
+        op.create_index('ix_tasks_title_trgm', 'tasks', ['title'], postgresql_using='gin',
+                        postgresql_ops={'title': 'gin_trgm_ops'}, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tasks_title_trgm', table_name='tasks')
+    op.drop_index('ix_tasks_search_vector', table_name='tasks')
+    op.execute('DROP TRIGGER IF EXISTS tasks_search_vector_update ON tasks')
+    op.execute('DROP FUNCTION IF EXISTS tasks_search_vector_update()')
+    op.drop_column('tasks', 'search_vector')
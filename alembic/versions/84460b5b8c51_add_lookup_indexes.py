@@ -0,0 +1,48 @@
+"""add lookup indexes
+
+Revision ID: 84460b5b8c51
+Revises: f03b7dc8a6f4
+Create Date: 2026-10-18 12:04:11.532817
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '84460b5b8c51'
+down_revision: Union[str, None] = 'f03b7dc8a6f4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Before the unique index can be built, existing duplicates must go.
+    op.execute(
+        'DELETE FROM task_tags a USING task_tags b '
+        'WHERE a.task_id = b.task_id AND a.tag_id = b.tag_id AND a.id > b.id'
+    )
+    # CONCURRENTLY cannot run inside a transaction, so that tasks stays writable while the indexes build.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_tasks_created_at_id', 'tasks', ['created_at', 'id'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_tasks_project_id_created_at_id', 'tasks', ['project_id', 'created_at', 'id'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_tasks_my_day_date_undone', 'tasks', ['my_day_date'],
+                        postgresql_where=sa.text('NOT done'), postgresql_concurrently=True)
+        op.create_index('uq_task_tags_task_id_tag_id', 'task_tags', ['task_id', 'tag_id'],
+                        unique=True, postgresql_concurrently=True)
+        op.create_index('ix_task_tags_tag_id_task_id', 'task_tags', ['tag_id', 'task_id'],
+                        postgresql_concurrently=True)
+    op.execute('ALTER TABLE task_tags ADD CONSTRAINT uq_task_tags_task_id_tag_id '
+               'UNIQUE USING INDEX uq_task_tags_task_id_tag_id')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_task_tags_tag_id_task_id', table_name='task_tags')
+    op.drop_constraint('uq_task_tags_task_id_tag_id', 'task_tags', type_='unique')
+    op.drop_index('ix_tasks_my_day_date_undone', table_name='tasks')
+    op.drop_index('ix_tasks_project_id_created_at_id', table_name='tasks')
+    op.drop_index('ix_tasks_created_at_id', table_name='tasks')
@@ -0,0 +1,41 @@
+"""fix reminders
+
+Revision ID: 8c4e1f2a7d63
+Revises: 5d2e7a1c9b40
+Create Date: 2026-10-18 17:41:09.512734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c4e1f2a7d63'
+down_revision: Union[str, None] = '5d2e7a1c9b40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The initial migration created reminders without task_id, so existing rows cannot be delivered to anyone.
+    op.execute('DELETE FROM reminders')
+    op.add_column('reminders', sa.Column('task_id', sa.Integer(), nullable=False))
+    op.add_column('reminders', sa.Column('claimed_until', sa.DateTime(), nullable=True))
+    op.add_column('reminders', sa.Column('sent_at', sa.DateTime(), nullable=True))
+    op.alter_column('reminders', 'remind_at', existing_type=sa.DateTime(), nullable=False)
+    op.create_foreign_key('reminders_task_id_fkey', 'reminders', 'tasks', ['task_id'], ['id'], ondelete='CASCADE')
+    op.create_index('ix_reminders_task_id', 'reminders', ['task_id'])
+    op.create_index('ix_reminders_pending_remind_at', 'reminders', ['remind_at'],
+                    postgresql_where=sa.text('sent_at IS NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_reminders_pending_remind_at', table_name='reminders')
+    op.drop_index('ix_reminders_task_id', table_name='reminders')
+    op.drop_constraint('reminders_task_id_fkey', 'reminders', type_='foreignkey')
+    op.alter_column('reminders', 'remind_at', existing_type=sa.DateTime(), nullable=True)
+    op.drop_column('reminders', 'sent_at')
+    op.drop_column('reminders', 'claimed_until')
+    op.drop_column('reminders', 'task_id')
@@ -0,0 +1,80 @@
+"""
+Статика интерфейса из памяти процесса.
+
+Файлы читаются при старте, сразу сжимаются gzip и brotli с максимальной степенью и отдаются без
+обращения к диску, с сильным ETag на каждый вариант кодировки. С DEBUG файл перечитывается,
+если изменился на диске
+"""
+import hashlib
+import mimetypes
+import os
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.compression import ENCODINGS, choose_encoding, compress
+from app.config import DEBUG, ASSET_CACHE_CONTROL
+from app.helpers import etag_matches
+
+
+class Asset:
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime_ns
+        with open(path, 'rb') as f:
+            body = f.read()
+        media_type, _ = mimetypes.guess_type(path)
+        media_type = media_type or 'application/octet-stream'
+        if media_type.startswith('text/') or media_type in ('application/javascript', 'application/json'):
+            media_type += '; charset=utf-8'
+        self.media_type = media_type
+        digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+        # Вариант None - без сжатия; сжатый хранится, только если он меньше исходного
+        self.bodies: dict[str | None, bytes] = {None: body}
+        for encoding in ENCODINGS:
+            compressed = compress(body, encoding, best=True)
+            if len(compressed) < len(body):
+                self.bodies[encoding] = compressed
+        self.etags = {encoding: f'"{digest}-{encoding}"' if encoding else f'"{digest}"' for encoding in self.bodies}
+
+    @property
+    def encodings(self) -> tuple[str, ...]:
+        return tuple(encoding for encoding in ENCODINGS if encoding in self.bodies)
+
+
+class AssetStore:
+    def __init__(self, cache_control: str = ASSET_CACHE_CONTROL, auto_reload: bool = DEBUG):
+        self.cache_control = cache_control
+        self.auto_reload = auto_reload
+        self.assets: dict[str, Asset] = {}
+
+    def add(self, url: str, path: str):
+        self.assets[url] = Asset(path)
+
+    def add_directory(self, directory: str, prefix: str):
+        for root, _, names in os.walk(directory):
+            for name in names:
+                path = os.path.join(root, name)
+                self.add(prefix + os.path.relpath(path, directory).replace(os.sep, '/'), path)
+
+    def get(self, url: str) -> Asset | None:
+        asset = self.assets.get(url)
+        if asset is not None and self.auto_reload and os.stat(asset.path).st_mtime_ns != asset.mtime:
+            asset = self.assets[url] = Asset(asset.path)
+        return asset
+
+    def response(self, request: Request, url: str) -> Response | None:
+        asset = self.get(url)
+        if asset is None:
+            return None
+        encoding = choose_encoding(request.headers.get('accept-encoding'), asset.encodings)
+        headers = {'ETag': asset.etags[encoding], 'Cache-Control': self.cache_control, 'Vary': 'Accept-Encoding'}
+        if etag_matches(request, asset.etags[encoding]):
+            return Response(status_code=304, headers=headers)
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+        headers['Content-Type'] = asset.media_type
+        return Response(asset.bodies[encoding], headers=headers)
+
+
+assets = AssetStore()
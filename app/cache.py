@@ -0,0 +1,250 @@
+import asyncio
+import inspect
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Hashable, Callable, Awaitable
+
+from pydantic import BaseModel
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.config import CACHE_ENABLED, CACHE_MAX_SIZE, CACHE_TTL, SINGLE_FLIGHT_ENABLED
+
+MISSING = object()
+INVALIDATE_ON_COMMIT = 'cache_invalidate_on_commit'
+CALLBACKS_ON_COMMIT = 'callbacks_on_commit'
+WRITES_ON_COMMIT = 'writes_on_commit'
+
+
+class TTLCache:
+    """
+    LRU-кэш с ограничением по числу записей и времени их жизни.
+    Кэш свой у каждого процесса: изменения из других воркеров станут видны не позже чем через ttl секунд.
+    generation растет при каждом сбросе: set с поколением, прочитанным до похода в базу,
+    не запишет значение, если за это время что-то сбросили
+    """
+    def __init__(self, maxsize: int, ttl: float, enabled: bool = True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = enabled
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Any:
+        if not self.enabled:
+            return MISSING
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return MISSING
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, generation: int | None = None):
+        if not self.enabled or (generation is not None and generation != self.generation):
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *keys: Hashable):
+        if keys:
+            self.generation += 1
+        for key in keys:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        self.generation += 1
+        self._data.clear()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
+
+
+class SingleFlight:
+    """
+    Объединяет одинаковые одновременные вызовы: первый (ведущий) выполняет вызов сам, остальные ждут
+    его результат. Ошибка достается всем, кто ждал, и не запоминается: следующий вызов начнет заново.
+    Отмена ведущего отменяет и вызов, тогда ждавшие его повторяют вызов сами
+    """
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._flights: dict[Hashable, asyncio.Future] = {}
+        self.started = 0
+        self.shared = 0
+        self.cancelled = 0
+
+    def _discard(self, key: Hashable, flight: asyncio.Future):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        while True:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = asyncio.ensure_future(call())
+                flight.add_done_callback(lambda done: self._discard(key, done))
+                self.started += 1
+                try:
+                    return await flight
+                except asyncio.CancelledError:
+                    self.cancelled += 1
+                    raise
+            self.shared += 1
+            try:
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                # Отменили ведущего, а не нас
+                if flight.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+
+    def forget(self):
+        """
+        Новые вызовы больше не присоединяются к начатым: те могли прочитать данные до последнего коммита
+        """
+        self._flights.clear()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'in_flight': len(self._flights),
+            'started': self.started,
+            'shared': self.shared,
+            'cancelled': self.cancelled,
+        }
+
+
+repository_cache = TTLCache(CACHE_MAX_SIZE, CACHE_TTL, enabled=CACHE_ENABLED)
+flights = SingleFlight(enabled=SINGLE_FLIGHT_ENABLED)
+
+
+def copy_value(value: Any) -> Any:
+    if isinstance(value, list):
+        return [copy_value(item) for item in value]
+    if isinstance(value, BaseModel):
+        return value.model_copy()
+    return value
+
+
+def cached(name: str):
+    """
+    Кэширует результат метода Repository по имени и значениям аргументов. Аргументы сопоставляются
+    с сигнатурой, так что get_project(1) и get_project(id=1) попадают в один ключ (name, 1).
+    Вызывающий получает копию, так что изменения результата не портят кэш.
+    Промах, во время которого кэш сбрасывали, не кэшируется: он мог прочитать данные до коммита.
+    Не кэшируется и чтение репозитория, который писал в своей транзакции и видит незафиксированное
+    """
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            key = (name, *(freeze(value) for value in list(bound.arguments.values())[1:]))
+            value = repository_cache.get(key)
+            if value is MISSING:
+                generation = repository_cache.generation
+                value = await method(self, *args, **kwargs)
+                if self.session is None or not self.session.info.get(WRITES_ON_COMMIT):
+                    repository_cache.set(key, value, generation)
+            return copy_value(value)
+
+        return wrapper
+
+    return decorator
+
+
+def freeze(value: Any) -> Hashable:
+    if isinstance(value, BaseModel):
+        return type(value).__name__, freeze(value.model_dump())
+    if isinstance(value, dict):
+        return tuple((key, freeze(item)) for key, item in sorted(value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def single_flight(name: str):
+    """
+    Одинаковые одновременные вызовы метода Repository в процессе делят один поход в базу.
+    Ведущий читает в своей сессии, так что чтение не берет из пула второе соединение на запрос,
+    остальные получают копию его результата. Репозиторий, который уже писал в своей транзакции,
+    читает сам, потому что должен видеть свои незафиксированные изменения
+    """
+    def decorator(method):
+        @wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            if not flights.enabled or (self.session is not None and self.session.info.get(WRITES_ON_COMMIT)):
+                return await method(self, *args, **kwargs)
+            key = (name, freeze(args), freeze(kwargs))
+            return copy_value(await flights.do(key, lambda: method(self, *args, **kwargs)))
+
+        return wrapper
+
+    return decorator
+
+
+def invalidate(session: Session, *keys: Hashable):
+    """
+    Сбрасывает ключи сразу и еще раз после фиксации транзакции сессии,
+    чтобы конкурентное чтение до коммита не оставило в кэше старое значение
+    """
+    repository_cache.invalidate(*keys)
+    session.info.setdefault(INVALIDATE_ON_COMMIT, set()).update(keys)
+
+
+def on_commit(session: Session, callback: Callable[[], Any]):
+    """
+    Откладывает обновление внутрипроцессных структур до фиксации транзакции, при откате callback забывается
+    """
+    session.info.setdefault(CALLBACKS_ON_COMMIT, []).append(callback)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def mark_writes(state):
+    if not state.is_select:
+        state.session.info[WRITES_ON_COMMIT] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_after_commit(session: Session):
+    if session.info.pop(WRITES_ON_COMMIT, False):
+        flights.forget()
+    repository_cache.invalidate(*session.info.pop(INVALIDATE_ON_COMMIT, ()))
+    for callback in session.info.pop(CALLBACKS_ON_COMMIT, ()):
+        callback()
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_invalidations(session: Session):
+    session.info.pop(WRITES_ON_COMMIT, None)
+    session.info.pop(INVALIDATE_ON_COMMIT, None)
+    session.info.pop(CALLBACKS_ON_COMMIT, None)
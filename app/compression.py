@@ -0,0 +1,114 @@
+"""
+Сжатие ответов brotli (br) и gzip.
+
+CompressionMiddleware сжимает готовые JSON и HTML ответы больше COMPRESSION_MIN_SIZE байт.
+Потоковые ответы (страницы, которые рендерятся по мере чтения из базы, экспорт, SSE) идут как есть:
+чтобы сжать их целиком, пришлось бы дождаться конца потока, а клиент ждет первые байты сразу
+"""
+import gzip
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+from app.config import COMPRESSION_ENABLED, COMPRESSION_MIN_SIZE, COMPRESSION_GZIP_LEVEL, COMPRESSION_BROTLI_QUALITY
+
+# В порядке предпочтения сервера
+ENCODINGS = ('br', 'gzip')
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/html')
+
+
+def accepted_encodings(header: str) -> dict[str, float]:
+    """
+    Кодировки из Accept-Encoding с их q
+    """
+    accepted = {}
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def choose_encoding(header: str | None, available: tuple[str, ...] = ENCODINGS) -> str | None:
+    """
+    Лучшая из доступных кодировок, которую принимает клиент, или None - отдавать как есть
+    """
+    if not header:
+        return None
+    accepted = accepted_encodings(header)
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body: bytes, encoding: str, best: bool = False) -> bytes:
+    """
+    best - максимальное сжатие для данных, которые сжимаются один раз, например статики при загрузке
+    """
+    if encoding == 'br':
+        return brotli.compress(body, quality=11 if best else COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=9 if best else COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE, enabled: bool = COMPRESSION_ENABLED):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.enabled = enabled
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or not self.enabled:
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get('accept-encoding'))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Message | None = None
+        passthrough = False
+
+        async def send_wrapper(message: Message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message['type'] == 'http.response.start':
+                start = message
+                headers = Headers(raw=message['headers'])
+                media_type = headers.get('content-type', '').split(';')[0].strip()
+                if 'content-encoding' in headers or media_type not in COMPRESSIBLE_TYPES:
+                    passthrough = True
+                    await send(start)
+                return
+            # Первый кусок тела: если за ним будут еще, это поток, и он идет без сжатия
+            passthrough = True
+            body = message.get('body', b'')
+            if message.get('more_body', False) or len(body) < self.minimum_size:
+                await send(start)
+                await send(message)
+                return
+            body = compress(body, encoding)
+            headers = MutableHeaders(raw=start['headers'])
+            headers['Content-Encoding'] = encoding
+            headers['Content-Length'] = str(len(body))
+            headers.add_vary_header('Accept-Encoding')
+            await send(start)
+            await send({'type': 'http.response.body', 'body': body})
+
+        await self.app(scope, receive, send_wrapper)
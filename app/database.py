@@ -1,8 +1,20 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import declarative_base, sessionmaker
 
-from app.config import DATABASE_URL
+from app.config import DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, \
+    DB_POOL_PRE_PING, DB_STATEMENT_CACHE_SIZE
+from app.metrics import instrument_engine
+from app.pool import InstrumentedPool, pool_monitor
 
-engine = create_async_engine(DATABASE_URL)
+engine = create_async_engine(DATABASE_URL,
+                             poolclass=InstrumentedPool,
+                             pool_size=DB_POOL_SIZE,
+                             max_overflow=DB_MAX_OVERFLOW,
+                             pool_timeout=DB_POOL_TIMEOUT,
+                             pool_recycle=DB_POOL_RECYCLE,
+                             pool_pre_ping=DB_POOL_PRE_PING,
+                             connect_args={'prepared_statement_cache_size': DB_STATEMENT_CACHE_SIZE})
+pool_monitor.attach(engine.sync_engine)
+instrument_engine(engine.sync_engine)
 Base = declarative_base()
 async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)  # type: ignore
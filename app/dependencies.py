@@ -1,6 +1,16 @@
-from fastapi import HTTPException
+import logging
+from typing import Annotated
 
+from fastapi import HTTPException, Query, Depends
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+from app.config import PAGE_SIZE, MAX_PAGE_SIZE, REPOSITORY_BACKEND
 from app.database import async_session
+from app.helpers import decode_cursor, decode_rank_cursor
+
+logger = logging.getLogger(__name__)
 
 
 async def has_query_params(q: str | None = None):
@@ -8,7 +18,98 @@ async def has_query_params(q: str | None = None):
         raise HTTPException(status_code=400, detail='Invalid query')
 
 
-def get_repository():
+async def get_repository(request: Request):
+    """
+    Репозиторий, привязанный к одной сессии на весь запрос: одно соединение из пула и одна транзакция.
+    Фиксирует ее UnitOfWorkMiddleware до отправки статуса ответа, так что ошибка коммита доходит
+    до клиента, а клиент, получивший ответ, сразу видит свою запись. Ответы с ошибкой и исключения
+    откатывают транзакцию при закрытии сессии.
+    С REPOSITORY_BACKEND=memory отдает общий репозиторий в памяти процесса
+    """
+    if REPOSITORY_BACKEND == 'memory':
+        from app.tasks.memory import memory_repository
+
+        yield memory_repository
+        return
+
+    from app.tasks.use_cases import Repository
+
+    async with async_session() as session:
+        request.state.db_session = session
+        yield Repository(async_session, session)
+
+
+class UnitOfWorkMiddleware:
+    """
+    Фиксирует транзакцию сессии запроса (см. get_repository) перед http.response.start.
+    Зависимости с yield в FastAPI закрываются уже после отправки ответа, поэтому коммит там
+    опоздал бы: клиент получил бы 200 даже при неудачной фиксации
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        state = scope.setdefault('state', {})
+        failed = False
+
+        async def send_wrapper(message: Message):
+            nonlocal failed
+            if failed:
+                return
+            if message['type'] == 'http.response.start':
+                session = state.pop('db_session', None)
+                if session is not None and message['status'] < 400:
+                    try:
+                        await session.commit()
+                    except Exception:
+                        logger.exception('failed to commit request transaction')
+                        failed = True
+                        await PlainTextResponse('Internal Server Error', status_code=500)(scope, receive, send)
+                        return
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+async def get_task_writer(rep=Depends(get_repository)):
+    """
+    Для частых мелких записей: склеивающий их WriteBatcher, если он запущен, иначе репозиторий запроса.
+    Сессия запроса открывает соединение только при первом запросе к базе, так что пока вызов ждет
+    своей пачки, соединение из пула он не держит
+    """
+    from app.tasks.batching import write_batcher
+
+    return write_batcher if write_batcher.rep is not None else rep
+
+
+def background_repository():
+    """
+    Репозиторий для фоновых задач вне запроса: каждый метод открывает свою сессию
+    """
+    if REPOSITORY_BACKEND == 'memory':
+        from app.tasks.memory import memory_repository
+
+        return memory_repository
+
     from app.tasks.use_cases import Repository
 
     return Repository(async_session)
+
+
+async def get_page_params(limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = PAGE_SIZE,
+                          cursor: str | None = None):
+    from app.tasks.serializers import PageParams
+
+    after = decode_cursor(cursor) if cursor is not None else None
+    return PageParams(limit=limit, after=after)
+
+
+async def get_search_page_params(limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = PAGE_SIZE,
+                                 cursor: str | None = None):
+    from app.tasks.serializers import SearchPageParams
+
+    after = decode_rank_cursor(cursor) if cursor is not None else None
+    return SearchPageParams(limit=limit, after=after)
@@ -0,0 +1,207 @@
+"""
+События об изменениях задач, проектов и тегов для подписчиков SSE.
+
+Repository складывает события в сессию, перед коммитом они уходят одним NOTIFY на транзакцию,
+и Postgres доставляет их только если транзакция зафиксирована. Каждый воркер держит одно
+отдельное от пула соединение с LISTEN и раздает события своим подписчикам через ограниченные
+очереди. Подписчик, который не успевает читать, отключается, а не копит события в памяти
+"""
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterator
+
+from sqlalchemy import event, text, make_url
+from sqlalchemy.orm import Session
+
+from app.config import EVENTS_CHANNEL, EVENTS_QUEUE_SIZE, EVENTS_HEALTH_INTERVAL, EVENTS_KEEPALIVE, \
+    REPOSITORY_BACKEND, DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+EVENTS_ON_COMMIT = 'events_on_commit'
+
+# Postgres ограничивает payload NOTIFY 8000 байтами
+MAX_PAYLOAD_BYTES = 7900
+
+NOTIFY = text("SELECT pg_notify(:channel, json_build_object("
+              "'revision', change_revision(), "
+              "'events', CAST(:events AS json))::text)")
+
+
+def notify(session: Session, table: str, op: str, ids: list[int] | None = None):
+    """
+    Добавляет событие к транзакции сессии. op - upsert, delete или reload, если затронутых строк
+    слишком много или они неизвестны (каскадное удаление): тогда клиенту стоит перечитать таблицу
+    """
+    session.info.setdefault(EVENTS_ON_COMMIT, []).append({'table': table, 'op': op, 'ids': ids})
+
+
+def merge_events(events: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """
+    Склеивает события одной таблицы и операции, id без повторов
+    """
+    merged: dict[tuple[str, str], dict[int, None] | None] = {}
+    for item in events:
+        key = (item['table'], item['op'])
+        if item['ids'] is None:
+            merged[key] = None
+        elif merged.setdefault(key, {}) is not None:
+            merged[key].update(dict.fromkeys(item['ids']))
+    return [{'table': table, 'op': op, 'ids': None if ids is None else list(ids)}
+            for (table, op), ids in merged.items()]
+
+
+def encode_events(events: list[dict[str, Any]]) -> str:
+    """
+    Payload для NOTIFY; если id не влезают в ограничение Postgres, события таблиц заменяются на reload
+    """
+    merged = merge_events(events)
+    payload = json.dumps(merged)
+    if len(payload.encode('utf-8')) > MAX_PAYLOAD_BYTES:
+        tables = dict.fromkeys(item['table'] for item in merged)
+        payload = json.dumps([{'table': table, 'op': 'reload', 'ids': None} for table in tables])
+    return payload
+
+
+@event.listens_for(Session, 'before_commit')
+def notify_before_commit(session: Session):
+    events = session.info.pop(EVENTS_ON_COMMIT, None)
+    if events:
+        session.execute(NOTIFY, {'channel': EVENTS_CHANNEL, 'events': encode_events(events)})
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_events(session: Session):
+    session.info.pop(EVENTS_ON_COMMIT, None)
+
+
+def format_sse(message: dict[str, Any]) -> str:
+    lines = [f'event: {message["table"]}']
+    if message['revision'] is not None:
+        lines.append(f'id: {message["revision"]}')
+    lines.append(f'data: {json.dumps(message)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+class Subscription:
+    def __init__(self, tables: set[str] | None, size: int):
+        self.tables = tables
+        self.queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue(maxsize=size)
+        self.dropped = False
+
+
+class ChangeBroadcaster:
+    """
+    Раздает события подписчикам воркера. С dsn слушает канал Postgres через собственное соединение
+    asyncpg, которое открывается при первой подписке и переподключается при обрыве.
+    Без dsn (репозиторий в памяти) события публикуются напрямую через publish
+    """
+    def __init__(self, dsn: str | None, channel: str = EVENTS_CHANNEL, queue_size: int = EVENTS_QUEUE_SIZE):
+        self.dsn = dsn
+        self.channel = channel
+        self.queue_size = queue_size
+        self.subscribers: set[Subscription] = set()
+        self.dropped = 0
+        self.listening = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def subscribe(self, tables: set[str] | None = None) -> Subscription:
+        if self.dsn is not None and self._task is None:
+            self._task = asyncio.create_task(self._listen())
+        subscription = Subscription(tables, self.queue_size)
+        self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscribers.discard(subscription)
+
+    def publish(self, revision: int | None, events: list[dict[str, Any]]):
+        for item in events:
+            message = {'revision': revision, **item}
+            for subscription in list(self.subscribers):
+                if subscription.tables is not None and item['table'] not in subscription.tables:
+                    continue
+                try:
+                    subscription.queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    subscription.dropped = True
+                    self.subscribers.discard(subscription)
+                    self.dropped += 1
+
+    def _on_notify(self, connection, pid: int, channel: str, payload: str):
+        try:
+            message = json.loads(payload)
+            self.publish(message['revision'], message['events'])
+        except (ValueError, KeyError, TypeError):
+            logger.warning('malformed change notification: %s', payload)
+
+    async def _listen(self):
+        """
+        Работает до close: любая ошибка, не только обрыв соединения, логируется,
+        и LISTEN открывается заново с растущей паузой, чтобы подписчики не остались без событий
+        """
+        import asyncpg
+
+        dsn = make_url(self.dsn).set(drivername='postgresql').render_as_string(hide_password=False)
+        delay, connected_before = 1, False
+        while True:
+            try:
+                connection = await asyncpg.connect(dsn)
+            except Exception:
+                logger.exception('failed to connect for LISTEN %s, retrying in %d s', self.channel, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+                continue
+            pause = 0
+            try:
+                await connection.add_listener(self.channel, self._on_notify)
+                self.listening.set()
+                delay = 1
+                if connected_before:
+                    # Пока соединения не было, уведомления терялись
+                    self.publish(None, [{'table': table, 'op': 'reload', 'ids': None}
+                                        for table in ('projects', 'tags', 'tasks')])
+                connected_before = True
+                while True:
+                    await asyncio.sleep(EVENTS_HEALTH_INTERVAL)
+                    await connection.execute('SELECT 1')
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                logger.warning('LISTEN connection lost, reconnecting')
+            except Exception:
+                logger.exception('LISTEN %s failed, reconnecting in %d s', self.channel, delay)
+                pause, delay = delay, min(delay * 2, 30)
+            finally:
+                self.listening.clear()
+                connection.terminate()
+            if pause:
+                await asyncio.sleep(pause)
+
+    async def stream(self, tables: set[str] | None = None, keepalive: float = EVENTS_KEEPALIVE) -> AsyncIterator[str]:
+        """
+        Поток SSE для одного клиента. Пока событий нет, раз в keepalive секунд уходит комментарий,
+        чтобы прокси не закрыли соединение. Отключенный за медленное чтение клиент получает
+        оставшиеся в очереди события и overflow, после чего ему стоит догнать изменения через /tasks/changes
+        """
+        subscription = self.subscribe(tables)
+        try:
+            while True:
+                if subscription.dropped and subscription.queue.empty():
+                    yield 'event: overflow\ndata: {}\n\n'
+                    return
+                try:
+                    message = await asyncio.wait_for(subscription.queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield format_sse(message)
+        finally:
+            self.unsubscribe(subscription)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+broadcaster = ChangeBroadcaster(None if REPOSITORY_BACKEND == 'memory' else DATABASE_URL)
@@ -1,68 +1,235 @@
+import base64
+import binascii
+import datetime
+import hashlib
 import json
 from functools import wraps
-from typing import Any, TypeVar, Generic, Mapping
+from typing import Any, TypeVar, Generic, Optional, AsyncIterator, Callable, get_type_hints, get_origin, get_args
 
+from fastapi import HTTPException
 from pydantic import ConfigDict, BaseModel
 from starlette.requests import Request
-from starlette.responses import Response
+from starlette.responses import Response, StreamingResponse
 
-from app.config import templates
+from app.rendering import renderer
 
 
 T = TypeVar('T')
 
+JSON = 'json'
+HTMX = 'htmx'
+PAGE = 'page'
 
-class ResponseWithHeaders(BaseModel, Generic[T]):
+
+class Envelope(BaseModel, Generic[T]):
     data: T
-    headers: Mapping[str, str]
+
+
+class PageEnvelope(Envelope[T], Generic[T]):
+    next_cursor: Optional[str] = None
+
+
+class Page(BaseModel, Generic[T]):
+    items: list[T]
+    next_cursor: Optional[str] = None
+
+
+class Paged(BaseModel, Generic[T]):
+    """
+    Объект с вложенным списком, который отдается постранично: next_cursor уходит в конверт рядом с data
+    """
+    item: T
+    next_cursor: Optional[str] = None
+
+
+class PageStream(Generic[T]):
+    """
+    Страница, строки которой еще читаются из базы пачками.
+    Полная HTML-страница рендерится потоком, для JSON и HTMX пачки собираются в обычную Page
+    """
+    def __init__(self, chunks: AsyncIterator[list[T]], to_page: Callable[[list[T]], Page[T]]):
+        self.chunks = chunks
+        self.to_page = to_page
+
+    async def collect(self) -> Page[T]:
+        items = []
+        async for chunk in self.chunks:
+            items.extend(chunk)
+        return self.to_page(items)
 
 
 class ModelConfig:
     model_config = ConfigDict(from_attributes=True)
 
 
-def pass_headers(func):
+def to_local_naive(value: datetime.datetime) -> datetime.datetime:
+    """
+    Колонки времени хранят его без зоны, в локальном времени сервера, как created_at из datetime.now:
+    время с зоной переводится в локальное и теряет зону
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+
+def pack_cursor(values: list) -> str:
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def unpack_cursor(cursor: str, size: int = 2) -> list:
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    values = json.loads(raw)
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError(cursor)
+    return values
+
+
+def encode_cursor(created_at: datetime.datetime, id_: int) -> str:
+    """
+    Упаковывает ключ последней записи страницы (created_at, id) в непрозрачный курсор
+    """
+    return pack_cursor([created_at.isoformat(), id_])
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    """
+    Распаковывает курсор, выданный encode_cursor
+    """
+    try:
+        created_at, id_ = unpack_cursor(cursor)
+        return datetime.datetime.fromisoformat(created_at), int(id_)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+
+
+def encode_rank_cursor(rank: float, id_: int) -> str:
+    """
+    Курсор страницы результатов поиска: релевантность и id последней записи
+    """
+    return pack_cursor([rank, id_])
+
+
+def decode_rank_cursor(cursor: str) -> tuple[float, int]:
+    try:
+        rank, id_ = unpack_cursor(cursor)
+        return float(rank), int(id_)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+
+
+def encode_change_cursor(revision: int, source: int, id_: int) -> str:
+    """
+    Курсор ленты изменений: ревизия, номер таблицы в порядке ленты и id последней записи
+    """
+    return pack_cursor([revision, source, id_])
+
+
+def decode_change_cursor(cursor: str) -> tuple[int, int, int]:
+    try:
+        revision, source, id_ = unpack_cursor(cursor, size=3)
+        return int(revision), int(source), int(id_)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+
+
+def negotiate(request: Request, template_name: str | None) -> str:
     """
-    Добавляет заголовки в Response для использования в renderer-ах
+    Выбирает формат ответа по заголовкам до сериализации: HTMX-фрагмент, JSON или полная страница
     """
-    @wraps(func)
-    async def wrapper(*args, **kwargs):
-        data = await func(*args, **kwargs)
-        headers = kwargs['request'].headers
-        return ResponseWithHeaders(data=data, headers=headers)
+    if template_name is None:
+        return JSON
+    if 'hx-request' in request.headers:
+        return HTMX
+    accept = request.headers.get('accept', '')
+    if 'application/json' in accept or 'text/html' not in accept:
+        return JSON
+    return PAGE
 
-    return wrapper
 
+def envelope_type(annotation: Any) -> type[Envelope]:
+    if get_origin(annotation) is PageStream:
+        return PageEnvelope[list[get_args(annotation)[0]]]
+    if isinstance(annotation, type) and issubclass(annotation, Page):
+        return PageEnvelope[annotation.model_fields['items'].annotation]
+    if isinstance(annotation, type) and issubclass(annotation, Paged):
+        return PageEnvelope[annotation.model_fields['item'].annotation]
+    return Envelope[annotation]
 
-def get_response_class(template_name: str) -> type[Response]:
+
+def render(template_name: str | None = None):
     """
-    Создает объект response_class в зависимости от заголовков
+    Оборачивает результат маршрута в {"data": ...} и сразу отдает байты:
+    JSON сериализуется pydantic-ом напрямую из моделей, HTML рендерится из шаблона.
+    PageStream для полной страницы рендерится потоком
     """
-    class HTMXOrJSONResponse(Response):
-        media_type = 'application/json'
+    def decorator(func):
+        envelope_class = envelope_type(get_type_hints(func).get('return', Any))
 
-        def render(self, content: Any) -> bytes:
-            headers = content.get('headers', {})
-            if 'headers' in content:
-                del content['headers']
-            if 'hx-request' in headers:
-                self.media_type = 'text/html'
-                htmx_body = templates.TemplateResponse(template_name, {'request': None, 'content': content}).body
-                return htmx_body
-            elif 'application/json' in headers.get('accept'):
-                self.media_type = 'application/json'
-                json_body = json.dumps(
-                    content,
-                    ensure_ascii=False,
-                    allow_nan=False,
-                    indent=None,
-                    separators=(',', ':'),
-                ).encode('utf-8')
-                return json_body
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            data = await func(*args, **kwargs)
+            media = negotiate(kwargs['request'], template_name)
+            if isinstance(data, PageStream):
+                if media == PAGE:
+                    return StreamingResponse(renderer.stream(template_name, data.chunks, full_page=True),
+                                             media_type='text/html')
+                data = await data.collect()
+            if isinstance(data, Page):
+                envelope = envelope_class.model_construct(data=data.items, next_cursor=data.next_cursor)
+            elif isinstance(data, Paged):
+                envelope = envelope_class.model_construct(data=data.item, next_cursor=data.next_cursor)
             else:
-                self.media_type = 'text/html'
-                html_body = templates.TemplateResponse(template_name,
-                                                       {'request': None, 'content': content, 'full_page': True}).body
-                return html_body
+                envelope = envelope_class.model_construct(data=data)
+            if media == JSON:
+                return Response(envelope.model_dump_json(), media_type='application/json')
+            body = renderer.render(template_name, envelope.__dict__, full_page=media == PAGE)
+            return Response(body, media_type='text/html')
+
+        return wrapper
+
+    return decorator
+
+
+def make_etag(request: Request, versions: dict[str, int]) -> str:
+    """
+    Слабый валидатор из версий таблиц, адреса запроса и варианта ответа (JSON, HTMX или страница)
+    """
+    key = '|'.join([
+        request.url.path,
+        request.url.query,
+        request.headers.get('accept', ''),
+        'hx' if 'hx-request' in request.headers else '',
+        *(f'{table}={version}' for table, version in sorted(versions.items())),
+    ])
+    return f'W/"{hashlib.blake2b(key.encode("utf-8"), digest_size=12).hexdigest()}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is None:
+        return False
+    candidates = {candidate.strip() for candidate in if_none_match.split(',')}
+    return '*' in candidates or etag in candidates or etag.removeprefix('W/') in candidates
+
+
+def conditional(*tables: str):
+    """
+    Отвечает 304 Not Modified, если версии таблиц не изменились с прошлого ответа клиенту.
+    Ставится поверх render, маршрут должен принимать request и rep
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            versions = await kwargs['rep'].get_versions(tables)
+            etag = make_etag(kwargs['request'], versions)
+            headers = {'ETag': etag, 'Vary': 'Accept, HX-Request'}
+            if etag_matches(kwargs['request'], etag):
+                return Response(status_code=304, headers=headers)
+            response = await func(*args, **kwargs)
+            response.headers.update(headers)
+            return response
+
+        return wrapper
 
-    return HTMXOrJSONResponse
+    return decorator
@@ -1,26 +1,146 @@
+import asyncio
+import logging
+import os
+
 import uvicorn
-from fastapi import FastAPI
-from starlette.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, PlainTextResponse
+
+from app import users, tasks, system
+from app.assets import assets
+from app.compression import CompressionMiddleware
+from app.config import DEBUG, WORKERS_COUNT, REPOSITORY_BACKEND, REMINDERS_ENABLED, WRITE_BATCH_ENABLED, \
+    TEMPLATES_DIR, STATIC_DIR
+from app.dependencies import background_repository, UnitOfWorkMiddleware
+from app.events import broadcaster
+from app.metrics import MetricsMiddleware, registry as metrics
+from app.querylog import QueryLogMiddleware
+from app.rendering import renderer, PAGE_TEMPLATES
+from app.tasks.autocomplete import tag_index
+from app.tasks.batching import write_batcher
+from app.tasks.reminders import reminder_dispatcher
+from app.tasks.stats import task_stats
 
-from app import users, tasks
-from app.config import DEBUG, WORKERS_COUNT
-from app.helpers import get_response_class
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
+app.add_middleware(UnitOfWorkMiddleware)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(QueryLogMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 
 app.include_router(tasks.router.router)
 app.include_router(users.router.router)
+app.include_router(system.router.router)
+
+
+@app.on_event('startup')
+async def preload_templates():
+    renderer.preload(*PAGE_TEMPLATES)
+
+
+@app.on_event('startup')
+async def load_assets():
+    assets.add('/', os.path.join(TEMPLATES_DIR, 'index.html'))
+    if os.path.isdir(STATIC_DIR):
+        assets.add_directory(STATIC_DIR, '/static/')
+
+
+@app.on_event('startup')
+async def start_metrics_flush():
+    if metrics.enabled:
+        app.state.metrics_flush = asyncio.create_task(metrics.flush_periodically())
+
+
+@app.on_event('shutdown')
+async def flush_metrics():
+    if metrics.enabled:
+        app.state.metrics_flush.cancel()
+        metrics.flush()
+
+
+@app.on_event('startup')
+async def load_tag_index():
+    rep = background_repository()
+    try:
+        await tag_index.refresh(rep)
+    except Exception:
+        # Без базы сервис все равно стартует, индекс загрузится при первом запросе автодополнения
+        logger.exception('failed to load tag index')
+    app.state.tag_index_refresh = asyncio.create_task(tag_index.refresh_periodically(rep))
+
+
+@app.on_event('shutdown')
+async def stop_tag_index_refresh():
+    app.state.tag_index_refresh.cancel()
+
+
+@app.on_event('startup')
+async def start_stats_reconcile():
+    app.state.stats_reconcile = asyncio.create_task(task_stats.reconcile_periodically(background_repository()))
+
+
+@app.on_event('shutdown')
+async def stop_stats_reconcile():
+    app.state.stats_reconcile.cancel()
+
+
+@app.on_event('startup')
+async def start_reminder_dispatcher():
+    if REMINDERS_ENABLED:
+        reminder_dispatcher.start(background_repository())
+
+
+@app.on_event('shutdown')
+async def stop_reminder_dispatcher():
+    await reminder_dispatcher.stop(background_repository())
+
+
+@app.on_event('startup')
+async def start_write_batcher():
+    if WRITE_BATCH_ENABLED:
+        write_batcher.start(background_repository())
+
+
+@app.on_event('shutdown')
+async def stop_write_batcher():
+    await write_batcher.stop()
+
+
+@app.on_event('shutdown')
+async def close_broadcaster():
+    await broadcaster.close()
+
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def get_metrics():
+    metrics.flush()
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
 
 
 @app.get('/', response_class=HTMLResponse)
-async def index():
-    with open('templates/index.html', 'r') as f:
-        return f.read()
+async def index(request: Request):
+    response = assets.response(request, '/')
+    if response is None:
+        raise HTTPException(status_code=404)
+    return response
+
+
+@app.get('/static/{path:path}')
+async def static_asset(request: Request, path: str):
+    response = assets.response(request, f'/static/{path}')
+    if response is None:
+        raise HTTPException(status_code=404)
+    return response
 
 
 if __name__ == '__main__':
+    metrics.clear_directory()
     if DEBUG:
         uvicorn.run('main:app', host='0.0.0.0', port=8000, reload=True)
     else:
-        uvicorn.run('main:app', host='0.0.0.0', port=8000, workers=WORKERS_COUNT)
+        # Данные репозитория в памяти не разделяются между процессами
+        workers = 1 if REPOSITORY_BACKEND == 'memory' else WORKERS_COUNT
+        uvicorn.run('main:app', host='0.0.0.0', port=8000, workers=workers)
@@ -0,0 +1,133 @@
+import threading
+import time
+from typing import Any
+
+from sqlalchemy import event, exc, util
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool, QueuePool
+
+from app.config import WORKERS_COUNT, DB_SLOW_CHECKOUT
+
+
+class PoolMonitor:
+    """
+    Счетчики пула соединений и кэшей запросов одного процесса.
+    Каждый воркер держит свой пул, поэтому в базу может уйти до WORKERS_COUNT * (pool_size + max_overflow) соединений
+    """
+    def __init__(self, slow_checkout: float):
+        self.slow_checkout = slow_checkout
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.slow_checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.compiled_hits = 0
+        self.compiled_misses = 0
+        self.prepared_hits = 0
+        self.prepared_misses = 0
+
+    def record_checkout(self, wait: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            if wait >= self.slow_checkout:
+                self.slow_checkouts += 1
+
+    def record_compiled(self, hit: bool):
+        if hit:
+            self.compiled_hits += 1
+        else:
+            self.compiled_misses += 1
+
+    def record_prepared(self, hit: bool):
+        if hit:
+            self.prepared_hits += 1
+        else:
+            self.prepared_misses += 1
+
+    def attach(self, engine: Engine):
+        """
+        Подписывается на события движка: попадания в кэш скомпилированных запросов SQLAlchemy
+        и в кэш подготовленных выражений asyncpg на каждом новом соединении
+        """
+        @event.listens_for(engine, 'after_cursor_execute')
+        def count_compiled(conn, cursor, statement, parameters, context, executemany):
+            if context is not None and context.cache_hit in (CACHE_HIT, CACHE_MISS):
+                self.record_compiled(context.cache_hit == CACHE_HIT)
+
+        @event.listens_for(engine, 'connect')
+        def count_prepared(dbapi_connection, connection_record):
+            cache = getattr(dbapi_connection, '_prepared_statement_cache', None)
+            if isinstance(cache, util.LRUCache):
+                dbapi_connection._prepared_statement_cache = CountingLRUCache(self, cache.capacity, cache.threshold)
+
+    def stats(self, pool: Pool) -> dict[str, Any]:
+        result: dict[str, Any] = {'pool': pool.__class__.__name__, 'workers': WORKERS_COUNT}
+        if isinstance(pool, QueuePool):
+            result.update({
+                'size': pool.size(),
+                'max_overflow': pool._max_overflow,
+                'timeout': pool.timeout(),
+                'checked_out': pool.checkedout(),
+                'idle': pool.checkedin(),
+                'overflow': max(pool.overflow(), 0),
+                'max_connections_per_worker': pool.size() + pool._max_overflow,
+                'max_connections_total': WORKERS_COUNT * (pool.size() + pool._max_overflow),
+            })
+        result.update({
+            'checkouts': self.checkouts,
+            'slow_checkouts': self.slow_checkouts,
+            'slow_checkout_threshold': self.slow_checkout,
+            'timeouts': self.timeouts,
+            'wait_avg': self.wait_total / self.checkouts if self.checkouts else 0.0,
+            'wait_max': self.wait_max,
+            'compiled_cache': hit_rate(self.compiled_hits, self.compiled_misses),
+            'prepared_statement_cache': hit_rate(self.prepared_hits, self.prepared_misses),
+        })
+        return result
+
+
+def hit_rate(hits: int, misses: int) -> dict[str, Any]:
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else None}
+
+
+class CountingLRUCache(util.LRUCache):
+    """
+    Кэш подготовленных выражений соединения asyncpg, который считает попадания
+    """
+    def __init__(self, monitor: PoolMonitor, capacity: int, threshold: float):
+        super().__init__(capacity, threshold)
+        self.monitor = monitor
+
+    def __contains__(self, key) -> bool:
+        found = super().__contains__(key)
+        self.monitor.record_prepared(found)
+        return found
+
+
+pool_monitor = PoolMonitor(DB_SLOW_CHECKOUT)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """
+    Пул, который замеряет ожидание свободного соединения
+    """
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_monitor.record_checkout(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_monitor.record_checkout(time.perf_counter() - start)
+        return connection
@@ -0,0 +1,117 @@
+"""
+Учет SQL-запросов в пределах одного HTTP-запроса: бюджет на число запросов, лог медленных выражений
+и поиск N+1 - одинаковых выражений, повторенных много раз за запрос.
+Хуки висят на классе Engine, так что видят любой движок, включая тестовые
+"""
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Scope, Receive, Send
+
+from app.config import QUERY_LOG_ENABLED, SLOW_QUERY_THRESHOLD, QUERY_BUDGET, N_PLUS_ONE_THRESHOLD
+
+logger = logging.getLogger('app.queries')
+
+
+class QueryCounter:
+    def __init__(self, scope: Scope | None = None):
+        self.scope = scope
+        self.count = 0
+        self.duration = 0.0
+        self.statements: Counter[str] = Counter()
+
+    @property
+    def route(self) -> str:
+        if self.scope is None:
+            return '-'
+        route = self.scope.get('route')
+        return f"{self.scope['method']} {route.path if route is not None else self.scope['path']}"
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> list[tuple[str, int]]:
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+
+# Вложенные счетчики: запрос в middleware, assert_max_queries внутри теста и т.п.
+active_counters: ContextVar[tuple[QueryCounter, ...]] = ContextVar('active_counters', default=())
+
+
+@contextmanager
+def count_queries(scope: Scope | None = None) -> Iterator[QueryCounter]:
+    counter = QueryCounter(scope)
+    token = active_counters.set(active_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        active_counters.reset(token)
+
+
+@contextmanager
+def assert_max_queries(limit: int) -> Iterator[QueryCounter]:
+    """
+    Тестовый помощник: падает, если внутри блока ушло больше limit SQL-выражений
+    """
+    with count_queries() as counter:
+        yield counter
+    statements = '\n'.join(f'{count} x {statement}' for statement, count in counter.statements.most_common())
+    assert counter.count <= limit, f'{counter.count} queries, expected at most {limit}:\n{statements}'
+
+
+def report(counter: QueryCounter):
+    if counter.count > QUERY_BUDGET:
+        logger.warning('%s: %d queries exceed budget of %d (%.1f ms in database)',
+                       counter.route, counter.count, QUERY_BUDGET, counter.duration * 1000)
+    for statement, count in counter.repeated():
+        logger.warning('%s: possible N+1, statement ran %d times: %s', counter.route, count, statement)
+
+
+class QueryLogMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or not QUERY_LOG_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        with count_queries(scope) as counter:
+            await self.app(scope, receive, send)
+        report(counter)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('querylog_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['querylog_start'].pop()
+    counters = active_counters.get()
+    for counter in counters:
+        counter.record(statement, duration)
+    if duration >= SLOW_QUERY_THRESHOLD and QUERY_LOG_ENABLED:
+        route = counters[0].route if counters else '-'
+        logger.warning('%s: slow query %.1f ms: %s; parameters: %s',
+                       route, duration * 1000, statement, format_parameters(parameters))
+
+
+@event.listens_for(Engine, 'handle_error')
+def drop_timer(context):
+    starts = context.connection.info.get('querylog_start') if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def format_parameters(parameters: Any, limit: int = 500) -> str:
+    text = repr(parameters)
+    return text if len(text) <= limit else f'{text[:limit]}...'
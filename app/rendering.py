@@ -0,0 +1,105 @@
+from typing import Any, AsyncIterator
+
+from jinja2 import Environment, FileSystemLoader, Template
+from markupsafe import Markup
+
+from app.cache import TTLCache, MISSING
+from app.config import DEBUG, TEMPLATES_DIR, FRAGMENT_CACHE_SIZE
+
+PAGE_TEMPLATES = ('base.html', 'task_list.html', 'project_list.html')
+
+# Шаблон списка -> шаблон одной строки и имя переменной строки в нем
+ROW_TEMPLATES = {
+    'task_list.html': ('task_row.html', 'task'),
+    'project_list.html': ('project_row.html', 'project'),
+}
+
+# Пустой фрагмент в выводе шаблона: отправить клиенту все, что накоплено
+FLUSH = Markup('')
+
+
+class TemplateRenderer:
+    """
+    Держит скомпилированные шаблоны и рендерит их сразу в байты.
+    Строки списков кэшируются по id и ревизии строки: ревизия - id транзакции, которая последней
+    меняла строку, так что у зафиксированной строки с той же парой то же содержимое, и при повторном
+    рендере заново собираются только изменившиеся задачи и проекты. Строки без ревизии не кэшируются
+    """
+    def __init__(self, directory: str, fragment_cache_size: int):
+        self.env = Environment(loader=FileSystemLoader(directory), autoescape=True, auto_reload=DEBUG)
+        self.async_env = Environment(loader=FileSystemLoader(directory), autoescape=True, auto_reload=DEBUG,
+                                     enable_async=True)
+        self.fragments = TTLCache(fragment_cache_size, ttl=float('inf'))
+        self._templates: dict[tuple[str, bool], Template] = {}
+
+    def preload(self, *names: str):
+        for name in names:
+            self.get_template(name)
+            self.get_template(name, streaming=True)
+        for row_template, _ in ROW_TEMPLATES.values():
+            self.get_template(row_template)
+
+    def get_template(self, name: str, streaming: bool = False) -> Template:
+        env = self.async_env if streaming else self.env
+        if DEBUG:
+            return env.get_template(name)
+        template = self._templates.get((name, streaming))
+        if template is None:
+            template = self._templates[name, streaming] = env.get_template(name)
+        return template
+
+    def render_row(self, name: str, var: str, item: Any) -> Markup:
+        revision = getattr(item, 'revision', None)
+        if revision is None:
+            return Markup(self.get_template(name).render({var: item}))
+        key = (name, item.id, revision)
+        fragment = self.fragments.get(key)
+        if fragment is MISSING:
+            fragment = Markup(self.get_template(name).render({var: item}))
+            self.fragments.set(key, fragment)
+        return fragment
+
+    def render(self, name: str, content: dict[str, Any], full_page: bool = False) -> bytes:
+        context = {'request': None, 'content': content, 'full_page': full_page}
+        if name in ROW_TEMPLATES:
+            row_template, var = ROW_TEMPLATES[name]
+            context['rows'] = [self.render_row(row_template, var, item) for item in content['data']]
+        return self.get_template(name).render(context).encode('utf-8')
+
+    async def stream(self, name: str, chunks: AsyncIterator[list[Any]], full_page: bool = False,
+                     flush_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+        """
+        Рендерит список по мере чтения строк из базы: начало страницы уходит до первого запроса,
+        дальше накопленный HTML отправляется перед чтением каждой следующей пачки строк
+        """
+        row_template, var = ROW_TEMPLATES[name]
+
+        async def rows():
+            iterator = aiter(chunks)
+            while True:
+                yield FLUSH
+                try:
+                    chunk = await anext(iterator)
+                except StopAsyncIteration:
+                    return
+                for item in chunk:
+                    yield self.render_row(row_template, var, item)
+
+        context = {'request': None, 'content': {}, 'full_page': full_page, 'rows': rows()}
+        buffer = []
+        size = 0
+        async for piece in self.get_template(name, streaming=True).generate_async(context):
+            if piece:
+                buffer.append(piece)
+                size += len(piece)
+                if size < flush_size:
+                    continue
+            if buffer:
+                yield ''.join(buffer).encode('utf-8')
+                buffer.clear()
+                size = 0
+        if buffer:
+            yield ''.join(buffer).encode('utf-8')
+
+
+renderer = TemplateRenderer(TEMPLATES_DIR, FRAGMENT_CACHE_SIZE)
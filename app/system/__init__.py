@@ -0,0 +1 @@
+import app.system.router
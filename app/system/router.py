@@ -0,0 +1,30 @@
+from fastapi import APIRouter
+
+from app.cache import repository_cache, flights
+from app.database import engine
+from app.pool import pool_monitor
+from app.rendering import renderer
+
+router = APIRouter(
+    prefix='/system', tags=['system'],
+)
+
+
+@router.get('/cache')
+async def get_cache_stats():
+    return repository_cache.stats()
+
+
+@router.get('/flights')
+async def get_flight_stats():
+    return flights.stats()
+
+
+@router.get('/fragments')
+async def get_fragment_cache_stats():
+    return renderer.fragments.stats()
+
+
+@router.get('/pool')
+async def get_pool_stats():
+    return pool_monitor.stats(engine.pool)
@@ -0,0 +1,101 @@
+import asyncio
+import heapq
+import logging
+from bisect import bisect_left, insort
+from typing import Iterable, Mapping
+
+from pydantic import BaseModel
+
+from app.config import TAG_INDEX_REFRESH
+
+logger = logging.getLogger(__name__)
+
+
+class TagSuggestion(BaseModel):
+    id: int
+    title: str
+    usage: int
+
+
+class TagIndex:
+    """
+    Индекс тегов для автодополнения: названия в нижнем регистре лежат в отсортированном списке,
+    поэтому теги с нужным префиксом - это непрерывный отрезок, который находится бинарным поиском.
+    Из отрезка выбираются top-N по числу задач с тегом. В базу поиск не ходит: индекс загружается
+    при старте, обновляется после коммита create_tag, delete_tag, attach_task_to_tag и импорта,
+    а изменения из других воркеров подтягиваются фоновой перезагрузкой раз в TAG_INDEX_REFRESH секунд
+    """
+    def __init__(self):
+        self._keys: list[tuple[str, int]] = []
+        self.titles: dict[int, str] = {}
+        self.usage: dict[int, int] = {}
+        self.versions: dict[str, int] = {}
+        self.loaded = False
+
+    def replace(self, tags: list[tuple[int, str, int]]):
+        self.titles = {id_: title for id_, title, _ in tags}
+        self.usage = {id_: usage for id_, _, usage in tags}
+        self._keys = sorted((title.lower(), id_) for id_, title, _ in tags)
+        self.loaded = True
+
+    def add(self, id_: int, title: str, usage: int = 0):
+        if id_ in self.titles:
+            return
+        self.titles[id_] = title
+        self.usage[id_] = usage
+        insort(self._keys, (title.lower(), id_))
+
+    def add_all(self, tags: Iterable[tuple[int, str]]):
+        for id_, title in tags:
+            self.add(id_, title)
+
+    def remove(self, id_: int):
+        title = self.titles.pop(id_, None)
+        if title is None:
+            return
+        del self.usage[id_]
+        position = bisect_left(self._keys, (title.lower(), id_))
+        if position < len(self._keys) and self._keys[position] == (title.lower(), id_):
+            del self._keys[position]
+
+    def increment(self, id_: int, delta: int = 1):
+        if id_ in self.usage:
+            self.usage[id_] += delta
+
+    def increment_all(self, counts: Mapping[int, int]):
+        for id_, delta in counts.items():
+            self.increment(id_, delta)
+
+    def reset(self):
+        self.replace([])
+        self.versions = {}
+        self.loaded = False
+
+    def complete(self, prefix: str, limit: int) -> list[TagSuggestion]:
+        prefix = prefix.lower()
+        start = bisect_left(self._keys, (prefix,))
+        stop = bisect_left(self._keys, (prefix + '\U0010ffff',), lo=start)
+        candidates = (self._keys[position] for position in range(start, stop))
+        best = heapq.nsmallest(limit, candidates, key=lambda key: (-self.usage[key[1]], key))
+        return [TagSuggestion(id=id_, title=self.titles[id_], usage=self.usage[id_]) for _, id_ in best]
+
+    async def refresh(self, rep):
+        """
+        Перезагружает индекс, только если теги или связи изменились с прошлой загрузки
+        """
+        versions = await rep.get_versions(('tags', 'task_tags'))
+        if self.loaded and versions == self.versions:
+            return
+        self.replace(await rep.get_tag_usage())
+        self.versions = versions
+
+    async def refresh_periodically(self, rep, interval: float = TAG_INDEX_REFRESH):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh(rep)
+            except Exception:
+                logger.exception('%s refresh failed', type(self).__name__)
+
+
+tag_index = TagIndex()
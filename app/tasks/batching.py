@@ -0,0 +1,155 @@
+import asyncio
+import logging
+from typing import Any
+
+from sqlalchemy.exc import IntegrityError
+
+from app.config import WRITE_BATCH_WINDOW, WRITE_BATCH_SIZE
+from app.metrics import registry
+from app.tasks.serializers import TaskSchema
+
+logger = logging.getLogger(__name__)
+
+BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# _sum / _count - сколько вызовов в среднем склеивается в одну запись
+batch_requests = registry.histogram('write_batch_requests', 'Coalesced write calls per flush',
+                                    ('operation',), BATCH_BUCKETS)
+batch_rows = registry.histogram('write_batch_rows', 'Distinct rows written per flush',
+                                ('operation',), BATCH_BUCKETS)
+
+
+class WriteBatcher:
+    """
+    Склеивает частые мелкие записи: отметки done/undone, перенос в проект и привязку тегов.
+    Вызовы, пришедшие в течение window секунд, пишутся одной транзакцией: задачи - одним UPDATE
+    по массиву id, связи с тегами - одним INSERT ... ON CONFLICT. Для одной задачи побеждает
+    последний вызов, и каждый вызов получает строку задачи в том виде, в каком она зафиксирована.
+    Пачки пишутся строго по очереди, поэтому более поздний вызов не перезапишется более ранним.
+    Если пачка нарушила ограничение базы, ее вызовы повторяются по одному, чтобы ошибка досталась
+    только своему вызову. Методы повторяют сигнатуры Repository, так что маршруты не различают их
+    """
+    def __init__(self, window: float = WRITE_BATCH_WINDOW, max_size: int = WRITE_BATCH_SIZE):
+        self.window = window
+        self.max_size = max_size
+        self.rep = None
+        self._task_writes: list[tuple[int, dict[str, Any], asyncio.Future]] = []
+        self._tag_writes: list[tuple[int, int, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._flushes: set[asyncio.Task] = set()
+        self._lock = asyncio.Lock()
+
+    @property
+    def pending(self) -> int:
+        return len(self._task_writes) + len(self._tag_writes)
+
+    def start(self, rep):
+        self.rep = rep
+
+    async def stop(self):
+        """
+        Дописывает накопленное и отключает склейку: дальше маршруты пишут напрямую
+        """
+        await self.flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        self.rep = None
+
+    def _enqueue(self, writes: list, *item) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        writes.append((*item, future))
+        if self.pending >= self.max_size:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._schedule_flush)
+        return future
+
+    def _schedule_flush(self):
+        task = asyncio.create_task(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def getting_done(self, id: int, done=True) -> TaskSchema | None:
+        return await self._enqueue(self._task_writes, id, {'done': done})
+
+    async def attach_project_task(self, task_id: int, project_id: int) -> TaskSchema | None:
+        return await self._enqueue(self._task_writes, task_id, {'project_id': project_id})
+
+    async def attach_task_to_tag(self, task_id: int, tag_id: int):
+        await self._enqueue(self._tag_writes, task_id, tag_id)
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Пачка забирается до ожидания блокировки: asyncio.Lock отпускает ждущих по очереди,
+        # так что пачки фиксируются в порядке вызовов
+        task_writes, self._task_writes = self._task_writes, []
+        tag_writes, self._tag_writes = self._tag_writes, []
+        if not task_writes and not tag_writes:
+            return
+        async with self._lock:
+            if task_writes:
+                await self._write_tasks(task_writes)
+            if tag_writes:
+                await self._write_tags(tag_writes)
+
+    async def _write_tasks(self, writes: list[tuple[int, dict[str, Any], asyncio.Future]]):
+        changes: dict[int, dict[str, Any]] = {}
+        for id_, values, _ in writes:
+            changes.setdefault(id_, {}).update(values)
+        if registry.enabled:
+            batch_requests.observe(len(writes), 'tasks')
+            batch_rows.observe(len(changes), 'tasks')
+        try:
+            tasks = await self.rep.update_tasks(changes)
+        except IntegrityError:
+            logger.warning('batch of %d task updates failed, retrying one by one', len(writes))
+            for id_, values, future in writes:
+                await self._settle(future, self.rep.update_tasks({id_: values}), lambda result: result.get(id_))
+            return
+        except Exception as exc:
+            for *_, future in writes:
+                self._fail(future, exc)
+            return
+        for id_, _, future in writes:
+            if not future.done():
+                future.set_result(tasks.get(id_))
+
+    async def _write_tags(self, writes: list[tuple[int, int, asyncio.Future]]):
+        pairs = list(dict.fromkeys((task_id, tag_id) for task_id, tag_id, _ in writes))
+        if registry.enabled:
+            batch_requests.observe(len(writes), 'task_tags')
+            batch_rows.observe(len(pairs), 'task_tags')
+        try:
+            await self.rep.attach_tags(pairs)
+        except IntegrityError:
+            logger.warning('batch of %d tag attachments failed, retrying one by one', len(writes))
+            for task_id, tag_id, future in writes:
+                await self._settle(future, self.rep.attach_tags([(task_id, tag_id)]), lambda result: None)
+            return
+        except Exception as exc:
+            for *_, future in writes:
+                self._fail(future, exc)
+            return
+        for *_, future in writes:
+            if not future.done():
+                future.set_result(None)
+
+    @staticmethod
+    async def _settle(future: asyncio.Future, write, unpack):
+        try:
+            result = unpack(await write)
+        except Exception as exc:
+            WriteBatcher._fail(future, exc)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    def _fail(future: asyncio.Future, exc: Exception):
+        if not future.done():
+            future.set_exception(exc)
+
+
+write_batcher = WriteBatcher()
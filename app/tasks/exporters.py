@@ -0,0 +1,52 @@
+import csv
+import io
+from typing import AsyncIterator, Any
+
+from app.tasks.importers import CSV_TAGS_SEPARATOR
+from app.tasks.serializers import TaskExportRow
+
+CSV_COLUMNS = ('id', 'title', 'description', 'done', 'created_at', 'scheduled_at', 'my_day_date', 'project_id')
+CSV_EXPAND_COLUMNS = ('project', 'tags')
+
+Batches = AsyncIterator[list[dict[str, Any]]]
+
+
+async def format_ndjson(batches: Batches) -> AsyncIterator[bytes]:
+    """
+    Одна задача на строку, по одному куску на пачку курсора
+    """
+    async for batch in batches:
+        yield b''.join(
+            TaskExportRow.model_construct(**row).model_dump_json(exclude_unset=True).encode('utf-8') + b'\n'
+            for row in batch
+        )
+
+
+async def format_csv(batches: Batches, expand: bool = False) -> AsyncIterator[bytes]:
+    """
+    Колонки совпадают с форматом импорта, так что выгрузку можно загрузить обратно через /tasks/import,
+    в том числе многострочные поля. Колонка id при импорте не учитывается, с expand проект и теги
+    восстанавливаются по названиям
+    """
+    columns = CSV_COLUMNS + CSV_EXPAND_COLUMNS if expand else CSV_COLUMNS
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(columns)
+    async for batch in batches:
+        for row in batch:
+            values = []
+            for column in columns:
+                value = row.get(column)
+                if column == 'tags':
+                    value = CSV_TAGS_SEPARATOR.join(value or ())
+                elif value is None:
+                    value = ''
+                elif hasattr(value, 'isoformat'):
+                    value = value.isoformat()
+                values.append(value)
+            writer.writerow(values)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
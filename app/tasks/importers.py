@@ -0,0 +1,183 @@
+import csv
+from collections import deque
+from typing import AsyncIterator
+
+from pydantic import ValidationError
+
+from app.config import IMPORT_BATCH_SIZE, IMPORT_MAX_ERRORS, IMPORT_MAX_LINE_BYTES
+from app.helpers import to_local_naive
+from app.tasks.serializers import TaskImportRow, ImportSummary, ImportLineError
+
+CSV_TAGS_SEPARATOR = '|'
+CSV_REQUIRED_STRINGS = ('title', 'description')
+
+ParsedRows = AsyncIterator[tuple[int, TaskImportRow | str]]
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, bytes | None]]:
+    """
+    Режет поток байт на строки, не держа в памяти больше одной строки.
+    Вместо слишком длинной строки отдает None
+    """
+    buffer = b''
+    line_no = 0
+    skipping = False
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            line_no += 1
+            if skipping:
+                skipping = False
+                yield line_no, None
+            else:
+                yield line_no, line if len(line) <= IMPORT_MAX_LINE_BYTES else None
+        if len(buffer) > IMPORT_MAX_LINE_BYTES:
+            skipping = True
+            buffer = b''
+    if buffer or skipping:
+        yield line_no + 1, None if skipping else buffer
+
+
+def format_validation_error(error: ValidationError) -> str:
+    return '; '.join(
+        f"{'.'.join(map(str, item['loc']))}: {item['msg']}" if item['loc'] else item['msg']
+        for item in error.errors()
+    )
+
+
+def normalize_row(row: TaskImportRow) -> TaskImportRow:
+    """
+    Колонки tasks хранят время без часового пояса, в локальном времени сервера
+    """
+    for field in ('created_at', 'scheduled_at'):
+        value = getattr(row, field)
+        if value is not None:
+            setattr(row, field, to_local_naive(value))
+    return row
+
+
+async def parse_ndjson(lines: AsyncIterator[tuple[int, bytes | None]]) -> ParsedRows:
+    async for line_no, line in lines:
+        if line is None:
+            yield line_no, 'Line is too long'
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield line_no, normalize_row(TaskImportRow.model_validate_json(line))
+        except ValidationError as e:
+            yield line_no, format_validation_error(e)
+
+
+class LineFeed:
+    """
+    Источник строк для одного csv.reader на весь файл: строки подкладываются по мере чтения потока,
+    а reader забирает их, только когда запись целиком пришла
+    """
+    def __init__(self):
+        self.lines: deque[str] = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+async def parse_csv(lines: AsyncIterator[tuple[int, bytes | None]]) -> ParsedRows:
+    """
+    Первая строка - заголовок с именами полей TaskImportRow, теги перечисляются через '|'.
+    Поле в кавычках может занимать несколько строк: запись копится, пока кавычки не закрыты,
+    ошибка записи сообщается с номером ее первой строки
+    """
+    feed = LineFeed()
+    reader = csv.reader(feed)
+    header = None
+    start = None
+    size = 0
+    quoted = False
+    async for line_no, line in lines:
+        if line is None or size + len(line) > IMPORT_MAX_LINE_BYTES:
+            yield start or line_no, 'Line is too long'
+            feed.lines.clear()
+            start, size, quoted = None, 0, False
+            continue
+        try:
+            text = line.decode('utf-8')
+        except UnicodeDecodeError:
+            yield start or line_no, 'Invalid UTF-8'
+            feed.lines.clear()
+            start, size, quoted = None, 0, False
+            continue
+        if start is None:
+            if header is None:
+                text = text.lstrip('\ufeff')
+            if not text.strip():
+                continue
+            start = line_no
+        size += len(line)
+        feed.lines.append(text + '\n')
+        if text.count('"') % 2:
+            quoted = not quoted
+        if quoted:
+            continue
+        record_line, start, size = start, None, 0
+        try:
+            values = next(reader)
+        except csv.Error as e:
+            feed.lines.clear()
+            yield record_line, str(e)
+            continue
+        if header is None:
+            header = values
+            continue
+        if len(values) != len(header):
+            yield record_line, f'Expected {len(header)} columns, got {len(values)}'
+            continue
+        record = {key: value for key, value in zip(header, values) if value != '' or key in CSV_REQUIRED_STRINGS}
+        if 'tags' in record:
+            record['tags'] = [tag for tag in record['tags'].split(CSV_TAGS_SEPARATOR) if tag]
+        try:
+            yield record_line, normalize_row(TaskImportRow.model_validate(record))
+        except ValidationError as e:
+            yield record_line, format_validation_error(e)
+    if start is not None:
+        yield start, 'Unterminated quoted field'
+
+
+def add_errors(summary: ImportSummary, errors: list[ImportLineError]):
+    summary.failed += len(errors)
+    free = IMPORT_MAX_ERRORS - len(summary.errors)
+    summary.errors.extend(errors[:free])
+    if len(errors) > free:
+        summary.errors_truncated = True
+
+
+async def import_rows(rep, rows: ParsedRows) -> ImportSummary:
+    """
+    Пишет разобранные строки пачками по IMPORT_BATCH_SIZE через Repository.import_tasks.
+    Пачки фиксируются по мере записи, так что к моменту ответа все посчитанное в imported уже в базе
+    """
+    summary = ImportSummary()
+    batch = []
+
+    async def flush():
+        imported, errors = await rep.import_tasks(batch)
+        summary.imported += imported
+        add_errors(summary, errors)
+        batch.clear()
+
+    async for line_no, row in rows:
+        summary.received += 1
+        if isinstance(row, str):
+            add_errors(summary, [ImportLineError(line=line_no, error=row)])
+            continue
+        batch.append((line_no, row))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await flush()
+    if batch:
+        await flush()
+    return summary
@@ -0,0 +1,639 @@
+import datetime
+import math
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from typing import AsyncIterator, Any, Hashable
+
+from app.config import EXPORT_BATCH_SIZE, STREAM_CHUNK_SIZE
+from app.events import broadcaster, merge_events
+from app.tasks.autocomplete import tag_index
+from app.tasks.reminders import reminder_dispatcher
+from app.tasks.stats import task_stats, task_state
+from app.tasks.search import search_terms, highlight, mark_terms
+from app.tasks.serializers import TaskSchema, ProjectSchema, TagSchema, TaskFilters, PageParams, TaskImportRow, \
+    ImportLineError, TaskSearchHit, SearchPageParams, ReminderSchema, TaskTagSchema, TombstoneSchema, Change
+
+TaskKey = tuple[datetime.datetime, int]
+
+# Таблицы в порядке ленты изменений, как CHANGE_SOURCES в Repository
+CHANGE_TABLES = ('projects', 'tags', 'tasks', 'task_tags', 'tombstones')
+
+
+class TaskRow:
+    __slots__ = ('id', 'title', 'description', 'done', 'created_at', 'scheduled_at', 'my_day_date', 'project_id')
+
+    def __init__(self, id, title, description, done, created_at, scheduled_at, my_day_date, project_id):
+        self.id = id
+        self.title = title
+        self.description = description
+        self.done = done
+        self.created_at = created_at
+        self.scheduled_at = scheduled_at
+        self.my_day_date = my_day_date
+        self.project_id = project_id
+
+    @property
+    def key(self) -> TaskKey:
+        return self.created_at, self.id
+
+
+class TitledRow:
+    __slots__ = ('id', 'title', 'description')
+
+    def __init__(self, id, title, description):
+        self.id = id
+        self.title = title
+        self.description = description
+
+
+class ReminderRow:
+    __slots__ = ('id', 'task_id', 'remind_at', 'claimed_until', 'sent_at')
+
+    def __init__(self, id, task_id, remind_at, claimed_until=None, sent_at=None):
+        self.id = id
+        self.task_id = task_id
+        self.remind_at = remind_at
+        self.claimed_until = claimed_until
+        self.sent_at = sent_at
+
+
+class SortedIndex:
+    """
+    Ключи задач (created_at, id) в порядке keyset-пагинации, сгруппированные по значению поля
+    """
+    def __init__(self):
+        self.keys: dict[Hashable, list[TaskKey]] = defaultdict(list)
+
+    def add(self, value: Hashable, key: TaskKey):
+        insort(self.keys[value], key)
+
+    def remove(self, value: Hashable, key: TaskKey):
+        keys = self.keys.get(value)
+        if keys is None:
+            return
+        position = bisect_left(keys, key)
+        if position < len(keys) and keys[position] == key:
+            del keys[position]
+        if not keys:
+            del self.keys[value]
+
+    def get(self, value: Hashable) -> list[TaskKey]:
+        return self.keys.get(value, [])
+
+
+class ChangeLog:
+    """
+    Ревизии строк в порядке (revision, id) по таблицам и записи об удалениях, как индексы ленты
+    изменений в Postgres. Все изменения одной операции репозитория получают одну ревизию,
+    при фиксации операции ее события уходят подписчикам
+    """
+    def __init__(self):
+        self.revision = 0
+        self.rows: dict[str, dict[int, int]] = defaultdict(dict)
+        self.order: dict[str, list[tuple[int, int]]] = defaultdict(list)
+        self.tombstones: dict[int, TombstoneSchema] = {}
+        self.events: list[dict[str, Any]] = []
+
+    def event(self, table: str, op: str, id: int):
+        if table != 'task_tags':
+            self.events.append({'table': table, 'op': op, 'ids': [id]})
+
+    def _forget(self, table: str, id: int):
+        revision = self.rows[table].pop(id, None)
+        if revision is not None:
+            keys = self.order[table]
+            del keys[bisect_left(keys, (revision, id))]
+
+    def touch(self, table: str, id: int):
+        if self.rows[table].get(id) == self.revision + 1:
+            return
+        self._forget(table, id)
+        self.rows[table][id] = self.revision + 1
+        insort(self.order[table], (self.revision + 1, id))
+        self.event(table, 'upsert', id)
+
+    def delete(self, table: str, id: int):
+        self._forget(table, id)
+        tombstone_id = len(self.tombstones) + 1
+        self.tombstones[tombstone_id] = TombstoneSchema(table=table, id=id)
+        self.order['tombstones'].append((self.revision + 1, tombstone_id))
+        self.event(table, 'delete', id)
+
+    def commit(self):
+        self.revision += 1
+        events, self.events = self.events, []
+        if events:
+            broadcaster.publish(self.revision, merge_events(events))
+
+    def after(self, table: str, key: tuple[int, float], limit: int) -> list[tuple[int, int]]:
+        keys = self.order[table]
+        start = bisect_right(keys, key)
+        return keys[start:start + limit]
+
+
+class InMemoryRepository:
+    """
+    Repository без базы: задачи, проекты, теги и связи живут в памяти процесса.
+    Вторичные индексы по проекту, тегу, done и my_day_date держат ключи в порядке (created_at, id),
+    так что страница списка стоит O(log n + размер страницы). Данные не разделяются между процессами,
+    поэтому движок годится для тестов, бенчмарков и однопользовательского запуска с одним воркером
+    """
+    def __init__(self):
+        self.tasks: dict[int, TaskRow] = {}
+        self.projects: dict[int, TitledRow] = {}
+        self.tags: dict[int, TitledRow] = {}
+        self.task_tags: dict[int, set[int]] = defaultdict(set)
+        self.versions: dict[str, int] = defaultdict(int)
+        self._ids: dict[str, int] = defaultdict(int)
+        self._order = SortedIndex()
+        self._by_project = SortedIndex()
+        self._by_tag = SortedIndex()
+        self._by_done = SortedIndex()
+        self._by_my_day = SortedIndex()
+        self._titles: dict[str, dict[str, list[int]]] = {'projects': defaultdict(list), 'tags': defaultdict(list)}
+        self.reminders: dict[int, ReminderRow] = {}
+        self._reminders_by_task: dict[int, set[int]] = defaultdict(set)
+        # Неотправленные напоминания в порядке (remind_at, id), как частичный индекс в Postgres
+        self._pending: list[tuple[datetime.datetime, int]] = []
+        # Связи задач с тегами по id, как строки task_tags, для ленты изменений
+        self._links: dict[int, tuple[int, int]] = {}
+        self._link_ids: dict[tuple[int, int], int] = {}
+        self.changes = ChangeLog()
+
+    def _next_id(self, table: str) -> int:
+        self._ids[table] += 1
+        return self._ids[table]
+
+    def _bump_versions(self, *tables: str):
+        for table in set(tables):
+            self.versions[table] += 1
+        self.changes.commit()
+
+    async def get_versions(self, tables: tuple[str, ...]) -> dict[str, int]:
+        return {table: self.versions.get(table, 0) for table in tables}
+
+    def _index_task(self, task: TaskRow):
+        key = task.key
+        task_stats.add(task_state(task))
+        self.changes.touch('tasks', task.id)
+        self._order.add(None, key)
+        self._by_done.add(task.done, key)
+        if task.project_id is not None:
+            self._by_project.add(task.project_id, key)
+        if task.my_day_date is not None:
+            self._by_my_day.add(task.my_day_date, key)
+        for tag_id in self.task_tags.get(task.id, ()):
+            self._by_tag.add(tag_id, key)
+
+    def _unindex_task(self, task: TaskRow):
+        key = task.key
+        task_stats.add(task_state(task), -1)
+        self._order.remove(None, key)
+        self._by_done.remove(task.done, key)
+        self._by_project.remove(task.project_id, key)
+        self._by_my_day.remove(task.my_day_date, key)
+        for tag_id in self.task_tags.get(task.id, ()):
+            self._by_tag.remove(tag_id, key)
+
+    def _update_task(self, task: TaskRow, **values):
+        self._unindex_task(task)
+        for name, value in values.items():
+            setattr(task, name, value)
+        self._index_task(task)
+
+    def _remove_task(self, task_id: int):
+        task = self.tasks.pop(task_id, None)
+        if task is not None:
+            self._unindex_task(task)
+            self.changes.delete('tasks', task_id)
+            for tag_id in self.task_tags.pop(task_id, ()):
+                self._unlink(task_id, tag_id)
+            for reminder_id in list(self._reminders_by_task.get(task_id, ())):
+                self._remove_reminder(reminder_id)
+
+    def _schema(self, task: TaskRow | None) -> TaskSchema:
+        result = TaskSchema.model_validate(task)
+        result.tags = self._tags_of(task.id)
+        result.revision = self.changes.rows['tasks'].get(task.id)
+        return result
+
+    def _project_schema(self, project: TitledRow | None) -> ProjectSchema:
+        result = ProjectSchema.model_validate(project)
+        result.revision = self.changes.rows['projects'].get(project.id)
+        return result
+
+    def _tags_of(self, task_id: int) -> list[TagSchema]:
+        return [TagSchema.model_validate(self.tags[tag_id]) for tag_id in sorted(self.task_tags.get(task_id, ()))]
+
+    def _select(self,
+                filters: TaskFilters | None,
+                page: PageParams | None,
+                project_id: int | None = None,
+                tag_id: int | None = None) -> list[TaskRow]:
+        """
+        Берет самый короткий из подходящих индексов и идет по нему от ключа курсора,
+        остальные условия проверяются на каждой задаче
+        """
+        filters = filters or TaskFilters()
+        if project_id is not None and filters.project_id is not None and project_id != filters.project_id:
+            return []
+        project_id = project_id if project_id is not None else filters.project_id
+
+        candidates = [self._order.get(None)]
+        if project_id is not None:
+            candidates.append(self._by_project.get(project_id))
+        if tag_id is not None:
+            candidates.append(self._by_tag.get(tag_id))
+        if filters.done is not None:
+            candidates.append(self._by_done.get(filters.done))
+        if filters.my_day_date is not None:
+            candidates.append(self._by_my_day.get(filters.my_day_date))
+        keys = min(candidates, key=len)
+
+        start = bisect_right(keys, page.after) if page is not None and page.after is not None else 0
+        limit = page.limit if page is not None else None
+        result = []
+        for position in range(start, len(keys)):
+            task = self.tasks[keys[position][1]]
+            if project_id is not None and task.project_id != project_id:
+                continue
+            if tag_id is not None and tag_id not in self.task_tags.get(task.id, ()):
+                continue
+            if filters.done is not None and task.done != filters.done:
+                continue
+            if filters.my_day_date is not None and task.my_day_date != filters.my_day_date:
+                continue
+            if filters.scheduled_from is not None and (task.scheduled_at is None
+                                                       or task.scheduled_at < filters.scheduled_from):
+                continue
+            if filters.scheduled_to is not None and (task.scheduled_at is None
+                                                     or task.scheduled_at >= filters.scheduled_to):
+                continue
+            result.append(task)
+            if limit is not None and len(result) >= limit:
+                break
+        return result
+
+    async def get_tasks(self, filters: TaskFilters | None = None, page: PageParams | None = None) -> list[TaskSchema]:
+        return [self._schema(task) for task in self._select(filters, page)]
+
+    async def get_task(self, id: int) -> TaskSchema:
+        return self._schema(self.tasks.get(id))
+
+    async def get_tasks_by_project_id(self,
+                                      id: int,
+                                      filters: TaskFilters | None = None,
+                                      page: PageParams | None = None) -> list[TaskSchema]:
+        return [self._schema(task) for task in self._select(filters, page, project_id=id)]
+
+    async def get_tasks_by_tag_id(self,
+                                  id: int,
+                                  filters: TaskFilters | None = None,
+                                  page: PageParams | None = None) -> list[TaskSchema]:
+        return [self._schema(task) for task in self._select(filters, page, tag_id=id)]
+
+    async def search_tasks(self,
+                           q: str,
+                           filters: TaskFilters | None = None,
+                           tag_id: int | None = None,
+                           page: SearchPageParams | None = None) -> list[TaskSearchHit]:
+        """
+        Перебирает отфильтрованные задачи: каждое слово запроса должно быть префиксом слова из названия
+        или описания, совпадение в названии весит вдвое больше. Индекса для поиска в памяти нет
+        """
+        terms = search_terms(q)
+        if not terms:
+            return []
+        ranked = []
+        for task in self._select(filters, None, tag_id=tag_id):
+            title_words = search_terms(task.title)
+            description_words = search_terms(task.description or '')
+            if not all(any(word.startswith(term) for word in title_words + description_words) for term in terms):
+                continue
+            rank = sum(2.0 for term in terms for word in title_words if word.startswith(term))
+            rank += sum(1.0 for term in terms for word in description_words if word.startswith(term))
+            if page is None or page.after is None or (rank, task.id) < page.after:
+                ranked.append((rank, task))
+        ranked.sort(key=lambda item: (item[0], item[1].id), reverse=True)
+        if page is not None:
+            ranked = ranked[:page.limit]
+        return [
+            TaskSearchHit(**self._schema(task).model_dump(), rank=rank,
+                          title_highlight=highlight(mark_terms(task.title, terms)),
+                          snippet=highlight(mark_terms(task.description, terms)))
+            for rank, task in ranked
+        ]
+
+    async def stream_task_page(self,
+                               filters: TaskFilters | None = None,
+                               page: PageParams | None = None,
+                               project_id: int | None = None,
+                               tag_id: int | None = None,
+                               chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[list[TaskSchema]]:
+        tasks = [self._schema(task) for task in self._select(filters, page, project_id, tag_id)]
+        for start in range(0, len(tasks), chunk_size):
+            yield tasks[start:start + chunk_size]
+
+    async def stream_tasks(self,
+                           filters: TaskFilters | None = None,
+                           expand: bool = False,
+                           batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[list[dict[str, Any]]]:
+        """
+        Строки выбираются сразу, поэтому выгрузка видит одно состояние, как и снимок REPEATABLE READ в Postgres
+        """
+        rows = []
+        for task in self._select(filters, None):
+            row = {name: getattr(task, name) for name in TaskRow.__slots__}
+            if expand:
+                project = self.projects.get(task.project_id)
+                row['project'] = project.title if project is not None else None
+                row['tags'] = [self.tags[tag_id].title for tag_id in sorted(self.task_tags.get(task.id, ()))]
+            rows.append(row)
+        for start in range(0, len(rows), batch_size):
+            yield rows[start:start + batch_size]
+
+    def _insert_task(self, **values) -> TaskRow:
+        task = TaskRow(id=self._next_id('tasks'), **values)
+        self.tasks[task.id] = task
+        self._index_task(task)
+        return task
+
+    async def create_task(self, task: TaskSchema) -> TaskSchema:
+        row = self._insert_task(title=task.title, description=task.description, done=task.done,
+                                created_at=task.created_at or datetime.datetime.now(),
+                                scheduled_at=task.scheduled_at, my_day_date=task.my_day_date,
+                                project_id=task.project_id)
+        self._bump_versions('tasks')
+        return self._schema(row)
+
+    def _insert_titled(self, table: str, title: str, description: str) -> TitledRow:
+        row = TitledRow(self._next_id(table), title, description)
+        getattr(self, table)[row.id] = row
+        self._titles[table][title].append(row.id)
+        self.changes.touch(table, row.id)
+        return row
+
+    def _delete_titled(self, table: str, id: int) -> TitledRow | None:
+        row = getattr(self, table).pop(id, None)
+        if row is not None:
+            ids = self._titles[table][row.title]
+            ids.remove(row.id)
+            if not ids:
+                del self._titles[table][row.title]
+            self.changes.delete(table, id)
+        return row
+
+    def _resolve_titles(self, table: str, titles: set[str]) -> dict[str, int]:
+        """
+        Находит id проектов или тегов по названиям, недостающие создает
+        """
+        ids = {title: self._titles[table][title][0] for title in titles if self._titles[table].get(title)}
+        missing = sorted(titles - ids.keys())
+        for title in missing:
+            ids[title] = self._insert_titled(table, title, title).id
+            if table == 'tags':
+                tag_index.add(ids[title], title)
+        if missing:
+            self._bump_versions(table)
+        return ids
+
+    def _link(self, task: TaskRow, tag_id: int):
+        if tag_id not in self.task_tags.get(task.id, ()):
+            self.task_tags[task.id].add(tag_id)
+            self._by_tag.add(tag_id, task.key)
+            tag_index.increment(tag_id)
+            link_id = self._next_id('task_tags')
+            self._links[link_id] = (task.id, tag_id)
+            self._link_ids[task.id, tag_id] = link_id
+            self.changes.touch('task_tags', link_id)
+            self.changes.event('tasks', 'upsert', task.id)
+
+    def _unlink(self, task_id: int, tag_id: int):
+        link_id = self._link_ids.pop((task_id, tag_id))
+        del self._links[link_id]
+        self.changes.delete('task_tags', link_id)
+
+    async def import_tasks(self, rows: list[tuple[int, TaskImportRow]]) -> tuple[int, list[ImportLineError]]:
+        errors = []
+        valid = []
+        for line_no, row in rows:
+            if row.project_id is not None and row.project_id not in self.projects:
+                errors.append(ImportLineError(line=line_no, error=f'Project {row.project_id} does not exist'))
+            else:
+                valid.append(row)
+        if not valid:
+            return 0, errors
+
+        project_ids = self._resolve_titles('projects', {row.project for row in valid if row.project})
+        tag_ids = self._resolve_titles('tags', {tag for row in valid for tag in row.tags})
+        now = datetime.datetime.now()
+        for row in valid:
+            task = self._insert_task(title=row.title, description=row.description, done=row.done,
+                                     created_at=row.created_at or now, scheduled_at=row.scheduled_at,
+                                     my_day_date=row.my_day_date,
+                                     project_id=project_ids[row.project] if row.project else row.project_id)
+            for tag in row.tags:
+                self._link(task, tag_ids[tag])
+        self._bump_versions('tasks', 'task_tags')
+        return len(valid), errors
+
+    async def delete_task(self, id: int):
+        self._remove_task(id)
+        self._bump_versions('tasks', 'task_tags')
+
+    async def getting_done(self, id: int, done=True) -> TaskSchema | None:
+        task = self.tasks.get(id)
+        if task is None:
+            return None
+        self._update_task(task, done=done)
+        self._bump_versions('tasks')
+        return self._schema(task)
+
+    async def get_task_stats(self) -> tuple[list[tuple[int | None, bool, int]],
+                                            list[tuple[datetime.date, bool, int]]]:
+        by_project, by_my_day = defaultdict(int), defaultdict(int)
+        for task in self.tasks.values():
+            by_project[task.project_id, bool(task.done)] += 1
+            if task.my_day_date is not None:
+                by_my_day[task.my_day_date, bool(task.done)] += 1
+        return ([(project_id, done, count) for (project_id, done), count in by_project.items()],
+                [(my_day_date, done, count) for (my_day_date, done), count in by_my_day.items()])
+
+    async def get_projects(self) -> list[ProjectSchema]:
+        return [self._project_schema(project) for project in self.projects.values()]
+
+    async def get_project(self, id: int) -> ProjectSchema:
+        return self._project_schema(self.projects.get(id))
+
+    async def create_project(self, project: ProjectSchema) -> ProjectSchema:
+        row = self._insert_titled('projects', project.title, project.description)
+        self._bump_versions('projects')
+        return self._project_schema(row)
+
+    async def delete_project(self, id: int):
+        if self._delete_titled('projects', id) is not None:
+            for _, task_id in list(self._by_project.get(id)):
+                self._remove_task(task_id)
+        self._bump_versions('projects', 'tasks', 'task_tags')
+
+    async def attach_project_task(self, task_id: int, project_id: int) -> TaskSchema | None:
+        task = self.tasks.get(task_id)
+        if task is None:
+            return None
+        self._update_task(task, project_id=project_id)
+        self._bump_versions('tasks')
+        return self._schema(task)
+
+    async def update_tasks(self, changes: dict[int, dict[str, Any]]) -> dict[int, TaskSchema]:
+        results = {}
+        for id_, values in sorted(changes.items()):
+            task = self.tasks.get(id_)
+            if task is not None:
+                self._update_task(task, **values)
+                results[id_] = self._schema(task)
+        self._bump_versions('tasks')
+        return results
+
+    async def get_tags(self) -> list[TagSchema]:
+        return [TagSchema.model_validate(tag) for tag in self.tags.values()]
+
+    async def get_tag(self, id: int) -> TagSchema:
+        return TagSchema.model_validate(self.tags.get(id))
+
+    async def get_tag_usage(self) -> list[tuple[int, str, int]]:
+        return [(tag.id, tag.title, len(self._by_tag.get(tag.id))) for tag in self.tags.values()]
+
+    async def get_all_tags_by_task(self, id: int) -> list[TagSchema]:
+        return self._tags_of(id)
+
+    async def create_tag(self, tag: str) -> TagSchema:
+        row = self._insert_titled('tags', tag, tag)
+        tag_index.add(row.id, row.title)
+        self._bump_versions('tags')
+        return TagSchema.model_validate(row)
+
+    async def delete_tag(self, id: int):
+        tag_index.remove(id)
+        if self._delete_titled('tags', id) is not None:
+            for key in list(self._by_tag.get(id)):
+                self._by_tag.remove(id, key)
+                self.task_tags[key[1]].discard(id)
+                self._unlink(key[1], id)
+        self._bump_versions('tags', 'task_tags')
+
+    async def attach_task_to_tag(self, task_id: int, tag_id: int):
+        task = self.tasks.get(task_id)
+        if task is not None and tag_id in self.tags:
+            self._link(task, tag_id)
+        self._bump_versions('task_tags')
+
+    async def attach_tags(self, pairs: list[tuple[int, int]]):
+        for task_id, tag_id in pairs:
+            task = self.tasks.get(task_id)
+            if task is not None and tag_id in self.tags:
+                self._link(task, tag_id)
+        self._bump_versions('task_tags')
+
+    def _unmark_pending(self, reminder: ReminderRow):
+        key = (reminder.remind_at, reminder.id)
+        position = bisect_left(self._pending, key)
+        if position < len(self._pending) and self._pending[position] == key:
+            del self._pending[position]
+
+    def _remove_reminder(self, id: int):
+        reminder = self.reminders.pop(id, None)
+        if reminder is not None:
+            self._unmark_pending(reminder)
+            self._reminders_by_task[reminder.task_id].discard(id)
+
+    def _change_item(self, table: str, id: int):
+        if table == 'projects':
+            return self._project_schema(self.projects[id])
+        if table == 'tags':
+            return TagSchema.model_validate(self.tags[id])
+        if table == 'tasks':
+            return TaskSchema.model_validate(self.tasks[id])
+        if table == 'task_tags':
+            task_id, tag_id = self._links[id]
+            return TaskTagSchema(id=id, task_id=task_id, tag_id=tag_id)
+        return self.changes.tombstones[id]
+
+    async def get_changes(self, after: tuple[int, int, int], limit: int) -> list[Change]:
+        revision, source, id_ = after
+        changes: list[Change] = []
+        for index, table in enumerate(CHANGE_TABLES):
+            if index < source:
+                key = (revision, math.inf)
+            elif index == source:
+                key = (revision, id_)
+            else:
+                key = (revision, -math.inf)
+            changes.extend((row_revision, index, row_id, self._change_item(table, row_id))
+                           for row_revision, row_id in self.changes.after(table, key, limit))
+        changes.sort(key=lambda change: change[:3])
+        return changes[:limit]
+
+    async def get_reminders(self, task_id: int) -> list[ReminderSchema]:
+        reminders = (self.reminders[id_] for id_ in self._reminders_by_task.get(task_id, ()))
+        return [ReminderSchema.model_validate(reminder)
+                for reminder in sorted(reminders, key=lambda reminder: (reminder.remind_at, reminder.id))]
+
+    async def create_reminder(self, task_id: int, remind_at: datetime.datetime) -> ReminderSchema | None:
+        if task_id not in self.tasks:
+            return None
+        reminder = ReminderRow(self._next_id('reminders'), task_id, remind_at)
+        self.reminders[reminder.id] = reminder
+        self._reminders_by_task[task_id].add(reminder.id)
+        insort(self._pending, (remind_at, reminder.id))
+        reminder_dispatcher.wake(remind_at)
+        return ReminderSchema.model_validate(reminder)
+
+    async def update_reminder(self, id: int, remind_at: datetime.datetime) -> ReminderSchema | None:
+        reminder = self.reminders.get(id)
+        if reminder is None:
+            return None
+        self._unmark_pending(reminder)
+        reminder.remind_at, reminder.claimed_until, reminder.sent_at = remind_at, None, None
+        insort(self._pending, (remind_at, reminder.id))
+        reminder_dispatcher.wake(remind_at)
+        return ReminderSchema.model_validate(reminder)
+
+    async def delete_reminder(self, id: int):
+        self._remove_reminder(id)
+
+    async def claim_reminders(self,
+                              horizon: datetime.datetime,
+                              now: datetime.datetime,
+                              claimed_until: datetime.datetime,
+                              limit: int) -> list[ReminderSchema]:
+        claimed = []
+        for remind_at, id_ in self._pending:
+            if remind_at > horizon or len(claimed) == limit:
+                break
+            reminder = self.reminders[id_]
+            if reminder.claimed_until is None or reminder.claimed_until < now:
+                reminder.claimed_until = claimed_until
+                claimed.append(ReminderSchema.model_validate(reminder))
+        return claimed
+
+    async def complete_reminders(self, ids: list[int], now: datetime.datetime) -> list[ReminderSchema]:
+        completed = []
+        for id_ in ids:
+            reminder = self.reminders.get(id_)
+            if reminder is not None and reminder.sent_at is None and reminder.remind_at <= now:
+                self._unmark_pending(reminder)
+                reminder.sent_at = now
+                completed.append(ReminderSchema.model_validate(reminder))
+        return sorted(completed, key=lambda reminder: (reminder.remind_at, reminder.id))
+
+    async def release_reminders(self, ids: list[int], sent_at: datetime.datetime | None = None):
+        for id_ in ids:
+            reminder = self.reminders.get(id_)
+            if reminder is None or reminder.sent_at != sent_at:
+                continue
+            if reminder.sent_at is not None:
+                insort(self._pending, (reminder.remind_at, reminder.id))
+            reminder.claimed_until = reminder.sent_at = None
+
+
+memory_repository = InMemoryRepository()
@@ -1,13 +1,76 @@
 import datetime
 import uuid
 
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Date, UUID
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Date, UUID, Index, UniqueConstraint, \
+    text, BigInteger, DDL, event
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred
 
 from app.database import Base
 
+# Конфигурация полнотекстового поиска: без стемминга, одинаково для русского и английского
+SEARCH_CONFIG = 'simple'
+
+SEARCH_VECTOR_FUNCTION = DDL(f"""
+CREATE OR REPLACE FUNCTION tasks_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.description, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+""")
+
+SEARCH_VECTOR_TRIGGER = DDL("""
+CREATE TRIGGER tasks_search_vector_update BEFORE INSERT OR UPDATE OF title, description ON tasks
+FOR EACH ROW EXECUTE FUNCTION tasks_search_vector_update()
+""")
+
+# Ревизия - id транзакции: одна на транзакцию и без общей блокировки, параллельные записи друг друга не ждут.
+# Ревизии растут в порядке начала транзакций, а не коммитов, поэтому лента изменений отдает только
+# ревизии ниже CHANGE_HORIZON: все транзакции с меньшим id уже завершены, и позже таких ревизий не появится
+CHANGE_REVISION_FUNCTION = DDL("""
+CREATE OR REPLACE FUNCTION change_revision() RETURNS bigint AS $$
+    SELECT pg_current_xact_id()::text::bigint
+$$ LANGUAGE sql VOLATILE
+""")
+
+CHANGE_HORIZON = text('SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint')
+
+TRACK_CHANGE_FUNCTION = DDL("""
+CREATE OR REPLACE FUNCTION track_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO tombstones (table_name, row_id, revision) VALUES (TG_TABLE_NAME, OLD.id, change_revision());
+        RETURN OLD;
+    END IF;
+    NEW.revision := change_revision();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+""")
+
+
+def track_changes_triggers(table: str) -> list[DDL]:
+    return [
+        DDL(f'CREATE TRIGGER {table}_track_change BEFORE INSERT OR UPDATE ON {table} '
+            'FOR EACH ROW EXECUTE FUNCTION track_change()'),
+        DDL(f'CREATE TRIGGER {table}_track_delete AFTER DELETE ON {table} '
+            'FOR EACH ROW EXECUTE FUNCTION track_change()'),
+    ]
+
 
 class Task(Base):
     __tablename__ = 'tasks'
+    __table_args__ = (
+        Index('ix_tasks_created_at_id', 'created_at', 'id'),
+        Index('ix_tasks_project_id_created_at_id', 'project_id', 'created_at', 'id'),
+        Index('ix_tasks_my_day_date_undone', 'my_day_date', postgresql_where=text('NOT done')),
+        Index('ix_tasks_search_vector', 'search_vector', postgresql_using='gin'),
+        Index('ix_tasks_title_trgm', 'title', postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'}),
+        Index('ix_tasks_revision_id', 'revision', 'id'),
+    )
     id = Column(Integer, autoincrement=True, primary_key=True)
     title = Column(String, nullable=False)
     description = Column(String)
@@ -16,31 +79,92 @@ class Task(Base):
     scheduled_at = Column(DateTime)
     my_day_date = Column(Date)
     project_id = Column(Integer, ForeignKey('projects.id', ondelete='CASCADE'))
+    # Заполняется триггером tasks_search_vector_update, в том числе при COPY
+    search_vector = deferred(Column(TSVECTOR))
+    # Ревизия последнего изменения, ставится триггером track_change
+    revision = Column(BigInteger, nullable=False, server_default='0')
+
+
+event.listen(Base.metadata, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+event.listen(Base.metadata, 'before_create', CHANGE_REVISION_FUNCTION)
+event.listen(Base.metadata, 'before_create', TRACK_CHANGE_FUNCTION)
+event.listen(Task.__table__, 'after_create', SEARCH_VECTOR_FUNCTION)
+event.listen(Task.__table__, 'after_create', SEARCH_VECTOR_TRIGGER)
 
 
 class Project(Base):
     __tablename__ = 'projects'
+    __table_args__ = (
+        Index('ix_projects_revision_id', 'revision', 'id'),
+    )
     id = Column(Integer, autoincrement=True, primary_key=True)
     title = Column(String, nullable=False)
     description = Column(String)
+    revision = Column(BigInteger, nullable=False, server_default='0')
 
 
 class TaskTag(Base):
     __tablename__ = 'task_tags'
+    __table_args__ = (
+        UniqueConstraint('task_id', 'tag_id', name='uq_task_tags_task_id_tag_id'),
+        Index('ix_task_tags_tag_id_task_id', 'tag_id', 'task_id'),
+        Index('ix_task_tags_revision_id', 'revision', 'id'),
+    )
     id = Column(Integer, autoincrement=True, primary_key=True)
     task_id = Column(Integer, ForeignKey('tasks.id', ondelete='CASCADE'))
     tag_id = Column(Integer, ForeignKey('tags.id', ondelete='CASCADE'))
+    revision = Column(BigInteger, nullable=False, server_default='0')
 
 
 class Tag(Base):
     __tablename__ = 'tags'
+    __table_args__ = (
+        Index('ix_tags_revision_id', 'revision', 'id'),
+    )
     id = Column(Integer, autoincrement=True, primary_key=True)
     title = Column(String, nullable=False)
     description = Column(String)
+    revision = Column(BigInteger, nullable=False, server_default='0')
+
+
+# Порядок строк одной ревизии в ленте изменений: сначала родители, потом ссылки на них
+TRACKED_MODELS = (Project, Tag, Task, TaskTag)
+
+for model in TRACKED_MODELS:
+    for trigger in track_changes_triggers(model.__tablename__):
+        event.listen(model.__table__, 'after_create', trigger)
 
 
 class Reminder(Base):
     __tablename__ = 'reminders'
-    id = Column(Integer, primary_key=True)
-    task_id = ForeignKey('tasks.id', ondelete='CASCADE')
-    remind_at = Column(DateTime)
+    __table_args__ = (
+        # Только неотправленные: диспетчер читает начало индекса, отправленные напоминания его не раздувают
+        Index('ix_reminders_pending_remind_at', 'remind_at', postgresql_where=text('sent_at IS NULL')),
+        Index('ix_reminders_task_id', 'task_id'),
+    )
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    task_id = Column(Integer, ForeignKey('tasks.id', ondelete='CASCADE'), nullable=False)
+    remind_at = Column(DateTime, nullable=False)
+    # Воркер, забравший напоминание, держит его до этого момента; потом его может забрать другой
+    claimed_until = Column(DateTime)
+    sent_at = Column(DateTime)
+
+
+class Tombstone(Base):
+    """
+    Запись об удалении строки отслеживаемой таблицы, для синхронизации клиентов
+    """
+    __tablename__ = 'tombstones'
+    __table_args__ = (
+        Index('ix_tombstones_revision_id', 'revision', 'id'),
+    )
+    id = Column(BigInteger, autoincrement=True, primary_key=True)
+    table_name = Column(String, nullable=False)
+    row_id = Column(Integer, nullable=False)
+    revision = Column(BigInteger, nullable=False)
+
+
+class TableVersion(Base):
+    __tablename__ = 'table_versions'
+    name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
@@ -0,0 +1,157 @@
+import asyncio
+import datetime
+import heapq
+import logging
+from abc import ABC, abstractmethod
+
+from app.config import REMINDER_WINDOW, REMINDER_LEASE, REMINDER_BATCH_SIZE, REMINDER_SINK
+from app.tasks.serializers import ReminderSchema
+
+logger = logging.getLogger(__name__)
+
+
+class ReminderSink(ABC):
+    """
+    Получатель наступивших напоминаний. Ошибка в deliver возвращает пачку в очередь на повтор
+    """
+    @abstractmethod
+    async def deliver(self, reminders: list[ReminderSchema]):
+        ...
+
+
+class LogSink(ReminderSink):
+    async def deliver(self, reminders: list[ReminderSchema]):
+        for reminder in reminders:
+            logger.info('reminder %d for task %d at %s', reminder.id, reminder.task_id, reminder.remind_at)
+
+
+class LocalSink(ReminderSink):
+    """
+    Складывает напоминания в очередь процесса, для тестов и встроенных потребителей
+    """
+    def __init__(self):
+        self.queue: asyncio.Queue[ReminderSchema] = asyncio.Queue()
+
+    async def deliver(self, reminders: list[ReminderSchema]):
+        for reminder in reminders:
+            self.queue.put_nowait(reminder)
+
+
+SINKS = {'log': LogSink, 'local': LocalSink}
+
+
+class ReminderDispatcher:
+    """
+    Отправляет напоминания из цикла событий приложения. Раз в полокна забирает из базы напоминания,
+    которые наступят в ближайшие window секунд, через FOR UPDATE SKIP LOCKED и аренду claimed_until,
+    так что несколько воркеров делят таблицу без двойной отправки. Забранные ждут своего времени
+    в куче по remind_at, и до следующего опроса диспетчер спит до ближайшего из них.
+    Перед отправкой напоминание атомарно помечается sent_at: удаленные и перенесенные после захвата
+    не отправятся. Если воркер упал, его аренда истекает и напоминания забирает другой
+    """
+    def __init__(self,
+                 sink: ReminderSink,
+                 window: float = REMINDER_WINDOW,
+                 lease: float = REMINDER_LEASE,
+                 batch_size: int = REMINDER_BATCH_SIZE):
+        self.sink = sink
+        self.window = datetime.timedelta(seconds=window)
+        self.lease = datetime.timedelta(seconds=max(lease, window))
+        self.batch_size = batch_size
+        self._heap: list[tuple[datetime.datetime, int]] = []
+        self._scheduled: set[int] = set()
+        self._next_poll: datetime.datetime | None = None
+        self._horizon: datetime.datetime | None = None
+        self._poll_requested = False
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def scheduled(self) -> int:
+        return len(self._heap)
+
+    def wake(self, remind_at: datetime.datetime):
+        """
+        Вызывается после создания или переноса напоминания в этом процессе: если оно попадает
+        в уже опрошенное окно, диспетчер опрашивает базу сразу, не дожидаясь следующего опроса
+        """
+        if self._horizon is not None and remind_at <= self._horizon:
+            self._poll_requested = True
+            self._wakeup.set()
+
+    async def _claim(self, rep, now: datetime.datetime) -> int:
+        reminders = await rep.claim_reminders(now + self.window, now, now + self.lease, self.batch_size)
+        for reminder in reminders:
+            if reminder.id not in self._scheduled:
+                self._scheduled.add(reminder.id)
+                heapq.heappush(self._heap, (reminder.remind_at, reminder.id))
+        return len(reminders)
+
+    async def _fire(self, rep, now: datetime.datetime):
+        ids = []
+        while self._heap and self._heap[0][0] <= now:
+            _, id_ = heapq.heappop(self._heap)
+            self._scheduled.discard(id_)
+            ids.append(id_)
+        if not ids:
+            return
+        reminders = await rep.complete_reminders(ids, now)
+        if not reminders:
+            return
+        try:
+            await self.sink.deliver(reminders)
+        except Exception:
+            logger.exception('failed to deliver %d reminders, releasing them for retry', len(reminders))
+            await rep.release_reminders([reminder.id for reminder in reminders], sent_at=now)
+
+    async def tick(self, rep, now: datetime.datetime) -> float:
+        """
+        Один шаг: при необходимости дозабирает окно и отправляет наступившие.
+        Возвращает, сколько секунд можно спать до следующего шага
+        """
+        if self._poll_requested or self._next_poll is None or now >= self._next_poll:
+            self._poll_requested = False
+            claimed = await self._claim(rep, now)
+            self._horizon = now + self.window
+            # Полная пачка: в окне есть еще, забираем следующую сразу
+            self._next_poll = now if claimed == self.batch_size else now + self.window / 2
+        await self._fire(rep, now)
+        wake_at = self._next_poll
+        if self._heap:
+            wake_at = min(wake_at, self._heap[0][0])
+        return max((wake_at - now).total_seconds(), 0)
+
+    async def run(self, rep):
+        while True:
+            # Сбрасываем до шага: wake, пришедший во время шага, разбудит следующий
+            self._wakeup.clear()
+            try:
+                delay = await self.tick(rep, datetime.datetime.now())
+            except Exception:
+                logger.exception('reminder dispatch failed')
+                delay = self.window.total_seconds() / 2
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, rep):
+        self._task = asyncio.create_task(self.run(rep))
+
+    async def stop(self, rep):
+        """
+        Останавливает цикл и отпускает забранные, но не отправленные напоминания другим воркерам
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        ids = [id_ for _, id_ in self._heap]
+        self._heap.clear()
+        self._scheduled.clear()
+        self._next_poll = self._horizon = None
+        if ids:
+            await rep.release_reminders(ids)
+
+
+reminder_dispatcher = ReminderDispatcher(SINKS[REMINDER_SINK]())
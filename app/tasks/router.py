@@ -1,13 +1,23 @@
 import datetime
-from typing import Annotated
+from typing import Annotated, Literal
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, HTTPException
 from starlette.requests import Request
+from starlette.responses import StreamingResponse
 
-from app.dependencies import get_repository
-from app.helpers import get_response_class, pass_headers, ResponseWithHeaders
+from app.events import broadcaster
+from app.dependencies import get_repository, get_task_writer, get_page_params, get_search_page_params, has_query_params
+from app.helpers import render, conditional, Envelope, PageEnvelope, PageStream, Paged, decode_change_cursor
 from app.tasks.serializers import TaskCreateRequest, TaskSchema, ProjectSchema, ProjectCreateRequest, \
-    ProjectByIdResponse, TagSchema, TagResponse
+    ProjectByIdResponse, TagSchema, TagResponse, TaskFilters, PageParams, TaskPage, ImportSummary, TaskSearchHit, \
+    SearchPage, SearchPageParams, ReminderSchema, ReminderCreateRequest, TaskStatsResponse, ProjectStats, \
+    TaskCounts, MyDayStats, ChangesPage
+from app.config import AUTOCOMPLETE_LIMIT, PAGE_SIZE, MAX_PAGE_SIZE
+from app.tasks.autocomplete import tag_index, TagSuggestion
+from app.tasks.batching import WriteBatcher
+from app.tasks.stats import task_stats
+from app.tasks.importers import iter_lines, parse_csv, parse_ndjson, import_rows
+from app.tasks.exporters import format_ndjson, format_csv
 from app.tasks.use_cases import Repository
 
 router = APIRouter(
@@ -15,18 +25,19 @@ router = APIRouter(
 )
 
 
-@router.get('/',
-            response_class=get_response_class('task_list.html'),
-            response_model=ResponseWithHeaders[list[TaskSchema]])
-@pass_headers
-async def get_tasks(request: Request, rep: Annotated[Repository, Depends(get_repository)]) -> list[TaskSchema]:
-    all_tasks = await rep.get_tasks()
-    return all_tasks
+@router.get('/', response_model=PageEnvelope[list[TaskSchema]])
+@conditional('tasks', 'task_tags', 'tags')
+@render('task_list.html')
+async def get_tasks(request: Request,
+                    filters: Annotated[TaskFilters, Depends()],
+                    page: Annotated[PageParams, Depends(get_page_params)],
+                    rep: Annotated[Repository, Depends(get_repository)]) -> PageStream[TaskSchema]:
+    return TaskPage.stream(rep.stream_task_page(filters, page), page)
 
 
 @router.post('/',
-             response_model=ResponseWithHeaders[TaskSchema])
-@pass_headers
+             response_model=Envelope[TaskSchema])
+@render()
 async def create_task(request: Request,
                       task_create_request: TaskCreateRequest,
                       rep: Annotated[Repository, Depends(get_repository)]) -> TaskSchema:
@@ -39,66 +50,237 @@ async def create_task(request: Request,
     return task_schema
 
 
-@router.get('/{id_}', response_model=ResponseWithHeaders[TaskSchema])
-@pass_headers
-async def get_task(request: Request, id_: int, rep: Annotated[Repository, Depends(get_repository)]) -> TaskSchema:
+@router.post('/import', response_model=Envelope[ImportSummary])
+@render()
+async def import_tasks(request: Request,
+                       rep: Annotated[Repository, Depends(get_repository)],
+                       format_: Annotated[Literal['ndjson', 'csv'] | None, Query(alias='format')] = None
+                       ) -> ImportSummary:
+    """
+    Потоковый импорт задач из NDJSON или CSV, формат берется из параметра format или Content-Type
+    """
+    if format_ is None:
+        format_ = 'csv' if 'csv' in request.headers.get('content-type', '') else 'ndjson'
+    lines = iter_lines(request.stream())
+    rows = parse_csv(lines) if format_ == 'csv' else parse_ndjson(lines)
+    return await import_rows(rep, rows)
+
+
+@router.get('/export', response_class=StreamingResponse)
+async def export_tasks(filters: Annotated[TaskFilters, Depends()],
+                       rep: Annotated[Repository, Depends(get_repository)],
+                       format_: Annotated[Literal['ndjson', 'csv'], Query(alias='format')] = 'ndjson',
+                       expand: bool = False) -> StreamingResponse:
+    """
+    Полная выгрузка задач потоком через серверный курсор, память не зависит от числа задач
+    """
+    batches = rep.stream_tasks(filters, expand)
+    if format_ == 'csv':
+        body, media_type = format_csv(batches, expand), 'text/csv; charset=utf-8'
+    else:
+        body, media_type = format_ndjson(batches), 'application/x-ndjson'
+    return StreamingResponse(body, media_type=media_type,
+                             headers={'Content-Disposition': f'attachment; filename="tasks.{format_}"'})
+
+
+@router.get('/search', response_model=PageEnvelope[list[TaskSearchHit]], dependencies=[Depends(has_query_params)])
+@conditional('tasks', 'task_tags', 'tags')
+@render()
+async def search_tasks(request: Request,
+                       filters: Annotated[TaskFilters, Depends()],
+                       page: Annotated[SearchPageParams, Depends(get_search_page_params)],
+                       rep: Annotated[Repository, Depends(get_repository)],
+                       q: Annotated[str | None, Query(max_length=256)] = None,
+                       tag_id: int | None = None) -> SearchPage:
+    """
+    Поиск задач по названию и описанию, самые релевантные первыми
+    """
+    hits = await rep.search_tasks(q, filters, tag_id, page)
+    return SearchPage.from_hits(hits, page)
+
+
+@router.get('/events', response_class=StreamingResponse)
+async def stream_events(tables: Annotated[list[Literal['tasks', 'projects', 'tags']] | None, Query()] = None
+                        ) -> StreamingResponse:
+    """
+    Server-sent events об изменениях задач, проектов и тегов. Соединение с базой не держит:
+    события приходят от общего для воркера LISTEN
+    """
+    return StreamingResponse(broadcaster.stream(set(tables) if tables else None), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@router.get('/changes', response_model=Envelope[ChangesPage])
+@render()
+async def get_changes(request: Request,
+                      rep: Annotated[Repository, Depends(get_repository)],
+                      since: Annotated[int | None, Query(ge=0)] = None,
+                      cursor: str | None = None,
+                      limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = PAGE_SIZE) -> ChangesPage:
+    """
+    Задачи, проекты, теги и связи, измененные после ревизии since, и удаленные после нее.
+    Без since отдает все с начала; следующая пачка той же выборки запрашивается по cursor.
+    Без 304 по версиям таблиц: лента обрезана по самой старой открытой транзакции, и строки
+    за этой границей появляются, когда та завершается, даже если версии таблиц не менялись
+    """
+    if cursor is not None:
+        after = decode_change_cursor(cursor)
+        since = after[0] - 1
+    elif since is not None:
+        after = (since, len(ChangesPage.SOURCES), 0)
+    else:
+        after = (-1, len(ChangesPage.SOURCES), 0)
+    changes = await rep.get_changes(after, limit)
+    return ChangesPage.from_changes(changes, limit, max(since or 0, 0))
+
+
+@router.get('/stats', response_model=Envelope[TaskStatsResponse])
+@render()
+async def get_task_stats(request: Request,
+                         rep: Annotated[Repository, Depends(get_repository)],
+                         date: datetime.date | None = None) -> TaskStatsResponse:
+    """
+    Открытые и выполненные задачи по проектам и в My Day на дату (по умолчанию сегодня) из счетчиков в памяти
+    """
+    if not task_stats.loaded:
+        await task_stats.refresh(rep)
+    date = date or datetime.date.today()
+    projects = [ProjectStats(project_id=project.id, title=project.title, **task_stats.project(project.id))
+                for project in await rep.get_projects()]
+    return TaskStatsResponse(
+        projects=projects,
+        no_project=TaskCounts(**task_stats.project(None)),
+        my_day=MyDayStats(date=date, **task_stats.my_day(date)),
+    )
+
+
+@router.get('/{id_}', response_model=Envelope[TaskSchema])
+@conditional('tasks', 'task_tags', 'tags')
+@render()
+async def get_task(request: Request,
+                   id_: int,
+                   rep: Annotated[Repository, Depends(get_repository)]) -> TaskSchema:
     task = await rep.get_task(id_)
     return TaskSchema(**task.__dict__)
 
 
-@router.post('/done/{task_id}', response_model=ResponseWithHeaders[TaskSchema])
-@pass_headers
+@router.post('/done/{task_id}', response_model=Envelope[TaskSchema])
+@render()
 async def done_task(request: Request,
                     task_id: int,
-                    rep: Annotated[Repository, Depends(get_repository)]) -> TaskSchema:
-    return await rep.getting_done(task_id)
+                    writer: Annotated[Repository | WriteBatcher, Depends(get_task_writer)]) -> TaskSchema:
+    task = await writer.getting_done(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail='Task not found')
+    return task
 
 
-@router.post('/undone/{task_id}', response_model=ResponseWithHeaders[TaskSchema])
-@pass_headers
+@router.post('/undone/{task_id}', response_model=Envelope[TaskSchema])
+@render()
 async def undone_task(request: Request,
                       task_id: int,
-                      rep: Annotated[Repository, Depends(get_repository)]) -> TaskSchema:
-    return await rep.getting_done(task_id, done=False)
+                      writer: Annotated[Repository | WriteBatcher, Depends(get_task_writer)]) -> TaskSchema:
+    task = await writer.getting_done(task_id, done=False)
+    if task is None:
+        raise HTTPException(status_code=404, detail='Task not found')
+    return task
 
 
 @router.delete('/{id_}')
-@pass_headers
+@render()
 async def delete_task(request: Request, id_: int, rep: Annotated[Repository, Depends(get_repository)]):
     await rep.delete_task(id_)
 
 
-@router.get('/projects/', response_model=ResponseWithHeaders[list[ProjectSchema]],
-            response_class=get_response_class('project_list.html'))
-@pass_headers
-async def get_projects(request: Request, rep: Annotated[Repository, Depends(get_repository)]) -> list[ProjectSchema]:
+@router.get('/{id_}/reminders', response_model=Envelope[list[ReminderSchema]])
+@render()
+async def get_reminders(request: Request,
+                        id_: int,
+                        rep: Annotated[Repository, Depends(get_repository)]) -> list[ReminderSchema]:
+    return await rep.get_reminders(id_)
+
+
+@router.post('/{id_}/reminders', response_model=Envelope[ReminderSchema])
+@render()
+async def create_reminder(request: Request,
+                          id_: int,
+                          reminder_create_request: ReminderCreateRequest,
+                          rep: Annotated[Repository, Depends(get_repository)]) -> ReminderSchema:
+    reminder = await rep.create_reminder(id_, reminder_create_request.remind_at)
+    if reminder is None:
+        raise HTTPException(status_code=404, detail='Task not found')
+    return reminder
+
+
+@router.put('/reminders/{id_}', response_model=Envelope[ReminderSchema])
+@render()
+async def update_reminder(request: Request,
+                          id_: int,
+                          reminder_create_request: ReminderCreateRequest,
+                          rep: Annotated[Repository, Depends(get_repository)]) -> ReminderSchema:
+    reminder = await rep.update_reminder(id_, reminder_create_request.remind_at)
+    if reminder is None:
+        raise HTTPException(status_code=404, detail='Reminder not found')
+    return reminder
+
+
+@router.delete('/reminders/{id_}')
+@render()
+async def delete_reminder(request: Request, id_: int, rep: Annotated[Repository, Depends(get_repository)]):
+    await rep.delete_reminder(id_)
+
+
+@router.get('/projects/', response_model=Envelope[list[ProjectSchema]])
+@conditional('projects')
+@render('project_list.html')
+async def get_projects(request: Request,
+                       rep: Annotated[Repository, Depends(get_repository)]) -> list[ProjectSchema]:
     all_projects = await rep.get_projects()
     return all_projects
 
 
-@router.get('/projects/{id_}', response_model=ResponseWithHeaders[ProjectSchema])
-@pass_headers
+@router.get('/projects/{id_}', response_model=PageEnvelope[ProjectByIdResponse])
+@conditional('projects', 'tasks', 'task_tags', 'tags')
+@render()
 async def get_project(request: Request,
                       id_: int,
-                      rep: Annotated[Repository, Depends(get_repository)]) -> ProjectByIdResponse:
+                      page: Annotated[PageParams, Depends(get_page_params)],
+                      rep: Annotated[Repository, Depends(get_repository)]) -> Paged[ProjectByIdResponse]:
+    """
+    Проект со страницей его задач, next_cursor продолжает список задач
+    """
     project = await rep.get_project(id_)
-    tasks = await rep.get_tasks_by_project_id(id_)
-    return ProjectByIdResponse(**project.__dict__, tasks=tasks)
+    tasks = await rep.get_tasks_by_project_id(id_, page=page)
+    return Paged[ProjectByIdResponse](item=ProjectByIdResponse(**project.__dict__, tasks=tasks),
+                                      next_cursor=TaskPage.from_tasks(tasks, page).next_cursor)
 
 
 @router.get('/tasks-by-project/{id_}',
-            response_model=ResponseWithHeaders[list[TaskSchema]],
-            response_class=get_response_class('task_list.html'))
-@pass_headers
+            response_model=PageEnvelope[list[TaskSchema]])
+@conditional('tasks', 'task_tags', 'tags')
+@render('task_list.html')
 async def get_tasks_by_project(request: Request,
                                id_: int,
-                               rep: Annotated[Repository, Depends(get_repository)]) -> list[TaskSchema]:
-    tasks = await rep.get_tasks_by_project_id(id_)
-    return tasks
-
-
-@router.post('/projects', response_model=ResponseWithHeaders[ProjectSchema])
-@pass_headers
+                               filters: Annotated[TaskFilters, Depends()],
+                               page: Annotated[PageParams, Depends(get_page_params)],
+                               rep: Annotated[Repository, Depends(get_repository)]) -> PageStream[TaskSchema]:
+    return TaskPage.stream(rep.stream_task_page(filters, page, project_id=id_), page)
+
+
+@router.get('/tasks-by-tag/{id_}',
+            response_model=PageEnvelope[list[TaskSchema]])
+@conditional('tasks', 'task_tags', 'tags')
+@render('task_list.html')
+async def get_tasks_by_tag(request: Request,
+                           id_: int,
+                           filters: Annotated[TaskFilters, Depends()],
+                           page: Annotated[PageParams, Depends(get_page_params)],
+                           rep: Annotated[Repository, Depends(get_repository)]) -> PageStream[TaskSchema]:
+    return TaskPage.stream(rep.stream_task_page(filters, page, tag_id=id_), page)
+
+
+@router.post('/projects', response_model=Envelope[ProjectSchema])
+@render()
 async def create_project(request: Request,
                          project_create_request: ProjectCreateRequest,
                          rep: Annotated[Repository, Depends(get_repository)]) -> ProjectSchema:
@@ -117,36 +299,62 @@ async def delete_project(id_: int, rep: Annotated[Repository, Depends(get_reposi
 
 
 @router.post('/projects/{task_id}/{project_id}')
-async def attach_project_to_task(task_id: int, project_id: int, rep: Annotated[Repository, Depends(get_repository)]):
-    await rep.attach_project_task(task_id, project_id)
-
-
-@router.get('/tags/', response_model=ResponseWithHeaders[list[TagSchema]])
-@pass_headers
-async def get_tags(request: Request, rep: Annotated[Repository, Depends(get_repository)]) -> list[TagSchema]:
+async def attach_project_to_task(task_id: int,
+                                 project_id: int,
+                                 writer: Annotated[Repository | WriteBatcher, Depends(get_task_writer)]):
+    if await writer.attach_project_task(task_id, project_id) is None:
+        raise HTTPException(status_code=404, detail='Task not found')
+
+
+@router.get('/tags/', response_model=Envelope[list[TagSchema]])
+@conditional('tags')
+@render()
+async def get_tags(request: Request,
+                   rep: Annotated[Repository, Depends(get_repository)]) -> list[TagSchema]:
     all_tags = await rep.get_tags()
     return all_tags
 
 
-@router.get('/tags/{id_}', response_model=ResponseWithHeaders[TagSchema])
-@pass_headers
-async def get_tag(request: Request, id_: int, rep: Annotated[Repository, Depends(get_repository)]) -> TagResponse:
+@router.get('/tags/autocomplete', response_model=Envelope[list[TagSuggestion]])
+@render()
+async def autocomplete_tags(request: Request,
+                            rep: Annotated[Repository, Depends(get_repository)],
+                            prefix: str = '',
+                            limit: Annotated[int, Query(ge=1, le=50)] = AUTOCOMPLETE_LIMIT) -> list[TagSuggestion]:
+    if not tag_index.loaded:
+        await tag_index.refresh(rep)
+    return tag_index.complete(prefix, limit)
+
+
+@router.get('/tags/{id_}', response_model=PageEnvelope[TagResponse])
+@conditional('tags', 'tasks', 'task_tags')
+@render()
+async def get_tag(request: Request,
+                  id_: int,
+                  page: Annotated[PageParams, Depends(get_page_params)],
+                  rep: Annotated[Repository, Depends(get_repository)]) -> Paged[TagResponse]:
+    """
+    Тег со страницей его задач, next_cursor продолжает список задач
+    """
     tag = await rep.get_tag(id_)
-    tasks = await rep.get_tasks_by_tag_id(id_)
+    tasks = await rep.get_tasks_by_tag_id(id_, page=page)
 
-    return TagResponse(**tag.__dict__, tasks=tasks)
+    return Paged[TagResponse](item=TagResponse(**tag.__dict__, tasks=tasks),
+                              next_cursor=TaskPage.from_tasks(tasks, page).next_cursor)
 
 
-@router.post('/tags', response_model=ResponseWithHeaders[TagSchema])
-@pass_headers
+@router.post('/tags', response_model=Envelope[TagSchema])
+@render()
 async def create_tag(request: Request, tag: str, rep: Annotated[Repository, Depends(get_repository)]) -> TagSchema:
     tag = await rep.create_tag(tag)
     return tag
 
 
 @router.post('/tags/{task_id}/{tag_id}')
-async def attach_task_to_tag(task_id: int, tag_id: int, rep: Annotated[Repository, Depends(get_repository)]):
-    await rep.attach_task_to_tag(task_id, tag_id)
+async def attach_task_to_tag(task_id: int,
+                             tag_id: int,
+                             writer: Annotated[Repository | WriteBatcher, Depends(get_task_writer)]):
+    await writer.attach_task_to_tag(task_id, tag_id)
 
 
 @router.delete('/tags/{id}')
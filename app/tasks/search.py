@@ -0,0 +1,36 @@
+import html
+import re
+
+# Маркеры совпадений для ts_headline: символы из области частного использования не встречаются в тексте задач,
+# поэтому текст можно экранировать целиком и уже потом превратить маркеры в <mark>
+MARK_START = '\ue000'
+MARK_STOP = '\ue001'
+HEADLINE_OPTIONS = f'StartSel={MARK_START}, StopSel={MARK_STOP}, MaxFragments=2, MaxWords=20, MinWords=5'
+
+WORD = re.compile(r'\w+')
+
+
+def search_terms(q: str) -> list[str]:
+    return [term.lower() for term in WORD.findall(q)][:16]
+
+
+def prefix_tsquery(terms: list[str]) -> str:
+    """
+    Все слова запроса должны встретиться, каждое - как префикс: 'напом' найдет 'напомнить'.
+    В запрос попадают только буквы и цифры, так что синтаксис tsquery из пользовательского ввода не сломать
+    """
+    return ' & '.join(f'{term}:*' for term in terms)
+
+
+def highlight(text: str | None) -> str:
+    escaped = html.escape(text or '')
+    return escaped.replace(MARK_START, '<mark>').replace(MARK_STOP, '</mark>')
+
+
+def mark_terms(text: str | None, terms: list[str]) -> str:
+    """
+    Ставит маркеры вокруг слов, начинающихся с одного из слов запроса, как ts_headline
+    """
+    prefixes = tuple(terms)
+    return WORD.sub(lambda match: f'{MARK_START}{match.group()}{MARK_STOP}'
+                    if match.group().lower().startswith(prefixes) else match.group(), text or '')
@@ -1,9 +1,10 @@
 import datetime
-from typing import Optional, Any
+from typing import Optional, Any, AsyncIterator, ClassVar
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 
-from app.helpers import ModelConfig
+from app.helpers import ModelConfig, Page, PageStream, encode_cursor, encode_rank_cursor, encode_change_cursor, \
+    to_local_naive
 
 
 class TagSchema(BaseModel, ModelConfig):
@@ -22,6 +23,54 @@ class TaskSchema(BaseModel, ModelConfig):
     my_day_date: Optional[datetime.date]
     project_id: Optional[int] = None
     tags: list[TagSchema] = []
+    # Ревизия строки для ключа кэша фрагментов, в ответы API не попадает
+    revision: Optional[int] = Field(None, exclude=True)
+
+
+class TaskFilters(BaseModel):
+    done: Optional[bool] = None
+    project_id: Optional[int] = None
+    scheduled_from: Optional[datetime.datetime] = None
+    scheduled_to: Optional[datetime.datetime] = None
+    my_day_date: Optional[datetime.date] = None
+
+
+class PageParams(BaseModel):
+    limit: int
+    after: Optional[tuple[datetime.datetime, int]] = None
+
+
+class TaskPage(Page[TaskSchema]):
+    @classmethod
+    def from_tasks(cls, tasks: list[TaskSchema], page: PageParams) -> 'TaskPage':
+        next_cursor = None
+        if tasks and len(tasks) == page.limit:
+            next_cursor = encode_cursor(tasks[-1].created_at, tasks[-1].id)
+        return cls(items=tasks, next_cursor=next_cursor)
+
+    @classmethod
+    def stream(cls, chunks: AsyncIterator[list[TaskSchema]], page: PageParams) -> PageStream[TaskSchema]:
+        return PageStream(chunks, lambda tasks: cls.from_tasks(tasks, page))
+
+
+class SearchPageParams(BaseModel):
+    limit: int
+    after: Optional[tuple[float, int]] = None
+
+
+class TaskSearchHit(TaskSchema):
+    rank: float
+    title_highlight: str
+    snippet: str
+
+
+class SearchPage(Page[TaskSearchHit]):
+    @classmethod
+    def from_hits(cls, hits: list[TaskSearchHit], page: SearchPageParams) -> 'SearchPage':
+        next_cursor = None
+        if hits and len(hits) == page.limit:
+            next_cursor = encode_rank_cursor(hits[-1].rank, hits[-1].id)
+        return cls(items=hits, next_cursor=next_cursor)
 
 
 class TagResponse(BaseModel):
@@ -39,10 +88,83 @@ class TaskCreateRequest(BaseModel):
     my_day_date: Optional[datetime.date]
 
 
+class TaskCounts(BaseModel):
+    open: int
+    done: int
+
+
+class ProjectStats(TaskCounts):
+    project_id: int
+    title: str
+
+
+class MyDayStats(TaskCounts):
+    date: datetime.date
+
+
+class TaskStatsResponse(BaseModel):
+    projects: list[ProjectStats]
+    no_project: TaskCounts
+    my_day: MyDayStats
+
+
+class ReminderSchema(BaseModel, ModelConfig):
+    id: int
+    task_id: int
+    remind_at: datetime.datetime
+    sent_at: Optional[datetime.datetime] = None
+
+
+class ReminderCreateRequest(BaseModel):
+    remind_at: datetime.datetime
+
+    @field_validator('remind_at')
+    @classmethod
+    def to_local_time(cls, value: datetime.datetime) -> datetime.datetime:
+        return to_local_naive(value)
+
+
+class TaskImportRow(TaskCreateRequest):
+    done: bool = False
+    created_at: Optional[datetime.datetime] = None
+    scheduled_at: Optional[datetime.datetime] = None
+    my_day_date: Optional[datetime.date] = None
+    project_id: Optional[int] = None
+    project: Optional[str] = None
+    tags: list[str] = []
+
+
+class TaskExportRow(BaseModel):
+    id: int
+    title: str
+    description: Optional[str]
+    done: Optional[bool]
+    created_at: Optional[datetime.datetime]
+    scheduled_at: Optional[datetime.datetime]
+    my_day_date: Optional[datetime.date]
+    project_id: Optional[int]
+    project: Optional[str] = None
+    tags: Optional[list[str]] = None
+
+
+class ImportLineError(BaseModel):
+    line: int
+    error: str
+
+
+class ImportSummary(BaseModel):
+    received: int = 0
+    imported: int = 0
+    failed: int = 0
+    errors: list[ImportLineError] = []
+    errors_truncated: bool = False
+
+
 class ProjectSchema(BaseModel, ModelConfig):
     id: Optional[int] = None
     title: str
     description: str
+    revision: Optional[int] = Field(None, exclude=True)
 
 
 class ProjectCreateRequest(BaseModel):
@@ -55,3 +177,49 @@ class ProjectByIdResponse(BaseModel, ModelConfig):
     title: str
     description: str
     tasks: list[TaskSchema]
+
+
+class TaskTagSchema(BaseModel, ModelConfig):
+    id: int
+    task_id: int
+    tag_id: int
+
+
+class TombstoneSchema(BaseModel):
+    table: str
+    id: int
+
+
+# (ревизия, номер таблицы в порядке ленты, id, строка) - ключ keyset-пагинации ленты и сама запись
+Change = tuple[int, int, int, BaseModel]
+
+
+class ChangesPage(BaseModel):
+    """
+    Пачка изменений после ревизии since. revision - граница, до которой включительно клиент получил
+    все изменения, ее передают как since в следующий раз. Если есть next_cursor, пачка не последняя
+    """
+    projects: list[ProjectSchema] = []
+    tags: list[TagSchema] = []
+    tasks: list[TaskSchema] = []
+    task_tags: list[TaskTagSchema] = []
+    deleted: list[TombstoneSchema] = []
+    revision: int
+    next_cursor: Optional[str] = None
+
+    # Поля в порядке номеров таблиц в ключе ленты
+    SOURCES: ClassVar[tuple[str, ...]] = ('projects', 'tags', 'tasks', 'task_tags', 'deleted')
+
+    @classmethod
+    def from_changes(cls, changes: list[Change], limit: int, since: int) -> 'ChangesPage':
+        page = cls(revision=since)
+        for _, source, _, item in changes:
+            getattr(page, cls.SOURCES[source]).append(item)
+        if changes:
+            revision, source, id_, _ = changes[-1]
+            page.revision = revision
+            if len(changes) == limit:
+                # Последняя ревизия могла попасть в пачку не целиком
+                page.revision = max(since, revision - 1)
+                page.next_cursor = encode_change_cursor(revision, source, id_)
+        return page
@@ -0,0 +1,104 @@
+import asyncio
+import datetime
+import logging
+from collections import defaultdict
+
+from app.config import STATS_RECONCILE_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# (project_id, my_day_date, done) - все, от чего зависят счетчики задачи
+TaskState = tuple[int | None, datetime.date | None, bool]
+
+
+def task_state(task) -> TaskState:
+    return task.project_id, task.my_day_date, bool(task.done)
+
+
+class TaskStats:
+    """
+    Счетчики открытых и выполненных задач по проектам и по дате My Day. Репозиторий после коммита
+    передает сюда старое и новое состояние измененной задачи, так что чтение не ходит в базу.
+    Массовые изменения (импорт, удаление проекта) сбрасывают счетчики, и они пересчитываются
+    одним сгруппированным запросом. Тот же пересчет раз в STATS_RECONCILE_INTERVAL секунд исправляет
+    расхождения и подтягивает изменения из других воркеров
+    """
+    def __init__(self):
+        self.by_project: dict[int | None, list[int]] = defaultdict(lambda: [0, 0])
+        self.by_my_day: dict[datetime.date, list[int]] = defaultdict(lambda: [0, 0])
+        self.versions: dict[str, int] = {}
+        self.loaded = False
+        # Растет с каждым изменением счетчиков, чтобы пересчет видел изменения, пришедшие во время запроса
+        self.generation = 0
+
+    def replace(self,
+                by_project: list[tuple[int | None, bool, int]],
+                by_my_day: list[tuple[datetime.date, bool, int]]):
+        self.by_project.clear()
+        self.by_my_day.clear()
+        for project_id, done, count in by_project:
+            self.by_project[project_id][bool(done)] += count
+        for my_day_date, done, count in by_my_day:
+            self.by_my_day[my_day_date][bool(done)] += count
+        self.loaded = True
+
+    def add(self, state: TaskState, delta: int = 1):
+        self.generation += 1
+        project_id, my_day_date, done = state
+        self.by_project[project_id][done] += delta
+        if my_day_date is not None:
+            self.by_my_day[my_day_date][done] += delta
+
+    def change(self, old: TaskState | None, new: TaskState | None):
+        if old is not None:
+            self.add(old, -1)
+        if new is not None:
+            self.add(new)
+
+    def invalidate(self):
+        self.generation += 1
+        self.loaded = False
+
+    def reset(self):
+        self.replace([], [])
+        self.versions = {}
+        self.loaded = False
+
+    def project(self, project_id: int | None) -> dict[str, int]:
+        open_, done = self.by_project.get(project_id, (0, 0))
+        return {'open': open_, 'done': done}
+
+    def my_day(self, date: datetime.date) -> dict[str, int]:
+        open_, done = self.by_my_day.get(date, (0, 0))
+        return {'open': open_, 'done': done}
+
+    async def refresh(self, rep):
+        """
+        Пересчитывает счетчики, если задачи менялись с прошлого пересчета или счетчики сброшены.
+        Изменение, примененное во время запроса, могло попасть в снимок, а могло и нет, поэтому такой
+        снимок не заменяет верные счетчики, а сброшенные заменяет, оставаясь неподтвержденным
+        до следующего пересчета
+        """
+        versions = await rep.get_versions(('tasks',))
+        if self.loaded and versions == self.versions:
+            return
+        generation = self.generation
+        by_project, by_my_day = await rep.get_task_stats()
+        if generation != self.generation:
+            if not self.loaded:
+                self.replace(by_project, by_my_day)
+                self.loaded = False
+            return
+        self.replace(by_project, by_my_day)
+        self.versions = versions
+
+    async def reconcile_periodically(self, rep, interval: float = STATS_RECONCILE_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh(rep)
+            except Exception:
+                logger.exception('%s refresh failed', type(self).__name__)
+
+
+task_stats = TaskStats()
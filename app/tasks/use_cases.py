@@ -1,46 +1,276 @@
-from sqlalchemy import select, insert, update, delete
+import datetime
+from collections import defaultdict, Counter
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Any
 
-from app.tasks.models import Task, Project, Tag, TaskTag
-from app.tasks.serializers import TaskSchema, ProjectSchema, TagSchema
+from sqlalchemy import select, insert, update, delete, tuple_, Select, Integer, String, any_, bindparam, func, \
+    literal, or_, exists, Float, cast, DateTime, Boolean
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert, aggregate_order_by
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cache import cached, single_flight, invalidate, on_commit
+from app.config import EXPORT_BATCH_SIZE, STREAM_CHUNK_SIZE
+from app.events import notify
+from app.tasks.autocomplete import tag_index
+from app.tasks.models import Task, Project, Tag, TaskTag, TableVersion, Reminder, Tombstone, TRACKED_MODELS, \
+    SEARCH_CONFIG, CHANGE_HORIZON
+from app.tasks.reminders import reminder_dispatcher
+from app.tasks.stats import task_stats, task_state, TaskState
+from app.tasks.search import search_terms, prefix_tsquery, highlight, HEADLINE_OPTIONS
+from app.tasks.serializers import TaskSchema, ProjectSchema, TagSchema, TaskFilters, PageParams, TaskImportRow, \
+    ImportLineError, TaskSearchHit, SearchPageParams, ReminderSchema, TaskTagSchema, TombstoneSchema, Change
+
+CHANGE_SOURCES = (*TRACKED_MODELS, Tombstone)
+CHANGE_SCHEMAS = {
+    Project: ProjectSchema.model_validate,
+    Tag: TagSchema.model_validate,
+    Task: TaskSchema.model_validate,
+    TaskTag: TaskTagSchema.model_validate,
+    Tombstone: lambda row: TombstoneSchema(table=row.table_name, id=row.row_id),
+}
+
+TASK_COPY_COLUMNS = ('id', 'title', 'description', 'done', 'created_at', 'scheduled_at', 'my_day_date', 'project_id')
+
+
+def filter_tasks(query: Select, filters: TaskFilters | None) -> Select:
+    if filters is None:
+        return query
+    if filters.done is not None:
+        query = query.where(Task.done == filters.done)
+    if filters.project_id is not None:
+        query = query.where(Task.project_id == filters.project_id)
+    if filters.scheduled_from is not None:
+        query = query.where(Task.scheduled_at >= filters.scheduled_from)
+    if filters.scheduled_to is not None:
+        query = query.where(Task.scheduled_at < filters.scheduled_to)
+    if filters.my_day_date is not None:
+        query = query.where(Task.my_day_date == filters.my_day_date)
+    return query
+
+
+def paginate_tasks(query: Select, page: PageParams | None) -> Select:
+    """
+    Keyset-пагинация по (created_at, id): стоимость страницы не зависит от глубины
+    """
+    query = query.order_by(Task.created_at, Task.id)
+    if page is None:
+        return query
+    if page.after is not None:
+        query = query.where(tuple_(Task.created_at, Task.id) > tuple_(*page.after))
+    return query.limit(page.limit)
 
 
 class Repository:
-    def __init__(self, async_session):
+    def __init__(self, async_session, session: AsyncSession | None = None):
         self.async_session = async_session
+        self.session = session
 
-    async def get_tasks(self) -> list[TaskSchema]:
+    @asynccontextmanager
+    async def _session(self):
+        """
+        Отдает сессию запроса, если репозиторий к ней привязан (фиксацией тогда управляет get_repository),
+        иначе открывает отдельную сессию и фиксирует ее по завершении метода
+        """
+        if self.session is not None:
+            yield self.session
+            return
+        async with self._own_session() as session:
+            yield session
+
+    @asynccontextmanager
+    async def _own_session(self):
+        """
+        Отдельная сессия, которая фиксируется по завершении метода даже у репозитория запроса:
+        для массовых записей, которые не должны держать блокировки и снимок до конца запроса
+        """
         async with self.async_session() as session:
-            query = select(Task)
+            yield session
+            await session.commit()
+
+    async def _bump_versions(self, session, *tables: str):
+        """
+        Увеличивает версии таблиц в той же транзакции, что и само изменение.
+        Строки блокируются в алфавитном порядке, чтобы параллельные транзакции не ловили deadlock
+        """
+        query = pg_insert(TableVersion).values([{'name': table, 'version': 1} for table in sorted(set(tables))])
+        query = query.on_conflict_do_update(index_elements=[TableVersion.name],
+                                           set_={'version': TableVersion.version + 1})
+        await session.execute(query)
+
+    async def get_versions(self, tables: tuple[str, ...]) -> dict[str, int]:
+        async with self._session() as session:
+            query = select(TableVersion.name, TableVersion.version).where(
+                TableVersion.name == any_(bindparam('tables', list(tables), type_=ARRAY(String)))
+            )
+            versions = dict((await session.execute(query)).all())
+            return {table: versions.get(table, 0) for table in tables}
+
+    async def _load_tags(self, session, tasks: list[TaskSchema]) -> list[TaskSchema]:
+        """
+        Заполняет tags у всех переданных задач одним запросом
+        """
+        if not tasks:
+            return tasks
+        task_ids = [task.id for task in tasks]
+        query = (select(TaskTag.task_id, Tag)
+                 .join(Tag, Tag.id == TaskTag.tag_id)
+                 .where(TaskTag.task_id == any_(bindparam('task_ids', task_ids, type_=ARRAY(Integer))))
+                 .order_by(Tag.id))
+        tags_by_task = defaultdict(list)
+        for task_id, tag in (await session.execute(query)).all():
+            tags_by_task[task_id].append(TagSchema.model_validate(tag))
+        for task in tasks:
+            task.tags = tags_by_task[task.id]
+        return tasks
+
+    @single_flight('tasks')
+    async def get_tasks(self, filters: TaskFilters | None = None, page: PageParams | None = None) -> list[TaskSchema]:
+        async with self._session() as session:
+            query = paginate_tasks(filter_tasks(select(Task), filters), page)
             query_result = (await session.execute(query)).scalars().all()
+            tasks = [TaskSchema.model_validate(task) for task in query_result]
 
-            return [TaskSchema.model_validate(task) for task in query_result]
+            return await self._load_tags(session, tasks)
 
+    @single_flight('task')
     async def get_task(self, id: int) -> TaskSchema:
-        async with self.async_session() as session:
+        async with self._session() as session:
             query = select(Task).where(Task.id == id)
             query_result = (await session.execute(query)).scalars().first()
 
             task = TaskSchema.model_validate(query_result)
-            task.tags = await self.get_all_tags_by_task(task.id)
+            await self._load_tags(session, [task])
 
             return task
 
-    async def get_tasks_by_project_id(self, id: int) -> list[TaskSchema]:
-        async with self.async_session() as session:
-            query = select(Task).where(Task.project_id == id)
+    @single_flight('tasks_by_project')
+    async def get_tasks_by_project_id(self,
+                                      id: int,
+                                      filters: TaskFilters | None = None,
+                                      page: PageParams | None = None) -> list[TaskSchema]:
+        async with self._session() as session:
+            query = paginate_tasks(filter_tasks(select(Task).where(Task.project_id == id), filters), page)
             query_result = (await session.execute(query)).scalars().all()
+            tasks = [TaskSchema.model_validate(task) for task in query_result]
 
-            return [TaskSchema.model_validate(task) for task in query_result]
+            return await self._load_tags(session, tasks)
 
-    async def get_tasks_by_tag_id(self, id: int) -> list[TaskSchema]:
-        async with self.async_session() as session:
-            query = select(Task).join(TaskTag).where(TaskTag.tag_id == id)
+    @single_flight('tasks_by_tag')
+    async def get_tasks_by_tag_id(self,
+                                  id: int,
+                                  filters: TaskFilters | None = None,
+                                  page: PageParams | None = None) -> list[TaskSchema]:
+        async with self._session() as session:
+            query = paginate_tasks(filter_tasks(select(Task).join(TaskTag).where(TaskTag.tag_id == id), filters), page)
             query_result = (await session.execute(query)).scalars().all()
+            tasks = [TaskSchema.model_validate(task) for task in query_result]
 
-            return [TaskSchema.model_validate(task) for task in query_result]
+            return await self._load_tags(session, tasks)
+
+    async def search_tasks(self,
+                           q: str,
+                           filters: TaskFilters | None = None,
+                           tag_id: int | None = None,
+                           page: SearchPageParams | None = None) -> list[TaskSearchHit]:
+        """
+        Полнотекстовый поиск по search_vector (слова запроса как префиксы) плюс нечеткое совпадение
+        названия по триграммам. Сортировка по релевантности, подсветка считается только для строк страницы
+        """
+        terms = search_terms(q)
+        if not terms:
+            return []
+        tsquery = func.to_tsquery(SEARCH_CONFIG, prefix_tsquery(terms))
+        rank = cast(func.ts_rank_cd(Task.search_vector, tsquery) + func.similarity(Task.title, q), Float)
+        query = (select(Task.id, rank.label('rank'))
+                 .where(or_(Task.search_vector.op('@@')(tsquery), Task.title.op('%')(q))))
+        query = filter_tasks(query, filters)
+        if tag_id is not None:
+            query = query.where(exists().where(TaskTag.task_id == Task.id, TaskTag.tag_id == tag_id))
+        if page is not None and page.after is not None:
+            query = query.where(tuple_(rank, Task.id) < tuple_(*page.after))
+        query = query.order_by(rank.desc(), Task.id.desc())
+        if page is not None:
+            query = query.limit(page.limit)
+        matches = query.subquery()
+
+        query = (select(Task, matches.c.rank,
+                        func.ts_headline(SEARCH_CONFIG, Task.title, tsquery, HEADLINE_OPTIONS),
+                        func.ts_headline(SEARCH_CONFIG, func.coalesce(Task.description, ''), tsquery,
+                                         HEADLINE_OPTIONS))
+                 .join(matches, matches.c.id == Task.id)
+                 .order_by(matches.c.rank.desc(), Task.id.desc()))
+        async with self._session() as session:
+            hits = [
+                TaskSearchHit(**TaskSchema.model_validate(task).model_dump(exclude={'tags'}), rank=task_rank,
+                              title_highlight=highlight(title), snippet=highlight(snippet))
+                for task, task_rank, title, snippet in (await session.execute(query)).all()
+            ]
+            return await self._load_tags(session, hits)
+
+    async def stream_task_page(self,
+                               filters: TaskFilters | None = None,
+                               page: PageParams | None = None,
+                               project_id: int | None = None,
+                               tag_id: int | None = None,
+                               chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[list[TaskSchema]]:
+        """
+        Та же страница, что у get_tasks, get_tasks_by_project_id и get_tasks_by_tag_id,
+        но читается через серверный курсор и отдается пачками по chunk_size задач с тегами.
+        Первую страницу одновременно запрашивают многие клиенты, поэтому она читается одной пачкой
+        через те методы, и одинаковые запросы делят один поход в базу. Чтение начинается только
+        при запросе первой пачки, так что начало HTML-страницы по-прежнему уходит до него
+        """
+        if page is not None and page.after is None:
+            if project_id is not None:
+                yield await self.get_tasks_by_project_id(project_id, filters, page)
+            elif tag_id is not None:
+                yield await self.get_tasks_by_tag_id(tag_id, filters, page)
+            else:
+                yield await self.get_tasks(filters, page)
+            return
+        query = select(Task)
+        if project_id is not None:
+            query = query.where(Task.project_id == project_id)
+        if tag_id is not None:
+            query = query.join(TaskTag).where(TaskTag.tag_id == tag_id)
+        query = paginate_tasks(filter_tasks(query, filters), page)
+
+        async with self._session() as session:
+            result = await session.stream(query.execution_options(yield_per=chunk_size))
+            async for partition in result.scalars().partitions():
+                tasks = [TaskSchema.model_validate(task) for task in partition]
+                yield await self._load_tags(session, tasks)
+
+    async def stream_tasks(self,
+                           filters: TaskFilters | None = None,
+                           expand: bool = False,
+                           batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[list[dict[str, Any]]]:
+        """
+        Отдает задачи пачками через серверный курсор в собственной read-only транзакции REPEATABLE READ,
+        так что вся выгрузка видит один снимок базы. С expand к задаче добавляются название проекта и теги
+        """
+        columns = [Task.id, Task.title, Task.description, Task.done, Task.created_at, Task.scheduled_at,
+                   Task.my_day_date, Task.project_id]
+        query = select(*columns)
+        if expand:
+            tags = (select(func.array_agg(aggregate_order_by(Tag.title, Tag.id)))
+                    .join(TaskTag, TaskTag.tag_id == Tag.id)
+                    .where(TaskTag.task_id == Task.id)
+                    .scalar_subquery())
+            empty = literal([], ARRAY(String))
+            query = (select(*columns, Project.title.label('project'), func.coalesce(tags, empty).label('tags'))
+                     .outerjoin(Project, Project.id == Task.project_id))
+        query = filter_tasks(query, filters).order_by(Task.created_at, Task.id)
 
-    async def create_task(self, task: TaskSchema) -> TaskSchema:
         async with self.async_session() as session:
+            await session.connection(execution_options={'isolation_level': 'REPEATABLE READ',
+                                                        'postgresql_readonly': True})
+            result = await session.stream(query.execution_options(yield_per=batch_size))
+            async for partition in result.mappings().partitions():
+                yield [dict(row) for row in partition]
+
+    async def create_task(self, task: TaskSchema) -> TaskSchema:
+        async with self._session() as session:
             query = insert(Task).values(
                 title=task.title,
                 description=task.description,
@@ -48,108 +278,438 @@ class Repository:
                 created_at=task.created_at,
                 scheduled_at=task.scheduled_at,
                 my_day_date=task.my_day_date,
+                project_id=task.project_id,
             ).returning(Task)
             query_result = (await session.execute(query)).scalars().first()
-            await session.commit()
+            await self._bump_versions(session, 'tasks')
             result = TaskSchema.model_validate(query_result)
+            on_commit(session, lambda: task_stats.change(None, task_state(result)))
+            notify(session, 'tasks', 'upsert', [result.id])
             return result
 
+    async def _update_task(self, session, id: int, **values) -> tuple[Task | None, TaskState | None]:
+        """
+        Обновляет задачу и возвращает ее вместе со старым состоянием для счетчиков, одним запросом
+        """
+        old = (select(Task.id, Task.project_id, Task.my_day_date, Task.done)
+               .where(Task.id == id)
+               .with_for_update()
+               .subquery())
+        query = (update(Task).where(Task.id == old.c.id).values(**values)
+                 .returning(Task, old.c.project_id, old.c.my_day_date, old.c.done))
+        row = (await session.execute(query)).first()
+        if row is None:
+            return None, None
+        task, project_id, my_day_date, done = row
+        return task, (project_id, my_day_date, bool(done))
+
+    async def _resolve_titles(self, session, model, titles: set[str]) -> dict[str, int]:
+        """
+        Находит id проектов или тегов по названиям, недостающие создает одним INSERT
+        """
+        if not titles:
+            return {}
+        query = (select(model.title, model.id)
+                 .where(model.title == any_(bindparam('titles', list(titles), type_=ARRAY(String))))
+                 .order_by(model.id.desc()))
+        ids = dict((await session.execute(query)).all())
+        missing = titles - ids.keys()
+        if missing:
+            query = insert(model).values([{'title': title, 'description': title} for title in sorted(missing)])
+            created = (await session.execute(query.returning(model.title, model.id))).all()
+            ids.update(created)
+            if model is Tag:
+                on_commit(session, lambda: tag_index.add_all((id_, title) for title, id_ in created))
+            notify(session, model.__tablename__, 'upsert', [id_ for _, id_ in created])
+            invalidate(session, (model.__tablename__,))
+            await self._bump_versions(session, model.__tablename__)
+        return ids
+
+    async def import_tasks(self, rows: list[tuple[int, TaskImportRow]]) -> tuple[int, list[ImportLineError]]:
+        """
+        Записывает пачку задач через COPY. Идентификаторы резервируются заранее,
+        чтобы тем же COPY записать связи с тегами. Каждая пачка фиксируется в своей транзакции,
+        а не в транзакции запроса: блокировки версий держатся только на время пачки,
+        и записанное не пропадает, если загрузка оборвется на середине
+        """
+        async with self._own_session() as session:
+            project_ids = await self._resolve_titles(session, Project, {row.project for _, row in rows if row.project})
+            tag_ids = await self._resolve_titles(session, Tag, {tag for _, row in rows for tag in row.tags})
+            referenced = {row.project_id for _, row in rows if row.project_id is not None}
+            if referenced:
+                query = select(Project.id).where(Project.id == any_(bindparam('ids', list(referenced),
+                                                                                type_=ARRAY(Integer))))
+                existing = set((await session.execute(query)).scalars().all())
+            else:
+                existing = set()
+
+            errors = []
+            valid = []
+            for line_no, row in rows:
+                if row.project_id is not None and row.project_id not in existing:
+                    errors.append(ImportLineError(line=line_no, error=f'Project {row.project_id} does not exist'))
+                else:
+                    valid.append(row)
+            if not valid:
+                return 0, errors
+
+            query = (select(func.nextval(func.pg_get_serial_sequence(Task.__tablename__, 'id')))
+                     .select_from(func.generate_series(1, len(valid))))
+            task_ids = (await session.execute(query)).scalars().all()
+            now = datetime.datetime.now()
+            task_records = []
+            tag_records = []
+            for task_id, row in zip(task_ids, valid):
+                project_id = project_ids[row.project] if row.project else row.project_id
+                task_records.append((task_id, row.title, row.description, row.done, row.created_at or now,
+                                     row.scheduled_at, row.my_day_date, project_id))
+                tag_records.extend((task_id, tag_ids[tag]) for tag in dict.fromkeys(row.tags))
+
+            connection = await (await session.connection()).get_raw_connection()
+            await connection.driver_connection.copy_records_to_table(
+                Task.__tablename__, records=task_records, columns=TASK_COPY_COLUMNS,
+            )
+            if tag_records:
+                await connection.driver_connection.copy_records_to_table(
+                    TaskTag.__tablename__, records=tag_records, columns=('task_id', 'tag_id'),
+                )
+                # После коммита нужны только счетчики по тегам, а не сами связи пачки
+                usage = Counter(tag_id for _, tag_id in tag_records)
+                on_commit(session, lambda: tag_index.increment_all(usage))
+            on_commit(session, task_stats.invalidate)
+            # id всей пачки в NOTIFY не влезут, клиенту проще перечитать задачи
+            notify(session, 'tasks', 'reload')
+            await self._bump_versions(session, 'tasks', 'task_tags')
+            return len(task_records), errors
+
     async def delete_task(self, id: int):
-        async with self.async_session() as session:
-            query = delete(Task).where(Task.id == id)
-            await session.execute(query)
-            await session.commit()
+        async with self._session() as session:
+            query = delete(Task).where(Task.id == id).returning(Task.project_id, Task.my_day_date, Task.done)
+            deleted = (await session.execute(query)).first()
+            if deleted is not None:
+                on_commit(session, lambda: task_stats.change(task_state(deleted), None))
+                notify(session, 'tasks', 'delete', [id])
+            await self._bump_versions(session, 'tasks', 'task_tags')
 
-    async def getting_done(self, id: int, done=True) -> TaskSchema:
-        async with self.async_session() as session:
-            query = update(Task).where(Task.id == id).values(done=done).returning(Task)
-            query_result = (await session.execute(query)).scalars().first()
+    async def getting_done(self, id: int, done=True) -> TaskSchema | None:
+        async with self._session() as session:
+            query_result, old = await self._update_task(session, id, done=done)
+            if query_result is None:
+                return None
+            await self._bump_versions(session, 'tasks')
             result = TaskSchema.model_validate(query_result)
-            await session.commit()
+            on_commit(session, lambda: task_stats.change(old, task_state(result)))
+            notify(session, 'tasks', 'upsert', [result.id])
             return result
 
+    async def get_task_stats(self) -> tuple[list[tuple[int | None, bool, int]],
+                                            list[tuple[datetime.date, bool, int]]]:
+        """
+        Число задач по (project_id, done) и по (my_day_date, done) одним запросом через GROUPING SETS
+        """
+        async with self._session() as session:
+            by_my_day = func.grouping(Task.project_id).label('by_my_day')
+            query = (select(by_my_day, Task.project_id, Task.my_day_date, Task.done, func.count())
+                     .group_by(func.grouping_sets(tuple_(Task.project_id, Task.done),
+                                                  tuple_(Task.my_day_date, Task.done))))
+            by_project, my_day = [], []
+            for grouped_by_my_day, project_id, my_day_date, done, count in (await session.execute(query)).all():
+                if not grouped_by_my_day:
+                    by_project.append((project_id, done, count))
+                elif my_day_date is not None:
+                    my_day.append((my_day_date, done, count))
+            return by_project, my_day
+
+    @cached('projects')
+    @single_flight('projects')
     async def get_projects(self) -> list[ProjectSchema]:
-        async with self.async_session() as session:
+        async with self._session() as session:
             query = select(Project)
             query_result = (await session.execute(query)).scalars().all()
 
             return [ProjectSchema.model_validate(project) for project in query_result]
 
+    @cached('project')
+    @single_flight('project')
     async def get_project(self, id: int, ) -> ProjectSchema:
-        async with self.async_session() as session:
+        async with self._session() as session:
             query = select(Project).where(Project.id == id)
             query_result = (await session.execute(query)).scalars().first()
 
             return ProjectSchema.model_validate(query_result)
 
     async def create_project(self, project: ProjectSchema) -> ProjectSchema:
-        async with self.async_session() as session:
+        async with self._session() as session:
             query = insert(Project).values(
                 title=project.title,
                 description=project.description,
             ).returning(Project)
             query_result = (await session.execute(query)).scalars().first()
-            await session.commit()
+            invalidate(session, ('projects',))
+            await self._bump_versions(session, 'projects')
             result = ProjectSchema.model_validate(query_result)
+            notify(session, 'projects', 'upsert', [result.id])
             return result
 
     async def delete_project(self, id: int):
-        async with self.async_session() as session:
+        async with self._session() as session:
             query = delete(Project).where(Project.id == id)
             await session.execute(query)
-            await session.commit()
+            invalidate(session, ('projects',), ('project', id))
+            # Задачи проекта удалены каскадом, счетчики проще пересчитать
+            on_commit(session, task_stats.invalidate)
+            notify(session, 'projects', 'delete', [id])
+            notify(session, 'tasks', 'reload')
+            await self._bump_versions(session, 'projects', 'tasks', 'task_tags')
 
-    async def attach_project_task(self, task_id: int, project_id: int) -> TaskSchema:
-        async with self.async_session() as session:
-            query = update(Task).where(Task.id == task_id).values(project_id=project_id).returning(Task)
-            query_result = (await session.execute(query)).scalars().first()
+    async def attach_project_task(self, task_id: int, project_id: int) -> TaskSchema | None:
+        async with self._session() as session:
+            query_result, old = await self._update_task(session, task_id, project_id=project_id)
+            if query_result is None:
+                return None
+            await self._bump_versions(session, 'tasks')
             result = TaskSchema.model_validate(query_result)
-            await session.commit()
+            on_commit(session, lambda: task_stats.change(old, task_state(result)))
+            notify(session, 'tasks', 'upsert', [result.id])
             return result
 
+    async def update_tasks(self, changes: dict[int, dict[str, Any]]) -> dict[int, TaskSchema]:
+        """
+        Меняет done и project_id сразу у многих задач одним UPDATE ... FROM unnest(...):
+        у каждой задачи свои значения, None оставляет поле как есть. Строки блокируются
+        в порядке id, чтобы параллельные пачки не ловили deadlock. Отсутствующих задач нет в ответе
+        """
+        if not changes:
+            return {}
+        ids = sorted(changes)
+        async with self._session() as session:
+            data = func.unnest(
+                bindparam('ids', ids, type_=ARRAY(Integer)),
+                bindparam('done', [changes[id_].get('done') for id_ in ids], type_=ARRAY(Boolean)),
+                bindparam('project_ids', [changes[id_].get('project_id') for id_ in ids], type_=ARRAY(Integer)),
+            ).table_valued('id', 'done', 'project_id').render_derived(name='data')
+            old = (select(Task.id, Task.project_id, Task.my_day_date, Task.done)
+                   .where(Task.id == any_(bindparam('old_ids', ids, type_=ARRAY(Integer))))
+                   .order_by(Task.id)
+                   .with_for_update()
+                   .subquery())
+            query = (update(Task)
+                     .where(Task.id == old.c.id, Task.id == data.c.id)
+                     .values(done=func.coalesce(data.c.done, Task.done),
+                             project_id=func.coalesce(data.c.project_id, Task.project_id))
+                     .returning(Task, old.c.project_id, old.c.my_day_date, old.c.done))
+            rows = (await session.execute(query)).all()
+            if not rows:
+                return {}
+            await self._bump_versions(session, 'tasks')
+            results, states = {}, []
+            for task, project_id, my_day_date, done in rows:
+                result = results[task.id] = TaskSchema.model_validate(task)
+                states.append(((project_id, my_day_date, bool(done)), task_state(result)))
+
+            def update_stats():
+                for old_state, new_state in states:
+                    task_stats.change(old_state, new_state)
+
+            on_commit(session, update_stats)
+            notify(session, 'tasks', 'upsert', list(results))
+            return results
+
+    @cached('tags')
+    @single_flight('tags')
     async def get_tags(self) -> list[TagSchema]:
-        async with self.async_session() as session:
+        async with self._session() as session:
             query = select(Tag)
             query_result = (await session.execute(query)).scalars().all()
 
             return [TagSchema.model_validate(tag) for tag in query_result]
 
+    @cached('tag')
+    @single_flight('tag')
     async def get_tag(self, id: int) -> TagSchema:
-        async with self.async_session() as session:
+        async with self._session() as session:
             query = select(Tag).where(Tag.id == id)
             query_result = (await session.execute(query)).scalars().first()
 
             return TagSchema.model_validate(query_result)
 
+    async def get_tag_usage(self) -> list[tuple[int, str, int]]:
+        """
+        Все теги с числом задач, для индекса автодополнения
+        """
+        async with self._session() as session:
+            query = (select(Tag.id, Tag.title, func.count(TaskTag.id))
+                     .outerjoin(TaskTag, TaskTag.tag_id == Tag.id)
+                     .group_by(Tag.id))
+            return [tuple(row) for row in (await session.execute(query)).all()]
+
+    @single_flight('tags_by_task')
     async def get_all_tags_by_task(self, id: int) -> list[TagSchema]:
-        async with self.async_session() as session:
+        async with self._session() as session:
             query = select(Tag).join(TaskTag).where(TaskTag.task_id == id)
             query_result = (await session.execute(query)).scalars().all()
 
             return [TagSchema.model_validate(tag) for tag in query_result]
 
     async def create_tag(self, tag: str) -> TagSchema:
-        async with self.async_session() as session:
+        async with self._session() as session:
             query = insert(Tag).values(
                 title=tag,
                 description=tag,
             ).returning(Tag)
             query_result = (await session.execute(query)).scalars().first()
-            await session.commit()
+            invalidate(session, ('tags',))
+            await self._bump_versions(session, 'tags')
             result = TagSchema.model_validate(query_result)
+            on_commit(session, lambda: tag_index.add(result.id, result.title))
+            notify(session, 'tags', 'upsert', [result.id])
             return result
 
     async def delete_tag(self, id: int):
-        async with self.async_session() as session:
+        async with self._session() as session:
             query = delete(Tag).where(Tag.id == id)
             await session.execute(query)
-            await session.commit()
+            on_commit(session, lambda: tag_index.remove(id))
+            notify(session, 'tags', 'delete', [id])
+            invalidate(session, ('tags',), ('tag', id))
+            await self._bump_versions(session, 'tags', 'task_tags')
 
     async def attach_task_to_tag(self, task_id: int, tag_id: int):
-        async with self.async_session() as session:
-            query = insert(TaskTag).values(
+        async with self._session() as session:
+            query = pg_insert(TaskTag).values(
                 task_id=task_id,
                 tag_id=tag_id,
-            )
+            ).on_conflict_do_nothing(index_elements=[TaskTag.task_id, TaskTag.tag_id]).returning(TaskTag.id)
+            if (await session.execute(query)).first() is not None:
+                on_commit(session, lambda: tag_index.increment(tag_id))
+                notify(session, 'tasks', 'upsert', [task_id])
+            await self._bump_versions(session, 'task_tags')
+
+    async def attach_tags(self, pairs: list[tuple[int, int]]):
+        """
+        Привязывает теги к задачам одним многострочным INSERT ... ON CONFLICT DO NOTHING
+        """
+        if not pairs:
+            return
+        async with self._session() as session:
+            query = (pg_insert(TaskTag)
+                     .values([{'task_id': task_id, 'tag_id': tag_id} for task_id, tag_id in pairs])
+                     .on_conflict_do_nothing(index_elements=[TaskTag.task_id, TaskTag.tag_id])
+                     .returning(TaskTag.task_id, TaskTag.tag_id))
+            created = (await session.execute(query)).all()
+            if created:
+                usage = Counter(tag_id for _, tag_id in created)
+                on_commit(session, lambda: tag_index.increment_all(usage))
+                notify(session, 'tasks', 'upsert', list(dict.fromkeys(task_id for task_id, _ in created)))
+            await self._bump_versions(session, 'task_tags')
+
+    async def get_changes(self, after: tuple[int, int, int], limit: int) -> list[Change]:
+        """
+        Изменения после ключа (ревизия, номер таблицы, id) в порядке этого ключа: по запросу на таблицу
+        по индексу (revision, id). Каждый следующий запрос ограничен ревизией limit-й уже найденной записи.
+        Ревизии не ниже горизонта, взятого один раз на все запросы, ждут следующего вызова:
+        их транзакции могли еще не зафиксироваться
+        """
+        revision, source, id_ = after
+        changes: list[Change] = []
+        async with self._session() as session:
+            horizon = (await session.execute(CHANGE_HORIZON)).scalar()
+            for index, model in enumerate(CHANGE_SOURCES):
+                if index < source:
+                    query = select(model).where(model.revision > revision)
+                elif index == source:
+                    query = select(model).where(tuple_(model.revision, model.id) > tuple_(revision, id_))
+                else:
+                    query = select(model).where(model.revision >= revision)
+                query = query.where(model.revision < horizon)
+                if len(changes) >= limit:
+                    query = query.where(model.revision <= changes[limit - 1][0])
+                query = query.order_by(model.revision, model.id).limit(limit)
+                to_schema = CHANGE_SCHEMAS[model]
+                changes.extend((row.revision, index, row.id, to_schema(row))
+                               for row in (await session.execute(query)).scalars())
+                changes.sort(key=lambda change: change[:3])
+                del changes[limit:]
+        return changes
+
+    async def get_reminders(self, task_id: int) -> list[ReminderSchema]:
+        async with self._session() as session:
+            query = select(Reminder).where(Reminder.task_id == task_id).order_by(Reminder.remind_at, Reminder.id)
+            return [ReminderSchema.model_validate(reminder) for reminder in (await session.execute(query)).scalars()]
+
+    async def create_reminder(self, task_id: int, remind_at: datetime.datetime) -> ReminderSchema | None:
+        """
+        Создает напоминание, если задача существует, иначе возвращает None
+        """
+        async with self._session() as session:
+            query = insert(Reminder).from_select(
+                ['task_id', 'remind_at'],
+                select(Task.id, literal(remind_at, DateTime)).where(Task.id == task_id),
+            ).returning(Reminder)
+            reminder = (await session.execute(query)).scalars().first()
+            if reminder is None:
+                return None
+            on_commit(session, lambda: reminder_dispatcher.wake(remind_at))
+            return ReminderSchema.model_validate(reminder)
+
+    async def update_reminder(self, id: int, remind_at: datetime.datetime) -> ReminderSchema | None:
+        """
+        Переносит напоминание; перенесенное снова ждет отправки, даже если уже было отправлено
+        """
+        async with self._session() as session:
+            query = (update(Reminder).where(Reminder.id == id)
+                     .values(remind_at=remind_at, claimed_until=None, sent_at=None)
+                     .returning(Reminder))
+            reminder = (await session.execute(query)).scalars().first()
+            if reminder is None:
+                return None
+            on_commit(session, lambda: reminder_dispatcher.wake(remind_at))
+            return ReminderSchema.model_validate(reminder)
+
+    async def delete_reminder(self, id: int):
+        async with self._session() as session:
+            await session.execute(delete(Reminder).where(Reminder.id == id))
+
+    async def claim_reminders(self,
+                              horizon: datetime.datetime,
+                              now: datetime.datetime,
+                              claimed_until: datetime.datetime,
+                              limit: int) -> list[ReminderSchema]:
+        """
+        Забирает до limit неотправленных напоминаний с remind_at до horizon, которые никто не держит.
+        SKIP LOCKED пропускает строки, которые в этот момент забирает другой воркер, вместо ожидания
+        """
+        async with self._session() as session:
+            claimable = (select(Reminder.id)
+                         .where(Reminder.sent_at.is_(None), Reminder.remind_at <= horizon,
+                                or_(Reminder.claimed_until.is_(None), Reminder.claimed_until < now))
+                         .order_by(Reminder.remind_at)
+                         .limit(limit)
+                         .with_for_update(skip_locked=True))
+            query = (update(Reminder).where(Reminder.id.in_(claimable.scalar_subquery()))
+                     .values(claimed_until=claimed_until)
+                     .returning(Reminder))
+            return [ReminderSchema.model_validate(reminder) for reminder in (await session.execute(query)).scalars()]
+
+    async def complete_reminders(self, ids: list[int], now: datetime.datetime) -> list[ReminderSchema]:
+        """
+        Помечает наступившие напоминания отправленными и возвращает их. Удаленные, перенесенные
+        на будущее и уже отправленные другим воркером не возвращаются
+        """
+        async with self._session() as session:
+            query = (update(Reminder)
+                     .where(Reminder.id.in_(ids), Reminder.sent_at.is_(None), Reminder.remind_at <= now)
+                     .values(sent_at=now)
+                     .returning(Reminder))
+            reminders = [ReminderSchema.model_validate(reminder)
+                         for reminder in (await session.execute(query)).scalars()]
+            return sorted(reminders, key=lambda reminder: (reminder.remind_at, reminder.id))
+
+    async def release_reminders(self, ids: list[int], sent_at: datetime.datetime | None = None):
+        """
+        Снимает аренду: без sent_at - с неотправленных, с sent_at - откатывает отправку с этой отметкой
+        """
+        async with self._session() as session:
+            sent = Reminder.sent_at.is_(None) if sent_at is None else Reminder.sent_at == sent_at
+            query = update(Reminder).where(Reminder.id.in_(ids), sent).values(claimed_until=None, sent_at=None)
             await session.execute(query)
-            await session.commit()
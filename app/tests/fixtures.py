@@ -8,15 +8,29 @@ from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from testcontainers.postgres import PostgresContainer
 
+from app.cache import repository_cache
+from app.config import REPOSITORY_BACKEND
 from app.database import Base
 from app.dependencies import get_repository
 from app.main import app
+from app.tasks.autocomplete import tag_index
+from app.tasks.stats import task_stats
+from app.tasks.memory import InMemoryRepository
 from app.tasks.serializers import ProjectSchema, TaskSchema
 from app.tasks.use_cases import Repository
 
+# Тесты, которые проверяют именно Postgres: планы запросов, пул, кэш поверх сессий
+requires_postgres = pytest.mark.skipif(REPOSITORY_BACKEND == 'memory', reason='needs Postgres')
+
 
 @pytest.fixture
 def rep_():
+    tag_index.reset()
+    task_stats.reset()
+    if REPOSITORY_BACKEND == 'memory':
+        yield InMemoryRepository()
+        return
+
     postgres = PostgresContainer('postgres:14.9-alpine3.18')
     with postgres:
         postgres.driver = 'asyncpg'
@@ -31,6 +45,7 @@ def rep_():
                 await conn.run_sync(Base.metadata.create_all)
 
         asyncio.run(init_models())
+        repository_cache.clear()
 
         yield rep
 
@@ -41,6 +56,16 @@ def app_client(rep_):
     return AsyncClient(app=app, base_url='http://localhost:8000/')
 
 
+@pytest.fixture
+def request_client(rep_, monkeypatch):
+    """
+    Клиент через настоящий get_repository: одна сессия и транзакция на запрос, как в приложении
+    """
+    monkeypatch.setattr('app.dependencies.async_session', rep_.async_session)
+    monkeypatch.delitem(app.dependency_overrides, get_repository, raising=False)
+    return AsyncClient(app=app, base_url='http://localhost:8000/')
+
+
 @pytest.fixture
 def tasks_list(rep_):
     async def async_task_list():
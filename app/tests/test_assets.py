@@ -0,0 +1,91 @@
+import os
+
+import pytest
+from httpx import AsyncClient
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from app.assets import assets
+from app.compression import CompressionMiddleware, choose_encoding
+from app.config import TEMPLATES_DIR
+from app.main import app
+
+INDEX = os.path.join(TEMPLATES_DIR, 'index.html')
+
+
+def test_choose_encoding():
+    assert choose_encoding('gzip, deflate', ('br', 'gzip')) == 'gzip'
+    assert choose_encoding('gzip;q=0.5, br', ('br', 'gzip')) == 'br'
+    assert choose_encoding('br;q=0, *', ('br', 'gzip')) == 'gzip'
+    assert choose_encoding('identity', ('br', 'gzip')) is None
+    assert choose_encoding(None) is None
+
+
+@pytest.mark.asyncio
+async def test_index_is_served_precompressed_from_memory():
+    assets.add('/', INDEX)
+    with open(INDEX, 'rb') as f:
+        original = f.read()
+    async with AsyncClient(app=app, base_url='http://localhost:8000/') as client:
+        result = await client.get('/', headers={'Accept-Encoding': 'gzip'})
+        assert result.headers['content-encoding'] == 'gzip'
+        assert result.headers['content-type'] == 'text/html; charset=utf-8'
+        assert result.content == original
+        etag = result.headers['etag']
+        assert not etag.startswith('W/')
+
+        result = await client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        assert result.status_code == 304
+
+        result = await client.get('/', headers={'Accept-Encoding': 'identity', 'If-None-Match': etag})
+        assert result.status_code == 200 and 'content-encoding' not in result.headers
+        assert result.headers['etag'] != etag
+
+        result = await client.get('/', headers={'Accept-Encoding': 'gzip, br'})
+        assert result.headers['content-encoding'] == 'br'
+        assert result.content == original and result.headers['etag'] != etag
+
+        result = await client.get('/static/missing.js')
+        assert result.status_code == 404
+
+
+async def large_json(request):
+    return JSONResponse({'items': ['task'] * 1000})
+
+
+async def small_json(request):
+    return JSONResponse({'items': []})
+
+
+async def events(request):
+    async def stream():
+        yield 'data: ' + 'x' * 2000 + '\n\n'
+        yield 'data: end\n\n'
+
+    return StreamingResponse(stream(), media_type='text/event-stream')
+
+
+@pytest.mark.asyncio
+async def test_compression_middleware():
+    test_app = Starlette(routes=[Route('/large', large_json), Route('/small', small_json), Route('/events', events)])
+    async with AsyncClient(app=CompressionMiddleware(test_app, minimum_size=500), base_url='http://test') as client:
+        result = await client.get('/large', headers={'Accept-Encoding': 'gzip'})
+        assert result.headers['content-encoding'] == 'gzip'
+        assert 'Accept-Encoding' in result.headers['vary']
+        assert int(result.headers['content-length']) < len(result.content)
+        assert len(result.json()['items']) == 1000
+
+        result = await client.get('/large', headers={'Accept-Encoding': 'br'})
+        assert result.headers['content-encoding'] == 'br'
+        assert len(result.json()['items']) == 1000
+
+        result = await client.get('/small', headers={'Accept-Encoding': 'gzip'})
+        assert 'content-encoding' not in result.headers
+
+        result = await client.get('/events', headers={'Accept-Encoding': 'gzip'})
+        assert 'content-encoding' not in result.headers
+        assert result.text.endswith('data: end\n\n')
+
+        result = await client.get('/large', headers={'Accept-Encoding': 'identity'})
+        assert 'content-encoding' not in result.headers
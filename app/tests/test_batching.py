@@ -0,0 +1,67 @@
+import asyncio
+import datetime
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app.metrics import registry
+from app.tasks.batching import WriteBatcher, batch_requests, batch_rows
+from app.tasks.serializers import TaskSchema
+from app.tests.fixtures import rep_, tasks_list, requires_postgres
+
+
+async def create_task(rep, title: str) -> TaskSchema:
+    return await rep.create_task(TaskSchema(title=title, description='', done=False,
+                                            created_at=datetime.datetime(1971, 1, 3),
+                                            scheduled_at=None, my_day_date=None, project_id=None))
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_are_coalesced(rep_, tasks_list):
+    registry.reset()
+    other = await create_task(rep_, 'task2')
+    tag = await rep_.create_tag('tag1')
+    batcher = WriteBatcher(window=0.05)
+    batcher.start(rep_)
+
+    results = await asyncio.gather(
+        batcher.getting_done(1),
+        batcher.attach_project_task(other.id, 1),
+        batcher.getting_done(1, done=False),
+        batcher.getting_done(other.id),
+        batcher.getting_done(100),
+        batcher.attach_task_to_tag(1, tag.id),
+        batcher.attach_task_to_tag(1, tag.id),
+    )
+    await batcher.stop()
+
+    # Последний вызов для задачи побеждает, и все ее вызовы видят зафиксированную строку
+    assert [task.done for task in results[:4]] == [False, True, False, True]
+    assert results[1].project_id == 1
+    assert results[4] is None
+    assert [tag.title for tag in await rep_.get_all_tags_by_task(1)] == ['tag1']
+    assert batch_requests.values[('tasks',)][1] == 5 and batch_rows.values[('tasks',)][1] == 3
+    assert batch_requests.values[('task_tags',)][1] == 2 and batch_rows.values[('task_tags',)][1] == 1
+
+
+@pytest.mark.asyncio
+async def test_full_batch_is_flushed_without_waiting(rep_, tasks_list):
+    batcher = WriteBatcher(window=60, max_size=2)
+    batcher.start(rep_)
+    done, undone = await asyncio.wait_for(asyncio.gather(batcher.getting_done(1), batcher.getting_done(1, False)), 5)
+    assert undone.done is False and batcher.pending == 0
+    await batcher.stop()
+
+
+@requires_postgres
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried_one_by_one(rep_, tasks_list):
+    other = await create_task(rep_, 'task2')
+    batcher = WriteBatcher(window=0.05)
+    batcher.start(rep_)
+    missing_project, done = await asyncio.gather(batcher.attach_project_task(1, 100),
+                                                 batcher.getting_done(other.id),
+                                                 return_exceptions=True)
+    await batcher.stop()
+    assert isinstance(missing_project, IntegrityError)
+    assert done.done is True
@@ -0,0 +1,188 @@
+import asyncio
+
+import pytest
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app.cache import TTLCache, MISSING, repository_cache, SingleFlight, flights, cached
+from app.tasks.serializers import ProjectSchema
+from app.tasks.use_cases import Repository
+from app.tests.fixtures import rep_, tasks_list, request_client, requires_postgres
+
+
+def test_lru_eviction_and_stats():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['size']) == (3, 1, 1, 2)
+
+
+def test_ttl_expiration():
+    cache = TTLCache(maxsize=2, ttl=0)
+    cache.set('a', 1)
+    assert cache.get('a') is MISSING
+    assert cache.stats()['expirations'] == 1
+
+
+def test_disabled_cache():
+    cache = TTLCache(maxsize=2, ttl=60, enabled=False)
+    cache.set('a', 1)
+    assert cache.get('a') is MISSING
+    assert cache.stats()['size'] == 0
+
+
+def test_set_after_invalidation_is_dropped():
+    cache = TTLCache(maxsize=2, ttl=60)
+    generation = cache.generation
+    cache.invalidate('a')
+    cache.set('a', 1, generation)
+    assert cache.get('a') is MISSING
+    cache.set('a', 2, cache.generation)
+    assert cache.get('a') == 2
+
+
+@pytest.mark.asyncio
+async def test_cached_miss_finished_after_invalidation():
+    class Source:
+        session = None
+        value = 'old'
+        release = asyncio.Event()
+
+        @cached('source')
+        async def read(self):
+            value = self.value
+            await self.release.wait()
+            return value
+
+    source = Source()
+    stale = asyncio.create_task(source.read())
+    await asyncio.sleep(0)
+    # Запись фиксируется, пока промах еще читает старое значение
+    source.value = 'new'
+    repository_cache.invalidate(('source',))
+    source.release.set()
+    assert await stale == 'old'
+    assert await source.read() == 'new'
+
+
+@requires_postgres
+@pytest.mark.asyncio
+async def test_repository_invalidation(rep_):
+    assert await rep_.get_projects() == []
+    project = await rep_.create_project(ProjectSchema(title='project1', description='description'))
+    assert [p.title for p in await rep_.get_projects()] == ['project1']
+
+    assert (await rep_.get_project(project.id)).title == 'project1'
+    hits = repository_cache.stats()['hits']
+    assert (await rep_.get_project(project.id)).title == 'project1'
+    assert (await rep_.get_project(id=project.id)).title == 'project1'
+    assert repository_cache.stats()['hits'] == hits + 2
+
+    await rep_.delete_project(project.id)
+    assert await rep_.get_projects() == []
+    with pytest.raises(ValidationError):
+        await rep_.get_project(project.id)
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_result_and_error():
+    group = SingleFlight()
+    calls = []
+
+    async def call(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    assert await asyncio.gather(*(group.do('a', lambda: call(1)) for _ in range(3))) == [1, 1, 1]
+    results = await asyncio.gather(*(group.do('b', lambda: call(ValueError())) for _ in range(2)),
+                                   return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    # Ошибка не запоминается
+    assert await group.do('b', lambda: call(2)) == 2
+    assert len(calls) == 3 and group.stats()['shared'] == 3
+
+
+@pytest.mark.asyncio
+async def test_single_flight_cancellation():
+    group = SingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 1
+
+    leader = asyncio.create_task(group.do('a', call))
+    follower = asyncio.create_task(group.do('a', call))
+    await asyncio.sleep(0.01)
+    follower.cancel()
+    # Отмена ждущего не трогает ведущего
+    assert await leader == 1 and len(calls) == 1
+
+    leader = asyncio.create_task(group.do('a', call))
+    follower = asyncio.create_task(group.do('a', call))
+    await asyncio.sleep(0.01)
+    leader.cancel()
+    # Ждущий отмененного ведущего читает сам
+    assert await follower == 1 and len(calls) == 3
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    assert group.stats()['cancelled'] == 1 and group.stats()['in_flight'] == 0
+
+
+@requires_postgres
+@pytest.mark.asyncio
+async def test_concurrent_reads_share_one_query(rep_, tasks_list):
+    started = flights.stats()['started']
+    results = await asyncio.gather(*(rep_.get_tasks_by_project_id(1) for _ in range(5)))
+    assert [[task.title for task in tasks] for tasks in results] == [['task1']] * 5
+    assert flights.stats()['started'] == started + 1
+    # Результаты - копии, а не общий объект
+    assert len({id(tasks[0]) for tasks in results}) == 5
+
+    # Транзакция, которая уже писала, читает свои изменения сама
+    async with rep_.async_session() as session:
+        async with session.begin():
+            rep = Repository(rep_.async_session, session)
+            await rep.getting_done(1)
+            started = flights.stats()['started']
+            assert (await rep.get_task(1)).done is True
+            assert flights.stats()['started'] == started
+
+
+@requires_postgres
+@pytest.mark.asyncio
+async def test_concurrent_list_requests_share_one_query(request_client, rep_, tasks_list):
+    started = flights.stats()['started']
+    results = await asyncio.gather(*(request_client.get('/tasks/tasks-by-project/1') for _ in range(10)))
+    assert [[task['title'] for task in result.json()['data']] for result in results] == [['task1']] * 10
+    assert flights.stats()['started'] == started + 1
+
+
+@requires_postgres
+@pytest.mark.asyncio
+async def test_concurrent_requests_fit_in_pool(request_client, rep_, tasks_list, monkeypatch):
+    url = rep_.async_session.kw['bind'].url
+    engine = create_async_engine(url, pool_size=2, max_overflow=0, pool_timeout=5)
+    monkeypatch.setattr('app.dependencies.async_session',
+                        sessionmaker(engine, expire_on_commit=False, class_=AsyncSession))
+    repository_cache.clear()
+    try:
+        # Запросов больше, чем соединений: чтение не должно брать второе соединение на запрос
+        results = await asyncio.wait_for(asyncio.gather(
+            *(request_client.get('/tasks/projects/1', headers={'Accept': 'application/json'}) for _ in range(10))
+        ), 10)
+    finally:
+        await engine.dispose()
+    assert [result.status_code for result in results] == [200] * 10
@@ -0,0 +1,101 @@
+import asyncio
+import datetime
+
+import pytest
+
+from app.config import REPOSITORY_BACKEND
+from app.events import ChangeBroadcaster, broadcaster, encode_events, MAX_PAYLOAD_BYTES
+from app.tasks.serializers import TaskSchema, TaskImportRow
+from app.tests.fixtures import rep_, tasks_list, requires_postgres
+
+
+async def listen(rep) -> ChangeBroadcaster:
+    if REPOSITORY_BACKEND == 'memory':
+        return broadcaster
+    url = rep.async_session.kw['bind'].url.render_as_string(hide_password=False)
+    listener = ChangeBroadcaster(url)
+    listener.subscribe(set())
+    await asyncio.wait_for(listener.listening.wait(), 10)
+    return listener
+
+
+@pytest.mark.asyncio
+async def test_committed_changes_are_pushed(rep_, tasks_list):
+    listener = await listen(rep_)
+    subscription = listener.subscribe({'tasks'})
+    try:
+        task = await rep_.create_task(TaskSchema(title='task2', description='', done=False,
+                                                 created_at=datetime.datetime(1971, 1, 3),
+                                                 scheduled_at=None, my_day_date=None, project_id=None))
+        await rep_.create_tag('tag1')
+        message = await asyncio.wait_for(subscription.queue.get(), 10)
+        assert message['table'] == 'tasks' and message['op'] == 'upsert' and message['ids'] == [task.id]
+        assert message['revision'] is not None
+
+        await rep_.delete_task(task.id)
+        message = await asyncio.wait_for(subscription.queue.get(), 10)
+        assert (message['op'], message['ids']) == ('delete', [task.id])
+        # Теги в подписку не входят
+        assert subscription.queue.empty()
+    finally:
+        listener.unsubscribe(subscription)
+        if listener is not broadcaster:
+            await listener.close()
+
+
+@requires_postgres
+@pytest.mark.asyncio
+async def test_listener_survives_unexpected_error(rep_, monkeypatch):
+    import asyncpg
+
+    connect = asyncpg.connect
+    calls = []
+
+    async def flaky_connect(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError('unexpected')
+        return await connect(*args, **kwargs)
+
+    monkeypatch.setattr(asyncpg, 'connect', flaky_connect)
+    listener = await listen(rep_)
+    try:
+        assert len(calls) == 2
+    finally:
+        await listener.close()
+
+
+@requires_postgres
+@pytest.mark.asyncio
+async def test_import_sends_reload(rep_):
+    listener = await listen(rep_)
+    subscription = listener.subscribe({'tasks'})
+    try:
+        rows = [(line, TaskImportRow(title=f'task{line}', description='')) for line in range(100)]
+        assert (await rep_.import_tasks(rows))[0] == 100
+        message = await asyncio.wait_for(subscription.queue.get(), 10)
+        assert (message['op'], message['ids']) == ('reload', None)
+    finally:
+        await listener.close()
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_is_dropped():
+    listener = ChangeBroadcaster(None, queue_size=2)
+    stream = listener.stream(keepalive=0.01)
+    assert await anext(stream) == ': keepalive\n\n'
+
+    listener.publish(1, [{'table': 'tasks', 'op': 'upsert', 'ids': [id_]} for id_ in range(3)])
+    assert not listener.subscribers and listener.dropped == 1
+    assert (await anext(stream)).startswith('event: tasks\nid: 1\n')
+    await anext(stream)
+    assert await anext(stream) == 'event: overflow\ndata: {}\n\n'
+    with pytest.raises(StopAsyncIteration):
+        await anext(stream)
+
+
+def test_large_payload_falls_back_to_reload():
+    payload = encode_events([{'table': 'tasks', 'op': 'upsert', 'ids': list(range(5000))},
+                             {'table': 'tasks', 'op': 'delete', 'ids': [1]}])
+    assert len(payload) < MAX_PAYLOAD_BYTES
+    assert payload == '[{"table": "tasks", "op": "reload", "ids": null}]'
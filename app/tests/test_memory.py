@@ -0,0 +1,46 @@
+import datetime
+
+import pytest
+
+from app.tasks.memory import InMemoryRepository
+from app.tasks.serializers import TaskSchema, ProjectSchema, TaskFilters, PageParams
+
+
+def make_task(i: int, project_id: int | None = None) -> TaskSchema:
+    return TaskSchema(title=f'task{i}', description='', done=i % 2 == 0,
+                      created_at=datetime.datetime(2023, 1, 1) + datetime.timedelta(minutes=i % 7),
+                      scheduled_at=None, my_day_date=None, project_id=project_id)
+
+
+@pytest.mark.asyncio
+async def test_indexes_follow_keyset_order_and_cascades():
+    rep = InMemoryRepository()
+    project = await rep.create_project(ProjectSchema(title='project1', description=''))
+    tag = await rep.create_tag('tag1')
+    for i in range(20):
+        task = await rep.create_task(make_task(i, project.id if i % 3 else None))
+        if i % 4 == 0:
+            await rep.attach_task_to_tag(task.id, tag.id)
+
+    everything = await rep.get_tasks()
+    keys = [(task.created_at, task.id) for task in everything]
+    assert keys == sorted(keys)
+
+    page = PageParams(limit=3, after=keys[2])
+    assert [task.id for task in await rep.get_tasks(page=page)] == [task.id for task in everything[3:6]]
+
+    by_project = await rep.get_tasks_by_project_id(project.id, TaskFilters(done=True))
+    assert [task.id for task in by_project] == [task.id for task in everything
+                                                if task.project_id == project.id and task.done]
+    by_tag = await rep.get_tasks_by_tag_id(tag.id)
+    assert {task.id for task in by_tag} == {i + 1 for i in range(0, 20, 4)}
+    assert all(task.tags[0].title == 'tag1' for task in by_tag)
+
+    await rep.getting_done(1, done=False)
+    assert 1 not in {task.id for task in await rep.get_tasks(TaskFilters(done=True))}
+
+    await rep.delete_project(project.id)
+    assert all(task.project_id is None for task in await rep.get_tasks())
+    await rep.delete_tag(tag.id)
+    assert await rep.get_tasks_by_tag_id(tag.id) == []
+    assert (await rep.get_task(1)).tags == []
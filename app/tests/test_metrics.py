@@ -0,0 +1,33 @@
+import json
+import os
+
+import pytest
+
+from app.metrics import registry
+from app.tests.fixtures import rep_, app_client
+
+
+@pytest.fixture
+def metrics_dir(tmp_path):
+    directory, registry.directory = registry.directory, str(tmp_path)
+    registry.reset()
+    yield tmp_path
+    registry.directory = directory
+
+
+@pytest.mark.asyncio
+async def test_metrics_aggregate_across_workers(app_client, metrics_dir):
+    await app_client.get('/tasks/', headers={'Accept': 'application/json'})
+    await app_client.get('/no-such-route')
+
+    other_worker = {'http_request_duration_seconds': [[['GET', '/tasks/', '200'], [1] + [0] * 13, 0.0005]]}
+    with open(os.path.join(metrics_dir, '1.json'), 'w') as f:
+        json.dump(other_worker, f)
+
+    result = await app_client.get('/metrics')
+    assert result.status_code == 200
+    lines = result.text.splitlines()
+    assert 'http_request_duration_seconds_count{method="GET",route="/tasks/",status="200"} 2' in lines
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/tasks/",status="200",le="+Inf"} 2' in lines
+    assert 'http_request_duration_seconds_count{method="GET",route="unmatched",status="404"} 1' in lines
+    assert any(line.startswith('http_response_size_bytes_count{method="GET",route="/tasks/"}') for line in lines)
@@ -0,0 +1,35 @@
+import pytest
+from sqlalchemy import select, literal, exc
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.pool import InstrumentedPool, pool_monitor
+from app.tests.fixtures import rep_, requires_postgres
+
+pytestmark = requires_postgres
+
+
+@pytest.mark.asyncio
+async def test_pool_monitor_counts_checkouts_and_statement_cache(rep_):
+    url = rep_.async_session.kw['bind'].url
+    engine = create_async_engine(url, poolclass=InstrumentedPool, pool_size=1, max_overflow=0, pool_timeout=0.2)
+    pool_monitor.attach(engine.sync_engine)
+    pool_monitor.reset()
+    try:
+        for _ in range(3):
+            async with engine.connect() as conn:
+                await conn.execute(select(literal(1)))
+
+        async with engine.connect():
+            with pytest.raises(exc.TimeoutError):
+                async with engine.connect():
+                    pass
+
+        stats = pool_monitor.stats(engine.pool)
+    finally:
+        await engine.dispose()
+
+    assert stats['size'] == 1 and stats['max_connections_per_worker'] == 1
+    assert stats['checkouts'] == 4 and stats['timeouts'] == 1
+    assert stats['wait_max'] >= 0.2
+    assert stats['compiled_cache']['hits'] >= 2
+    assert stats['prepared_statement_cache']['hits'] >= 2
@@ -0,0 +1,110 @@
+import asyncio
+import datetime
+import json
+
+import pytest
+from sqlalchemy import event, text
+
+from app.tasks.serializers import TaskFilters, PageParams, SearchPageParams
+from app.tests.fixtures import rep_, requires_postgres
+
+pytestmark = requires_postgres
+
+SEED = [
+    "INSERT INTO projects (title, description) SELECT 'project' || i, '' FROM generate_series(1, 200) i",
+    "INSERT INTO tags (title, description) SELECT 'tag' || i, '' FROM generate_series(1, 200) i",
+    "INSERT INTO tasks (title, description, done, created_at, my_day_date, project_id) "
+    "SELECT 'task' || i, '', i % 3 = 0, timestamp '2023-01-01' + i * interval '1 minute', "
+    "date '2023-01-01' + i % 30, 1 + i % 200 FROM generate_series(1, 20000) i",
+    "INSERT INTO task_tags (task_id, tag_id) SELECT i, 1 + i % 200 FROM generate_series(1, 20000) i",
+    "ANALYZE",
+]
+
+PAGE = PageParams(limit=50, after=(datetime.datetime(2023, 1, 5), 5000))
+
+REPOSITORY_CALLS = {
+    'get_tasks': lambda rep: rep.get_tasks(page=PAGE),
+    'get_tasks_my_day': lambda rep: rep.get_tasks(TaskFilters(done=False, my_day_date=datetime.date(2023, 1, 7)),
+                                                  PageParams(limit=50)),
+    'get_task': lambda rep: rep.get_task(100),
+    'get_tasks_by_project_id': lambda rep: rep.get_tasks_by_project_id(7, page=PAGE),
+    'get_tasks_by_tag_id': lambda rep: rep.get_tasks_by_tag_id(7, page=PAGE),
+    'search_tasks': lambda rep: rep.search_tasks('task12', page=SearchPageParams(limit=50)),
+    'get_changes': lambda rep: rep.get_changes((5, 5, 0), 50),
+    'get_all_tags_by_task': lambda rep: rep.get_all_tags_by_task(100),
+    'get_project': lambda rep: rep.get_project(7),
+    'get_tag': lambda rep: rep.get_tag(7),
+    'getting_done': lambda rep: rep.getting_done(100),
+    'attach_project_task': lambda rep: rep.attach_project_task(100, 8),
+    'attach_task_to_tag': lambda rep: rep.attach_task_to_tag(100, 8),
+    'update_tasks': lambda rep: rep.update_tasks({100: {'done': True}, 101: {'project_id': 8}}),
+    'attach_tags': lambda rep: rep.attach_tags([(100, 8), (101, 8)]),
+    'delete_task': lambda rep: rep.delete_task(100),
+}
+
+# Поиск строк, который Postgres выполняет при каскадном удалении по внешним ключам
+CASCADE_LOOKUPS = [
+    'SELECT 1 FROM tasks WHERE project_id = 7',
+    'SELECT 1 FROM task_tags WHERE task_id = 100',
+    'SELECT 1 FROM task_tags WHERE tag_id = 7',
+]
+
+
+@pytest.fixture
+def seeded_rep(rep_):
+    async def seed():
+        async with rep_.async_session() as session:
+            for statement in SEED:
+                await session.execute(text(statement))
+            await session.commit()
+
+    asyncio.run(seed())
+    yield rep_
+
+
+def seq_scans(plan: dict) -> list[str]:
+    found = [plan['Relation Name']] if plan['Node Type'] == 'Seq Scan' else []
+    for child in plan.get('Plans', []):
+        found.extend(seq_scans(child))
+    return found
+
+
+async def explain(engine, statements: list[tuple[str, tuple]]) -> list[tuple[str, list[str]]]:
+    """
+    Строит планы с выключенным seq scan: Postgres все равно выберет его, только если подходящего индекса нет
+    """
+    result = []
+    async with engine.connect() as conn:
+        await conn.exec_driver_sql('SET enable_seqscan = off')
+        for statement, parameters in statements:
+            plan = (await conn.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {statement}', parameters)).scalar()
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            result.append((statement, seq_scans(plan[0]['Plan'])))
+    return result
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('method', REPOSITORY_CALLS)
+async def test_repository_queries_use_indexes(seeded_rep, method):
+    engine = seeded_rep.async_session.kw['bind']
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine.sync_engine, 'before_cursor_execute', capture)
+    try:
+        await REPOSITORY_CALLS[method](seeded_rep)
+    finally:
+        event.remove(engine.sync_engine, 'before_cursor_execute', capture)
+
+    assert statements
+    for statement, scanned in await explain(engine, statements):
+        assert not scanned, f'{method}: sequential scan on {scanned} in {statement}'
+
+
+@pytest.mark.asyncio
+async def test_cascade_lookups_use_indexes(seeded_rep):
+    engine = seeded_rep.async_session.kw['bind']
+    for statement, scanned in await explain(engine, [(statement, ()) for statement in CASCADE_LOOKUPS]):
+        assert not scanned, f'sequential scan on {scanned} in {statement}'
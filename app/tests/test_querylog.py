@@ -0,0 +1,23 @@
+import logging
+
+import pytest
+
+from app.querylog import count_queries, report
+from app.tests.fixtures import rep_, requires_postgres, tasks_list
+
+pytestmark = requires_postgres
+
+
+@pytest.mark.asyncio
+async def test_repeated_statements_reported_as_n_plus_one(rep_, tasks_list, caplog):
+    with count_queries() as counter:
+        for _ in range(6):
+            await rep_.get_task(1)
+    assert counter.count == 12
+    assert [count for _, count in counter.repeated()] == [6, 6]
+
+    with caplog.at_level(logging.WARNING, logger='app.queries'):
+        report(counter)
+    messages = [record.getMessage() for record in caplog.records]
+    assert any('exceed budget' in message for message in messages)
+    assert sum('possible N+1' in message for message in messages) == 2
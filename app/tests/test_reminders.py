@@ -0,0 +1,100 @@
+import datetime
+import time
+
+import pytest
+
+from app.tasks.importers import normalize_row
+from app.tasks.reminders import ReminderDispatcher, ReminderSink, LocalSink
+from app.tasks.serializers import ReminderCreateRequest, TaskImportRow
+from app.tests.fixtures import app_client, rep_, tasks_list
+
+NOW = datetime.datetime(2030, 1, 1, 12, 0)
+
+
+class FailingSink(ReminderSink):
+    async def deliver(self, reminders):
+        raise RuntimeError('sink is down')
+
+
+def test_aware_times_stored_the_same_way(monkeypatch):
+    monkeypatch.setenv('TZ', 'Asia/Vladivostok')
+    time.tzset()
+    try:
+        instant = '2030-01-01T12:00:00+00:00'
+        reminder = ReminderCreateRequest(remind_at=instant)
+        row = normalize_row(TaskImportRow(title='task', description='', created_at=instant, scheduled_at=instant))
+        assert reminder.remind_at == row.created_at == row.scheduled_at == datetime.datetime(2030, 1, 1, 22, 0)
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+def drain(sink: LocalSink) -> list[int]:
+    ids = []
+    while not sink.queue.empty():
+        ids.append(sink.queue.get_nowait().id)
+    return ids
+
+
+@pytest.mark.asyncio
+async def test_reminder_endpoints(app_client, rep_, tasks_list):
+    result = await app_client.post('/tasks/1/reminders', json={'remind_at': '2030-01-01T12:00:00'})
+    assert result.status_code == 200
+    reminder = result.json()['data']
+    assert reminder['task_id'] == 1 and reminder['sent_at'] is None
+
+    result = await app_client.put(f'/tasks/reminders/{reminder["id"]}', json={'remind_at': '2030-01-02T12:00:00'})
+    assert result.json()['data']['remind_at'] == '2030-01-02T12:00:00'
+    result = await app_client.get('/tasks/1/reminders')
+    assert [item['id'] for item in result.json()['data']] == [reminder['id']]
+
+    await app_client.delete(f'/tasks/reminders/{reminder["id"]}')
+    result = await app_client.get('/tasks/1/reminders')
+    assert result.json()['data'] == []
+
+    result = await app_client.post('/tasks/100/reminders', json={'remind_at': '2030-01-01T12:00:00'})
+    assert result.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_dispatch_claims_once_and_fires_on_time(rep_, tasks_list):
+    due = await rep_.create_reminder(1, NOW - datetime.timedelta(seconds=5))
+    soon = await rep_.create_reminder(1, NOW + datetime.timedelta(seconds=10))
+    moved = await rep_.create_reminder(1, NOW + datetime.timedelta(seconds=20))
+    deleted = await rep_.create_reminder(1, NOW + datetime.timedelta(seconds=30))
+    await rep_.create_reminder(1, NOW + datetime.timedelta(hours=1))
+
+    first, second = LocalSink(), LocalSink()
+    dispatcher = ReminderDispatcher(first, window=60, lease=300, batch_size=3)
+    other = ReminderDispatcher(second, window=60, lease=300, batch_size=100)
+
+    # Пачка заполнена: следующий шаг сразу забирает остаток окна
+    assert await dispatcher.tick(rep_, NOW) == 0
+    assert await dispatcher.tick(rep_, NOW) == 10
+    assert drain(first) == [due.id]
+    assert dispatcher.scheduled == 3
+
+    # Второй воркер не получает напоминания, которые держит первый
+    await other.tick(rep_, NOW)
+    assert other.scheduled == 0
+
+    await rep_.update_reminder(moved.id, NOW + datetime.timedelta(hours=2))
+    await rep_.delete_reminder(deleted.id)
+    await dispatcher.tick(rep_, NOW + datetime.timedelta(seconds=40))
+    assert drain(first) == [soon.id]
+    assert drain(second) == []
+
+    reminders = {reminder.id: reminder for reminder in await rep_.get_reminders(1)}
+    assert reminders[due.id].sent_at == NOW
+    assert reminders[moved.id].sent_at is None
+
+
+@pytest.mark.asyncio
+async def test_failed_delivery_is_retried(rep_, tasks_list):
+    reminder = await rep_.create_reminder(1, NOW)
+    await ReminderDispatcher(FailingSink()).tick(rep_, NOW)
+
+    sink = LocalSink()
+    # Аренда снята, так что другой воркер забирает напоминание, не дожидаясь ее истечения
+    await ReminderDispatcher(sink).tick(rep_, NOW + datetime.timedelta(seconds=1))
+    assert drain(sink) == [reminder.id]
@@ -0,0 +1,61 @@
+import datetime
+
+import pytest
+
+from app.rendering import renderer
+from app.tasks.serializers import TaskSchema
+from app.tests.fixtures import app_client, rep_, tasks_list
+
+
+def make_task(id_: int, title: str, revision: int | None = 1) -> TaskSchema:
+    return TaskSchema(id=id_, title=title, description='', done=False, created_at=datetime.datetime(1971, 1, 1),
+                      scheduled_at=None, my_day_date=None, revision=revision)
+
+
+def test_fragment_cache_rerenders_only_changed_rows():
+    renderer.fragments.clear()
+    tasks = [make_task(i, f'task{i}') for i in range(5)]
+    body = renderer.render('task_list.html', {'data': tasks})
+    assert body.count(b'<li>') == 5
+    misses = renderer.fragments.stats()['misses']
+
+    tasks[2] = make_task(2, '<changed>', revision=2)
+    body = renderer.render('task_list.html', {'data': tasks}, full_page=True)
+    assert b'&lt;changed&gt;' in body
+    assert b'<!DOCTYPE html>' in body
+    assert renderer.fragments.stats()['misses'] == misses + 1
+
+
+@pytest.mark.asyncio
+async def test_stream_sends_page_shell_before_rows():
+    fetched = []
+
+    async def chunks():
+        for start in (0, 3):
+            fetched.append(start)
+            yield [make_task(i, f'task{i}') for i in range(start, start + 3)]
+
+    pieces = [(len(fetched), piece) async for piece in renderer.stream('task_list.html', chunks(), full_page=True)]
+    shell = b''.join(piece for fetched_before, piece in pieces if not fetched_before)
+    assert b'<!DOCTYPE html>' in shell and b'<li>' not in shell
+    body = b''.join(piece for _, piece in pieces)
+    assert body.count(b'<li>') == 6
+    expected = renderer.render('task_list.html', {'data': [make_task(i, f'task{i}') for i in range(6)]},
+                               full_page=True)
+    assert body.split() == expected.split()
+
+
+@pytest.mark.asyncio
+async def test_fragment_key_follows_row_revision(app_client, rep_, tasks_list):
+    renderer.fragments.clear()
+    headers = {'HX-Request': 'true'}
+    assert '<li>task1</li>' in (await app_client.get('/tasks/', headers=headers)).text
+    misses = renderer.fragments.stats()['misses']
+    await app_client.get('/tasks/', headers=headers)
+    assert renderer.fragments.stats()['misses'] == misses
+
+    # Изменение строки дает новую ревизию и новый ключ
+    await app_client.post('/tasks/done/1')
+    await app_client.get('/tasks/', headers=headers)
+    assert renderer.fragments.stats()['misses'] == misses + 1
+    assert 'revision' not in (await app_client.get('/tasks/')).json()['data'][0]
@@ -1,8 +1,18 @@
+import asyncio
+import datetime
+import json
 import os
 
 import pytest
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
 
-from app.tests.fixtures import rep_, app_client, tasks_list
+from app.cache import repository_cache
+from app.querylog import assert_max_queries
+from app.tasks.serializers import TaskSchema, ProjectSchema
+from app.tasks.use_cases import Repository
+from app.tasks.stats import task_stats, TaskStats
+from app.tests.fixtures import rep_, app_client, tasks_list, request_client, requires_postgres
 
 os.chdir('..')
 
@@ -34,6 +44,9 @@ async def test_get_tasks(app_client, rep_, tasks_list):
     result = await app_client.get('/tasks/', headers={'HX-Request': 'true'})
     assert result.status_code == 200
     assert 'text/html' in result.headers['content-type']
+    result = await app_client.get('/tasks/', headers={'Accept': 'text/html'})
+    assert result.status_code == 200
+    assert '<!DOCTYPE html>' in result.text and '<li>task1</li>' in result.text
     pass
 
 
@@ -79,3 +92,389 @@ async def test_create_project(app_client, rep_):
     assert result.json()['data']['title'] == 'test'
     assert result.json()['data']['description'] == 'test'
     pass
+
+
+@pytest.mark.asyncio
+async def test_get_tasks_pagination(app_client, rep_):
+    for i in range(3):
+        await rep_.create_task(TaskSchema(title=f'task{i}',
+                                          description='description',
+                                          done=i == 1,
+                                          created_at=datetime.datetime(1971, 1, 1 + i),
+                                          scheduled_at=None,
+                                          my_day_date=None))
+    headers = {'Accept': 'application/json'}
+    result = await app_client.get('/tasks/', params={'limit': 2}, headers=headers)
+    assert result.status_code == 200
+    assert [task['title'] for task in result.json()['data']] == ['task0', 'task1']
+    next_cursor = result.json()['next_cursor']
+    assert next_cursor is not None
+
+    result = await app_client.get('/tasks/', params={'limit': 2, 'cursor': next_cursor}, headers=headers)
+    assert [task['title'] for task in result.json()['data']] == ['task2']
+    assert result.json()['next_cursor'] is None
+
+    result = await app_client.get('/tasks/', params={'done': True}, headers=headers)
+    assert [task['title'] for task in result.json()['data']] == ['task1']
+
+    result = await app_client.get('/tasks/', params={'cursor': 'garbage'}, headers=headers)
+    assert result.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_get_tasks_with_tags(app_client, rep_, tasks_list):
+    tag1 = await rep_.create_tag('tag1')
+    tag2 = await rep_.create_tag('tag2')
+    await rep_.attach_task_to_tag(1, tag1.id)
+    await rep_.attach_task_to_tag(1, tag2.id)
+    headers = {'Accept': 'application/json'}
+
+    result = await app_client.get('/tasks/', headers=headers)
+    assert [tag['title'] for tag in result.json()['data'][0]['tags']] == ['tag1', 'tag2']
+
+    result = await app_client.get('/tasks/projects/1', headers=headers)
+    assert [tag['title'] for tag in result.json()['data']['tasks'][0]['tags']] == ['tag1', 'tag2']
+
+    result = await app_client.get(f'/tasks/tags/{tag2.id}', headers=headers)
+    assert [tag['title'] for tag in result.json()['data']['tasks'][0]['tags']] == ['tag1', 'tag2']
+
+
+@pytest.mark.asyncio
+async def test_import_tasks(app_client, rep_):
+    body = '\n'.join([
+        '{"title": "task1", "description": "d", "project": "imported", "tags": ["tag1", "tag2"]}',
+        '{"title": "task2", "description": "d", "done": true}',
+        '{"title": "task3"}',
+    ])
+    result = await app_client.post('/tasks/import', content=body, headers={'Content-Type': 'application/x-ndjson'})
+    assert result.status_code == 200
+    summary = result.json()['data']
+    assert (summary['received'], summary['imported'], summary['failed']) == (3, 2, 1)
+    assert summary['errors'][0]['line'] == 3
+
+    tasks = await rep_.get_tasks()
+    assert [task.title for task in tasks] == ['task1', 'task2']
+    assert [tag.title for tag in tasks[0].tags] == ['tag1', 'tag2']
+    assert (await rep_.get_project(tasks[0].project_id)).title == 'imported'
+
+    body = 'title,description,done,tags\ntask4,d,true,tag1|tag3\n'
+    result = await app_client.post('/tasks/import', params={'format': 'csv'}, content=body)
+    assert result.json()['data']['imported'] == 1
+
+
+@requires_postgres
+@pytest.mark.asyncio
+async def test_import_commits_each_batch(request_client, rep_, monkeypatch):
+    monkeypatch.setattr('app.tasks.importers.IMPORT_BATCH_SIZE', 2)
+
+    async def upload():
+        for i in range(3):
+            yield f'{{"title": "task{i}", "description": "d"}}\n'.encode()
+        raise ConnectionError('client went away')
+
+    with pytest.raises(ConnectionError):
+        await request_client.post('/tasks/import', content=upload())
+    # Пачка, записанная до обрыва, уже зафиксирована
+    assert [task.title for task in await rep_.get_tasks()] == ['task0', 'task1']
+
+
+@pytest.mark.asyncio
+async def test_export_tasks(app_client, rep_):
+    body = '\n'.join([
+        '{"title": "task1", "description": "d", "project": "exported", "tags": ["tag1", "tag2"]}',
+        '{"title": "task2", "description": "d", "done": true}',
+    ])
+    await app_client.post('/tasks/import', content=body)
+
+    result = await app_client.get('/tasks/export', params={'expand': True})
+    assert result.status_code == 200
+    assert result.headers['content-type'] == 'application/x-ndjson'
+    rows = [json.loads(line) for line in result.text.splitlines()]
+    assert [(row['title'], row['project'], row['tags']) for row in rows] == [
+        ('task1', 'exported', ['tag1', 'tag2']), ('task2', None, []),
+    ]
+
+    result = await app_client.get('/tasks/export', params={'format': 'csv', 'done': True})
+    lines = result.text.splitlines()
+    assert lines[0] == 'id,title,description,done,created_at,scheduled_at,my_day_date,project_id'
+    assert len(lines) == 2 and ',task2,d,True,' in lines[1]
+
+    exported = (await app_client.get('/tasks/export', params={'format': 'csv', 'expand': True})).content
+    result = await app_client.post('/tasks/import', params={'format': 'csv'}, content=exported)
+    assert result.json()['data']['imported'] == 2
+    result = await app_client.get('/tasks/export', params={'expand': True})
+    rows = [json.loads(line) for line in result.text.splitlines()]
+    assert [(row['title'], row['done'], row['project'], row['tags']) for row in rows[2:]] == [
+        ('task1', False, 'exported', ['tag1', 'tag2']), ('task2', True, None, []),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_csv_export_imports_back(app_client, rep_):
+    description = 'first line\nsecond "quoted", line\r\n\nlast'
+    await app_client.post('/tasks/', json={'title': 'task1', 'description': description, 'done': False,
+                                           'scheduled_at': None, 'my_day_date': None})
+    exported = (await app_client.get('/tasks/export', params={'format': 'csv'})).content
+
+    result = await app_client.post('/tasks/import', params={'format': 'csv'}, content=exported)
+    assert result.json()['data']['imported'] == 1 and result.json()['data']['errors'] == []
+    assert [task.description for task in await rep_.get_tasks()] == [description, description]
+
+    body = 'title,description\nbroken,"no closing quote\nnext\n'
+    result = await app_client.post('/tasks/import', params={'format': 'csv'}, content=body)
+    assert result.json()['data']['errors'] == [{'line': 2, 'error': 'Unterminated quoted field'}]
+
+
+@pytest.mark.asyncio
+async def test_search_tasks(app_client, rep_):
+    body = '\n'.join([
+        '{"title": "Купить молоко", "description": "в магазине <у дома>", "tags": ["home"]}',
+        '{"title": "Позвонить маме", "description": "про молоко"}',
+        '{"title": "Отчет", "description": "квартальный"}',
+    ])
+    await app_client.post('/tasks/import', content=body)
+
+    result = await app_client.get('/tasks/search', params={'q': 'молок'})
+    assert result.status_code == 200
+    hits = result.json()['data']
+    assert [hit['title'] for hit in hits] == ['Купить молоко', 'Позвонить маме']
+    assert hits[0]['title_highlight'] == 'Купить <mark>молоко</mark>'
+    assert '&lt;у дома&gt;' in hits[0]['snippet']
+
+    result = await app_client.get('/tasks/search', params={'q': 'молоко', 'tag_id': 1})
+    assert [hit['title'] for hit in result.json()['data']] == ['Купить молоко']
+
+    result = await app_client.get('/tasks/search', params={'q': 'молоко', 'limit': 1})
+    page = result.json()
+    result = await app_client.get('/tasks/search', params={'q': 'молоко', 'limit': 1, 'cursor': page['next_cursor']})
+    assert [hit['title'] for hit in result.json()['data']] == ['Позвонить маме']
+
+    result = await app_client.get('/tasks/search')
+    assert result.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_changes(app_client, rep_, tasks_list):
+    changes = (await app_client.get('/tasks/changes')).json()['data']
+    assert [task['id'] for task in changes['tasks']] == [1]
+    assert [project['id'] for project in changes['projects']] == [1]
+    assert changes['next_cursor'] is None
+    since = changes['revision']
+
+    tag = await rep_.create_tag('tag1')
+    await rep_.attach_task_to_tag(1, tag.id)
+    await rep_.getting_done(1)
+    changes = (await app_client.get('/tasks/changes', params={'since': since})).json()['data']
+    assert changes['projects'] == []
+    assert [item['id'] for item in changes['tags']] == [tag.id]
+    assert [(link['task_id'], link['tag_id']) for link in changes['task_tags']] == [(1, tag.id)]
+    assert [(task['id'], task['done']) for task in changes['tasks']] == [(1, True)]
+    link_id = changes['task_tags'][0]['id']
+    assert changes['revision'] > since
+    since = changes['revision']
+
+    await rep_.delete_task(1)
+    changes = (await app_client.get('/tasks/changes', params={'since': since})).json()['data']
+    assert changes['tasks'] == [] and changes['task_tags'] == []
+    assert sorted((item['table'], item['id']) for item in changes['deleted']) == [('task_tags', link_id),
+                                                                                   ('tasks', 1)]
+
+    # Постраничный проход с нуля отдает каждую запись ровно один раз
+    seen, params = [], {'limit': 1}
+    while True:
+        changes = (await app_client.get('/tasks/changes', params=params)).json()['data']
+        seen += [(source, item.get('table'), item['id']) for source in ('projects', 'tags', 'deleted')
+                 for item in changes[source]]
+        if changes['next_cursor'] is None:
+            break
+        params = {'limit': 1, 'cursor': changes['next_cursor']}
+    assert sorted(seen) == [('deleted', 'task_tags', link_id), ('deleted', 'tasks', 1),
+                            ('projects', None, 1), ('tags', None, tag.id)]
+
+
+@requires_postgres
+@pytest.mark.asyncio
+async def test_changes_wait_for_open_transactions(rep_):
+    async with rep_.async_session() as session:
+        async with session.begin():
+            project = await Repository(rep_.async_session, session).create_project(
+                ProjectSchema(title='project1', description=''))
+            # Запись в другую таблицу не ждет открытую транзакцию
+            tag = await asyncio.wait_for(rep_.create_tag('tag1'), 5)
+            # Тег закоммичен, но его ревизия выше ревизии незавершенной транзакции проекта:
+            # отдать его сейчас значило бы потерять проект при следующей синхронизации
+            assert await rep_.get_changes((0, 0, 0), 50) == []
+    changes = await rep_.get_changes((0, 0, 0), 50)
+    assert [(source, item.id) for _, source, _, item in changes] == [(0, project.id), (1, tag.id)]
+
+
+@requires_postgres
+@pytest.mark.asyncio
+async def test_changes_not_cached_behind_open_transaction(app_client, rep_):
+    async with rep_.async_session() as session:
+        async with session.begin():
+            # Транзакция с id, но без записей в таблицы ленты, как у напоминаний
+            await session.execute(text('SELECT pg_current_xact_id()'))
+            await rep_.create_tag('tag1')
+            result = await app_client.get('/tasks/changes')
+            assert result.json()['data']['tags'] == []
+    headers = {'If-None-Match': result.headers.get('ETag', '*')}
+    result = await app_client.get('/tasks/changes', headers=headers)
+    assert result.status_code == 200
+    assert [tag['title'] for tag in result.json()['data']['tags']] == ['tag1']
+
+
+@pytest.mark.asyncio
+async def test_stats_refresh_keeps_concurrent_changes():
+    stats = TaskStats()
+    stats.replace([(None, False, 1)], [])
+
+    class Rep:
+        async def get_versions(self, tables):
+            return {'tasks': 2}
+
+        async def get_task_stats(self):
+            # Коммит во время пересчета уже применил свое изменение, а в снимок не попал
+            stats.change(None, (None, None, False))
+            return [(None, False, 1)], []
+
+    await stats.refresh(Rep())
+    assert stats.project(None) == {'open': 2, 'done': 0}
+
+
+@pytest.mark.asyncio
+async def test_task_stats(app_client, rep_, tasks_list):
+    today = datetime.date.today()
+    for i, my_day_date in enumerate([today, today, None]):
+        await app_client.post('/tasks/', json={'title': f'extra{i}', 'description': '', 'done': False,
+                                               'scheduled_at': None, 'my_day_date': my_day_date and str(my_day_date)})
+    result = await app_client.get('/tasks/stats')
+    stats = result.json()['data']
+    assert stats['projects'] == [{'project_id': 1, 'title': 'project1', 'open': 1, 'done': 0}]
+    assert stats['no_project'] == {'open': 3, 'done': 0}
+    assert stats['my_day'] == {'date': str(today), 'open': 2, 'done': 0}
+
+    await rep_.getting_done(2)
+    await rep_.attach_project_task(3, 1)
+    await rep_.delete_task(4)
+    stats = (await app_client.get('/tasks/stats')).json()['data']
+    assert stats['projects'] == [{'project_id': 1, 'title': 'project1', 'open': 2, 'done': 0}]
+    assert stats['no_project'] == {'open': 0, 'done': 1}
+    assert stats['my_day'] == {'date': str(today), 'open': 1, 'done': 1}
+
+    # Пересчет с нуля сходится со счетчиками, которые обновлялись по изменениям
+    counters = dict(task_stats.by_project), dict(task_stats.by_my_day)
+    task_stats.reset()
+    await task_stats.refresh(rep_)
+    assert (dict(task_stats.by_project), dict(task_stats.by_my_day)) == counters
+
+
+@pytest.mark.asyncio
+async def test_autocomplete_tags(app_client, rep_):
+    body = '\n'.join([
+        '{"title": "a", "description": "", "tags": ["Home"]}',
+        '{"title": "b", "description": "", "tags": ["home office", "work"]}',
+        '{"title": "c", "description": "", "tags": ["home office"]}',
+    ])
+    await app_client.post('/tasks/import', content=body)
+
+    result = await app_client.get('/tasks/tags/autocomplete', params={'prefix': 'HO'})
+    assert result.status_code == 200
+    assert [(tag['title'], tag['usage']) for tag in result.json()['data']] == [('home office', 2), ('Home', 1)]
+
+    tag = await rep_.create_tag('hobby')
+    await rep_.attach_task_to_tag(1, tag.id)
+    await rep_.attach_task_to_tag(2, tag.id)
+    await rep_.attach_task_to_tag(3, tag.id)
+    await rep_.delete_tag(1)
+    result = await app_client.get('/tasks/tags/autocomplete', params={'prefix': 'ho', 'limit': 1})
+    assert [tag['title'] for tag in result.json()['data']] == ['hobby']
+
+    result = await app_client.get('/tasks/tags/autocomplete', params={'prefix': 'ho'})
+    assert [tag['title'] for tag in result.json()['data']] == ['hobby', 'home office']
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('url, max_queries', [
+    ('/tasks/', 3),
+    ('/tasks/1', 3),
+    ('/tasks/projects/', 2),
+    ('/tasks/projects/1', 4),
+    ('/tasks/tasks-by-project/1', 3),
+    ('/tasks/tags/1', 4),
+])
+async def test_query_counts(app_client, rep_, tasks_list, url, max_queries):
+    await rep_.create_tag('tag1')
+    await rep_.attach_task_to_tag(1, 1)
+    repository_cache.clear()
+    with assert_max_queries(max_queries):
+        result = await app_client.get(url, headers={'Accept': 'application/json'})
+    assert result.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_nested_tasks_are_paginated(app_client, rep_, tasks_list):
+    tag = await rep_.create_tag('tag1')
+    await app_client.post('/tasks/', json={'title': 'task2', 'description': '', 'done': False,
+                                           'scheduled_at': None, 'my_day_date': None})
+    await rep_.attach_project_task(2, 1)
+    for task_id in (1, 2):
+        await rep_.attach_task_to_tag(task_id, tag.id)
+
+    for url in ('/tasks/projects/1', f'/tasks/tags/{tag.id}'):
+        titles, params = [], {'limit': 1}
+        while True:
+            result = (await app_client.get(url, params=params)).json()
+            titles += [task['title'] for task in result['data']['tasks']]
+            if result['next_cursor'] is None:
+                break
+            params = {'limit': 1, 'cursor': result['next_cursor']}
+        assert sorted(titles) == ['task1', 'task2']
+
+
+@pytest.mark.asyncio
+async def test_write_missing_task(app_client, rep_, tasks_list):
+    assert (await app_client.post('/tasks/done/100')).status_code == 404
+    assert (await app_client.post('/tasks/undone/100')).status_code == 404
+    assert (await app_client.post('/tasks/projects/100/1')).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_get_tasks_not_modified(app_client, rep_, tasks_list):
+    headers = {'Accept': 'application/json'}
+    result = await app_client.get('/tasks/', headers=headers)
+    etag = result.headers['etag']
+
+    result = await app_client.get('/tasks/', headers={**headers, 'If-None-Match': etag})
+    assert result.status_code == 304
+    assert result.headers['etag'] == etag
+
+    result = await app_client.get('/tasks/', headers={'HX-Request': 'true', 'If-None-Match': etag})
+    assert result.status_code == 200
+    assert result.headers['etag'] != etag
+
+    await app_client.post('/tasks/done/1')
+    result = await app_client.get('/tasks/', headers={**headers, 'If-None-Match': etag})
+    assert result.status_code == 200
+    assert result.headers['etag'] != etag
+
+
+@requires_postgres
+@pytest.mark.asyncio
+async def test_request_transaction_commits_before_response(request_client, rep_):
+    result = await request_client.post('/tasks/projects', json={'title': 'project1', 'description': ''})
+    assert result.status_code == 200
+    assert [project.title for project in await rep_.get_projects()] == ['project1']
+
+    def fail(session):
+        raise RuntimeError('commit failed')
+
+    # Неудачная фиксация должна дойти до клиента, а не потеряться после отправленного 200
+    event.listen(Session, 'before_commit', fail)
+    try:
+        result = await request_client.post('/tasks/projects', json={'title': 'project2', 'description': ''})
+    finally:
+        event.remove(Session, 'before_commit', fail)
+    assert result.status_code == 500
+    repository_cache.clear()
+    assert [project.title for project in await rep_.get_projects()] == ['project1']
@@ -0,0 +1,210 @@
+"""
+Нагрузочный прогон API задач: несколько конкурентных клиентов гоняют взвешенную смесь запросов
+к /tasks/, /tasks/projects/{id} и /tasks/tags/{id} в вариантах JSON и HTMX и считают
+пропускную способность и p50/p95/p99 по каждому маршруту.
+
+Приложение поднимается в том же процессе (по умолчанию) или берется по адресу --url.
+Нужен Postgres: локальный из docker-compose через DATABASE_URL или временный контейнер
+(--testcontainer, образ должен быть скачан заранее, если сети нет). Результат - JSON,
+который можно сравнить с прошлым прогоном через --baseline.
+
+    python -m benchmarks.load --testcontainer --seed --tasks 100000 --concurrency 16 --duration 30 \
+        --output results.json
+    python -m benchmarks.load --url http://localhost:8000 --duration 30 --baseline results.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import Callable
+
+import httpx
+
+from benchmarks.seed import seed, add_arguments as add_seed_arguments
+
+JSON_HEADERS = {'Accept': 'application/json'}
+HTMX_HEADERS = {'Accept': 'text/html', 'HX-Request': 'true'}
+
+
+@dataclass
+class Scenario:
+    name: str
+    weight: int
+    path: Callable[[random.Random, argparse.Namespace], str]
+    headers: dict[str, str]
+
+
+SCENARIOS = [
+    Scenario('GET /tasks/ json', 30, lambda rnd, args: '/tasks/', JSON_HEADERS),
+    Scenario('GET /tasks/ htmx', 20, lambda rnd, args: '/tasks/', HTMX_HEADERS),
+    Scenario('GET /tasks/projects/{id} json', 15,
+             lambda rnd, args: f'/tasks/projects/{rnd.randint(1, args.projects)}', JSON_HEADERS),
+    Scenario('GET /tasks/projects/{id} htmx', 10,
+             lambda rnd, args: f'/tasks/projects/{rnd.randint(1, args.projects)}', HTMX_HEADERS),
+    Scenario('GET /tasks/tags/{id} json', 15,
+             lambda rnd, args: f'/tasks/tags/{rnd.randint(1, args.tags)}', JSON_HEADERS),
+    Scenario('GET /tasks/tags/{id} htmx', 10,
+             lambda rnd, args: f'/tasks/tags/{rnd.randint(1, args.tags)}', HTMX_HEADERS),
+]
+
+
+def percentile(values: list[float], p: float) -> float:
+    """
+    Перцентиль по ближайшему рангу на отсортированном списке
+    """
+    if not values:
+        return 0.0
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict[str, float]:
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+async def client_loop(client: httpx.AsyncClient, args: argparse.Namespace, worker: int, deadline: float,
+                      latencies: dict[str, list[float]], errors: dict[str, int]):
+    rnd = random.Random(args.random_seed + worker)
+    weights = [scenario.weight for scenario in SCENARIOS]
+    while time.perf_counter() < deadline:
+        scenario = rnd.choices(SCENARIOS, weights)[0]
+        path = scenario.path(rnd, args)
+        started = time.perf_counter()
+        try:
+            response = await client.get(path, headers=scenario.headers)
+            ok = response.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        elapsed = time.perf_counter() - started
+        if ok:
+            latencies[scenario.name].append(elapsed)
+        else:
+            errors[scenario.name] += 1
+
+
+async def run(client: httpx.AsyncClient, args: argparse.Namespace) -> dict:
+    if args.warmup:
+        warmup_deadline = time.perf_counter() + args.warmup
+        await asyncio.gather(*(client_loop(client, args, worker, warmup_deadline, defaultdict(list), defaultdict(int))
+                               for worker in range(args.concurrency)))
+
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(*(client_loop(client, args, worker, deadline, latencies, errors)
+                           for worker in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    routes = {scenario.name: summarize(latencies[scenario.name], errors[scenario.name], elapsed)
+              for scenario in SCENARIOS}
+    total = summarize([value for values in latencies.values() for value in values], sum(errors.values()), elapsed)
+    return {'routes': routes, 'total': total}
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result: dict, baseline: dict) -> dict[str, dict[str, float]]:
+    """
+    Относительное изменение rps и перцентилей к прошлому прогону, в процентах
+    """
+    diff = {}
+    for name, current in {**result['routes'], 'total': result['total']}.items():
+        previous = baseline['total'] if name == 'total' else baseline['routes'].get(name)
+        if not previous:
+            continue
+        diff[name] = {key: round((current[key] - previous[key]) / previous[key] * 100, 1)
+                      for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms') if previous[key]}
+    return diff
+
+
+async def main(args: argparse.Namespace):
+    with ExitStack() as stack:
+        if args.testcontainer:
+            from testcontainers.postgres import PostgresContainer
+
+            postgres = stack.enter_context(PostgresContainer('postgres:14.9-alpine3.18'))
+            postgres.driver = 'asyncpg'
+            os.environ['DATABASE_URL'] = postgres.get_connection_url()
+
+        seeded = None
+        if args.seed:
+            from sqlalchemy.ext.asyncio import create_async_engine
+
+            engine = create_async_engine(os.environ['DATABASE_URL'])
+            try:
+                seeded = await seed(engine, args.projects, args.tags, args.tasks, args.tags_per_task)
+            finally:
+                await engine.dispose()
+
+        if args.url:
+            client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout,
+                                       limits=httpx.Limits(max_connections=args.concurrency))
+        else:
+            # Приложение импортируется только здесь, чтобы движок увидел DATABASE_URL контейнера
+            from app.main import app
+
+            client = httpx.AsyncClient(app=app, base_url='http://benchmark', timeout=args.timeout)
+        async with client:
+            result = await run(client, args)
+
+    report = {
+        'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'machine': platform.platform(),
+        'target': args.url or 'in-process',
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'seed': seeded,
+        **result,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['change_percent'] = compare(result, json.load(f))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', help='адрес запущенного сервиса; без него приложение поднимается в процессе')
+    parser.add_argument('--testcontainer', action='store_true', help='поднять временный Postgres в docker')
+    parser.add_argument('--seed', action='store_true', help='пересоздать схему и залить данные перед прогоном')
+    add_seed_arguments(parser)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--random-seed', type=int, default=0)
+    parser.add_argument('--output')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,57 @@
+"""
+Замеряет накладные расходы MetricsMiddleware и хуков движка на один запрос:
+пустое ASGI-приложение с middleware и без него, плюс одна запись в гистограмму SQL.
+
+    python -m benchmarks.metrics_overhead --requests 100000
+"""
+import argparse
+import asyncio
+import time
+
+from app.metrics import MetricsMiddleware, registry, statement_duration, statement_rows
+
+
+class Route:
+    path = '/tasks/{id_}'
+
+
+async def endpoint(scope, receive, send):
+    scope['route'] = Route
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b'{"data":null}'})
+
+
+async def receive():
+    return {'type': 'http.request', 'body': b''}
+
+
+async def send(message):
+    pass
+
+
+async def run(app, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        await app({'type': 'http', 'method': 'GET', 'path': '/tasks/1'}, receive, send)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=100000)
+    args = parser.parse_args()
+
+    registry.enabled = True
+    bare = asyncio.run(run(endpoint, args.requests))
+    instrumented = asyncio.run(run(MetricsMiddleware(endpoint), args.requests))
+    print(f'middleware: {(instrumented - bare) / args.requests * 1e6:.2f} us per request')
+
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        statement_duration.observe(0.0012, 'SELECT')
+        statement_rows.observe(50, 'SELECT')
+    print(f'statement hooks: {(time.perf_counter() - start) / args.requests * 1e6:.2f} us per statement')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Сравнивает CPU на сериализацию списка задач: старый путь через ResponseWithHeaders
+(валидация конверта, dict-дамп FastAPI, json.dumps) и новый через render (model_dump_json).
+
+    python -m benchmarks.render_pipeline --tasks 10000 --repeat 20
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import time
+from typing import Generic, Mapping, TypeVar
+
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from pydantic import BaseModel
+
+from app.helpers import PageEnvelope
+from app.tasks.serializers import TaskSchema, TagSchema
+
+T = TypeVar('T')
+
+
+class ResponseWithHeaders(BaseModel, Generic[T]):
+    data: T
+    headers: Mapping[str, str]
+
+
+HEADERS = {'host': 'localhost', 'accept': 'application/json', 'user-agent': 'benchmark'}
+
+
+def make_tasks(count: int) -> list[TaskSchema]:
+    created_at = datetime.datetime(2023, 1, 1)
+    tags = [TagSchema(id=1, title='work', description='work'), TagSchema(id=2, title='home', description='home')]
+    return [
+        TaskSchema(id=i, title=f'task {i}', description='description ' * 4, done=i % 3 == 0,
+                   created_at=created_at + datetime.timedelta(minutes=i), scheduled_at=None,
+                   my_day_date=datetime.date(2023, 1, 1 + i % 28), project_id=1 + i % 10, tags=tags[:i % 3])
+        for i in range(count)
+    ]
+
+
+async def old_pipeline(tasks: list[TaskSchema], field) -> bytes:
+    envelope = ResponseWithHeaders(data=tasks, headers=HEADERS)
+    content = await serialize_response(field=field, response_content=envelope)
+    del content['headers']
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(',', ':')).encode('utf-8')
+
+
+async def new_pipeline(tasks: list[TaskSchema], envelope_class) -> bytes:
+    return envelope_class.model_construct(data=tasks, next_cursor=None).model_dump_json().encode('utf-8')
+
+
+async def measure(pipeline, tasks, arg, repeat: int) -> float:
+    await pipeline(tasks, arg)
+    started = time.process_time()
+    for _ in range(repeat):
+        await pipeline(tasks, arg)
+    return (time.process_time() - started) / repeat
+
+
+async def main(count: int, repeat: int):
+    tasks = make_tasks(count)
+    field = create_response_field(name='response', type_=ResponseWithHeaders[list[TaskSchema]])
+    envelope_class = PageEnvelope[list[TaskSchema]]
+    old = await measure(old_pipeline, tasks, field, repeat)
+    new = await measure(new_pipeline, tasks, envelope_class, repeat)
+    old_body = json.loads(await old_pipeline(tasks, field))
+    new_body = json.loads(await new_pipeline(tasks, envelope_class))
+    assert old_body['data'] == new_body['data'], 'wire format differs'
+    print(json.dumps({
+        'tasks': count,
+        'old_cpu_ms': round(old * 1000, 2),
+        'new_cpu_ms': round(new * 1000, 2),
+        'saved_cpu_ms': round((old - new) * 1000, 2),
+        'speedup': round(old / new, 1),
+    }))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.tasks, args.repeat))